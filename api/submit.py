@@ -1,22 +1,151 @@
 import os
+import sys
 import json
-from http.server import HTTPStatus
-import psycopg2
-from psycopg2.extras import Json
-from dotenv import load_dotenv
+import time
 
-load_dotenv()
+_IMPORT_START = time.perf_counter()
+
+if not os.getenv("DATABASE_URL"):
+    # Local development; deployed functions get their environment from the platform
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Warm invocations reuse the connection; one idle longer than this is pinged before use
+DB_LIVENESS_INTERVAL = float(os.getenv("DB_LIVENESS_INTERVAL") or 30)
+SUBMIT_UPSERT = (os.getenv("SUBMIT_UPSERT") or "").strip().lower() in ("1", "true", "yes", "on")
+
+# Keep in sync with UPSERT_KEY_SQL / UPSERT_PREDICATE_SQL in backend/app.py
+UPSERT_KEY_SQL = "(data->'student'->>'rollNumber'), (data->'student'->>'semester'), academic_year"
+UPSERT_PREDICATE_SQL = "COALESCE(data->'student'->>'rollNumber', '') <> ''"
+
+# New submissions feed the same score sketches as the Flask /submit (backend/sketches.py), and
+# written rows are graded with the same rule sets (backend/grading.py), reloaded this often
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+SCORE_SKETCHES = (os.getenv("SCORE_SKETCHES") or "1").strip().lower() in ("1", "true", "yes", "on")
+GRADING_RULES_TTL = float(os.getenv("GRADING_RULES_TTL") or 60)
+
+
+def _backend(name):
+    """Import a module of backend/ (deferred like psycopg2, so preflights skip it)."""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return __import__(name)
+
+
+def _savepoint(cur, name, step, *args):
+    """Run step(cur, *args) under a savepoint; a failure is logged and never fails the submission."""
+    cur.execute(f"SAVEPOINT {name};")
+    try:
+        result = step(cur, *args)
+        cur.execute(f"RELEASE SAVEPOINT {name};")
+        return result
+    except Exception as e:
+        cur.execute(f"ROLLBACK TO SAVEPOINT {name};")
+        print(f"{name} failed: {e}", file=sys.stderr)
+        return None
+
+
+def _header(request, name):
+    headers = getattr(request, "headers", None) or {}
+    value = headers.get(name) or headers.get(name.lower())
+    return (value or "").strip() or None
+
+
+# Module state survives between invocations of a warm function instance
+_conn = None
+_conn_used = 0.0
+_cold = True
+_rulebook = None
+_rulebook_loaded = 0.0
+
+
+def _discard_conn():
+    global _conn
+    if _conn is not None:
+        try:
+            _conn.close()
+        except Exception:
+            pass
+    _conn = None
+
+
+def _get_conn():
+    """Return the instance's connection, reconnecting when it is closed or fails a ping."""
+    global _conn
+    import psycopg2  # deferred so OPTIONS preflights on a cold instance skip it
+
+    if _conn is not None and not _conn.closed:
+        if time.monotonic() - _conn_used < DB_LIVENESS_INTERVAL:
+            return _conn
+        try:
+            cur = _conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            _conn.rollback()
+            return _conn
+        except psycopg2.Error:
+            _discard_conn()
+    _conn = psycopg2.connect(DATABASE_URL, connect_timeout=5, keepalives=1, keepalives_idle=30)
+    return _conn
+
+
+def _release_conn(failed):
+    """Keep the connection for the next invocation unless it is no longer usable."""
+    global _conn_used
+    if _conn is None:
+        return
+    if failed:
+        try:
+            _conn.rollback()
+        except Exception:
+            _discard_conn()
+            return
+    if _conn.closed:
+        _discard_conn()
+    else:
+        _conn_used = time.monotonic()
+
+
+def _rules(cur, payload):
+    """(rule id, rules) of the submission's university, from the instance's cached rule book."""
+    global _rulebook, _rulebook_loaded
+    grading = _backend("grading")
+    if _rulebook is None or time.monotonic() - _rulebook_loaded > GRADING_RULES_TTL:
+        _rulebook = grading.load(cur)
+        _rulebook_loaded = time.monotonic()
+    student = payload.get("student") if isinstance(payload, dict) else None
+    rule_id, _version, rules = _rulebook.lookup(student.get("universityName") if isinstance(student, dict) else None)
+    return rule_id, rules
+
+
+def _record_sketches(cur, payload):
+    """Add a new submission to its cohort's score sketches; imported here so an import failure stays in the savepoint."""
+    return _backend("sketches").record(cur, payload)
+
+
+def _record_grade(cur, submission_id, payload):
+    """Grade a written submission and store it in the same transaction, as app._record_grade does."""
+    grading = _backend("grading")
+    rule_id, rules = _rules(cur, payload)
+    result = grading.grade(payload, rules)
+    if result is not None and rule_id is not None:
+        grading.store(cur, submission_id, rule_id, result)
+    return result
+
 
 def handler(request):
     """Vercel serverless function to handle POST /api/submit"""
+    global _cold
     
     # CORS headers
     headers = {
         "Access-Control-Allow-Origin": "*",
         "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization, Idempotency-Key, X-Upsert",
         "Content-Type": "application/json"
     }
     
@@ -58,30 +187,81 @@ def handler(request):
                 "body": json.dumps({"error": "DATABASE_URL not configured"})
             }
         
-        # Insert into database
-        conn = psycopg2.connect(DATABASE_URL)
+        idempotency_key = _header(request, "Idempotency-Key")
+        upsert_header = _header(request, "X-Upsert")
+        upsert = upsert_header.lower() in ("1", "true", "yes", "on") if upsert_header else SUBMIT_UPSERT
+        student = payload.get("student") or {}
+        roll = str(student.get("rollNumber") or "").strip()
+        academic_year = str(student.get("academicYear") or "").strip()
+
+        cold, _cold = _cold, False
+        start = time.perf_counter()
+        conn = _get_conn()
+        connected = time.perf_counter()
         cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO submissions (data) VALUES (%s) RETURNING id, created_at;",
-            (Json(payload),)
-        )
-        row = cur.fetchone()
+        body = json.dumps(payload)
+        row = None
+        wrote = True
+        if idempotency_key:
+            cur.execute(
+                "SELECT id, created_at, FALSE FROM submissions WHERE idempotency_key=%s;",
+                (idempotency_key,)
+            )
+            row = cur.fetchone()
+            wrote = row is None
+        if row is None and upsert and roll:
+            cur.execute(
+                "INSERT INTO submissions (data, academic_year, idempotency_key) VALUES (%s::jsonb, %s, %s) "
+                f"ON CONFLICT ({UPSERT_KEY_SQL}) WHERE {UPSERT_PREDICATE_SQL} DO UPDATE SET "
+                "data = EXCLUDED.data, "
+                "idempotency_key = COALESCE(EXCLUDED.idempotency_key, submissions.idempotency_key) "
+                "RETURNING id, created_at, (created_at = now());",
+                (body, academic_year, idempotency_key)
+            )
+            row = cur.fetchone()
+        elif row is None:
+            cur.execute(
+                "INSERT INTO submissions (data, academic_year, idempotency_key) VALUES (%s::jsonb, %s, %s) "
+                "ON CONFLICT (idempotency_key, academic_year) DO NOTHING RETURNING id, created_at, TRUE;",
+                (body, academic_year, idempotency_key)
+            )
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(
+                    "SELECT id, created_at, FALSE FROM submissions WHERE idempotency_key=%s;",
+                    (idempotency_key,)
+                )
+                row = cur.fetchone()
+                wrote = False
+        if row[2] and SCORE_SKETCHES:
+            _savepoint(cur, "score_sketches", _record_sketches, payload)
+        grade = _savepoint(cur, "submission_grade", _record_grade, row[0], payload) if wrote else None
         conn.commit()
         cur.close()
-        conn.close()
-        
+        _release_conn(failed=False)
+
+        # Server-Timing shows whether an invocation paid for the cold start or a reconnect
+        timing = f"connect;dur={(connected - start) * 1000:.1f}, db;dur={(time.perf_counter() - connected) * 1000:.1f}"
+        if cold:
+            timing = f"import;dur={_IMPORT_MS:.1f}, " + timing
         return {
-            "statusCode": 201,
-            "headers": headers,
+            "statusCode": 201 if row[2] else 200,
+            "headers": {**headers, "Server-Timing": timing},
             "body": json.dumps({
                 "id": row[0],
-                "created_at": row[1].isoformat()
+                "created_at": row[1].isoformat(),
+                "created": bool(row[2]),
+                "grade": grade
             })
         }
     
     except Exception as e:
+        _release_conn(failed=True)
         return {
             "statusCode": 500,
             "headers": headers,
             "body": json.dumps({"error": str(e)})
         }
+
+
+_IMPORT_MS = (time.perf_counter() - _IMPORT_START) * 1000
@@ -3,14 +3,40 @@ import json
 import jwt
 import io
 import base64
+import hmac
+import hashlib
+import functools
+import contextlib
+import importlib.util
+import threading
+import time
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, make_response, g, has_request_context
 from flask import send_from_directory, abort
+from werkzeug.utils import safe_join
 from flask_cors import CORS
 import psycopg2
 from psycopg2.extras import Json
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import metrics
+import profiling
+import compression
+import cube
+import email_templates
+import grading
+import http_sessions
+import mail_scheduler
+import auth_context
+import db_router
+import password_hashing
+import query_log
+import request_capture
+import sketches
+import subject_catalog
+import trends
+from json_provider import FastJSONProvider
 
 load_dotenv()
 
@@ -19,120 +45,462 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_KEY")
 
-use_supabase = False
-supabase = None
-if SUPABASE_URL and SUPABASE_SERVICE_KEY:
-    try:
-        from supabase import create_client
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-        use_supabase = True
-    except Exception:
-        use_supabase = False
+# The supabase client is imported and created on first use (_supabase()), so processes that
+# never touch it -- and every cold start -- skip the import and the client setup.
+use_supabase = bool(SUPABASE_URL and SUPABASE_SERVICE_KEY) and importlib.util.find_spec("supabase") is not None
+_supabase_client = None
+_supabase_lock = threading.Lock()
+
+
+def _supabase():
+    global _supabase_client
+    if _supabase_client is None:
+        with _supabase_lock:
+            if _supabase_client is None:
+                from supabase import create_client
+                _supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return _supabase_client
+
 
 if not use_supabase and not DATABASE_URL:
     raise RuntimeError("Please set DATABASE_URL or SUPABASE_URL + SUPABASE_SERVICE_KEY environment variables (see .env.example)")
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
+metrics.init_app(app)
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Shared secret for operator-only endpoints and headers (sent as X-Admin-Token)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def _is_admin():
+    supplied = request.headers.get("X-Admin-Token") or ""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, ADMIN_TOKEN)
+
+
+profiling.init_app(app, _is_admin)
+request_capture.init_app(app)
+# Registered last: after_request hooks run in reverse, so compression time counts toward request latency
+compression.init_app(app)
 
 # JWT secret
 JWT_SECRET = os.getenv("JWT_SECRET") or os.getenv("SECRET_KEY") or "dev-secret"
 
-def _create_token(user_id: int):
+def _create_token(user_id: int, profile=None):
+    """Sign a 24h token; `profile` (the /auth/me body) is embedded when AUTH_EMBED_PROFILE is on."""
+    now = datetime.utcnow()
     payload = {
         "user_id": int(user_id),
-        "exp": datetime.utcnow() + timedelta(hours=24)
+        "iat": now,
+        "exp": now + timedelta(hours=24)
     }
+    if profile and auth_context.AUTH_EMBED_PROFILE:
+        payload["profile"] = profile
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-def _decode_token(token: str):
+def _verify_token(token: str):
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
         return payload
     except Exception:
         return None
 
-def get_conn():
-    return psycopg2.connect(DATABASE_URL)
+def _decode_token(token: str):
+    """Verified claims of `token` (cached by token hash, see auth_context), or None."""
+    return auth_context.claims(token, _verify_token)
+
+def _user_profile(row):
+    """/auth/me body from an (id, name, email, created_at) users row."""
+    created = row[3]
+    return {"id": row[0], "name": row[1], "email": row[2],
+            "created_at": created.isoformat() if hasattr(created, "isoformat") else created}
+
+def _statement_kind(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    head = str(query).lstrip().split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+
+class _TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that records execution time of every statement in metrics.DB_QUERY
+    and query_log (slow-query log, per-statement totals, sampled EXPLAIN plans).
+    """
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = super().execute(query, vars)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            kind = _statement_kind(query)
+            metrics.DB_QUERY.observe(elapsed, kind)
+            if query_log.record(query, vars, elapsed, self.rowcount):
+                metrics.DB_SLOW_QUERIES.inc(kind)
+                if ok and isinstance(query, str) and query_log.should_explain(query):
+                    self._explain(query, vars)
+
+    def _explain(self, query, vars):
+        """Re-run a slow SELECT under EXPLAIN ANALYZE inside a savepoint that is always rolled back:
+        ANALYZE really executes the statement, so its side effects (nextval, inserts by volatile
+        functions, advisory locks) must not stay in the caller's transaction, and a failure cannot
+        abort it.  Results of the original query were already fetched.
+        """
+        if self.connection.autocommit or self.connection.closed:
+            return
+        cur = psycopg2.extensions.cursor(self.connection)
+        try:
+            cur.execute("SAVEPOINT query_log_explain;")
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error:
+                plan = None
+            cur.execute("ROLLBACK TO SAVEPOINT query_log_explain;")
+            cur.execute("RELEASE SAVEPOINT query_log_explain;")
+            if plan is not None:
+                query_log.attach_plan(query, plan)
+        except psycopg2.Error:
+            pass
+        finally:
+            cur.close()
+
+
+# Optional read replicas (DATABASE_REPLICA_URLS) for read-only queries
+router = db_router.ReplicaRouter(DATABASE_URL, os.getenv("DATABASE_REPLICA_URLS"))
+
+
+def _request_user_id():
+    auth = request.headers.get("Authorization")
+    if auth and auth.startswith("Bearer "):
+        decoded = _decode_token(auth.split(" ", 1)[1].strip())
+        if decoded and decoded.get("user_id"):
+            return int(decoded.get("user_id"))
+    return None
+
+
+def _read_url():
+    """Database URL for read-only queries.
+    Chosen once per request so the ETag validator and the query see the same server,
+    and pinned to the primary for users who just wrote (read-your-writes).
+    """
+    if not router.replicas:
+        return DATABASE_URL
+    if not has_request_context():
+        return router.read_url()
+    url = g.get("_read_url")
+    if url is None:
+        url = DATABASE_URL if router.recent_writer(_request_user_id()) else router.read_url()
+        g._read_url = url
+    return url
+
+
+def get_conn(readonly=False):
+    """Open a connection; readonly=True may be served by a replica."""
+    url = _read_url() if readonly else DATABASE_URL
+    if readonly and router.replicas:
+        metrics.DB_READ_ROUTE.inc("primary" if url == DATABASE_URL else "replica")
+    with metrics.DB_CONNECT.time():
+        try:
+            return psycopg2.connect(url, cursor_factory=_TimedCursor)
+        except psycopg2.OperationalError:
+            if url == DATABASE_URL:
+                raise
+            router.mark_failed(url)
+            if has_request_context():
+                g._read_url = DATABASE_URL
+            return psycopg2.connect(DATABASE_URL, cursor_factory=_TimedCursor)
 
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({"status":"ok"})
 
-@app.route("/submit", methods=["POST"])
-def submit():
-    try:
-        payload = request.get_json(force=True)
-        if payload is None:
-            return jsonify({"error":"invalid json"}), 400
-        # try to resolve user from Authorization header
-        user_id = None
-        auth = request.headers.get("Authorization")
-        if auth and auth.startswith("Bearer "):
-            token = auth.split(" ", 1)[1].strip()
-            decoded = _decode_token(token)
-            if decoded and decoded.get("user_id"):
-                user_id = int(decoded.get("user_id"))
-
-        # If Supabase client available, insert using Supabase (server-side key)
-        if use_supabase and supabase is not None:
-            # Insert as a JSON object into `submissions` table's `data` column
-            insert_obj = {"data": payload}
-            if user_id:
-                insert_obj["user_id"] = user_id
-            resp = supabase.table("submissions").insert(insert_obj).execute()
-            # resp returns a tuple-like object in some versions
-            if hasattr(resp, "error") and resp.error:
-                return jsonify({"error": str(resp.error)}), 500
-            # Try to extract inserted id and created_at if present
-            data = None
-            try:
-                data = resp.data or resp["data"]
-            except Exception:
-                data = None
-            return jsonify({"ok": True, "data": data}), 201
 
-        # Fallback: direct Postgres
-        conn = get_conn()
-        cur = conn.cursor()
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
+    if not _is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(profiling.list_profiles())
+
+
+@app.route("/admin/profiles/<path:filename>", methods=["GET"])
+def download_profile(filename):
+    if not _is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    path = safe_join(profiling.PROFILE_DIR, filename)  # None for names that leave the directory
+    if path is None or not os.path.isfile(path):
+        return abort(404)
+    return send_from_directory(profiling.PROFILE_DIR, filename, as_attachment=True)
+
+
+@app.route("/admin/queries", methods=["GET", "DELETE"])
+def query_stats():
+    """Statements ranked by total time (?order=mean|max|calls, ?limit=N); DELETE resets the counters."""
+    if not _is_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    if request.method == "DELETE":
+        query_log.reset()
+        return jsonify({"reset": True})
+    limit = min(int(request.args.get("limit") or 20), 500)
+    return jsonify({
+        "slow_query_ms": query_log.SLOW_QUERY_MS,
+        "queries": query_log.top(limit, request.args.get("order") or "total"),
+    })
+
+# Idempotency / upsert support for /submit.
+# Clients send an `Idempotency-Key` header so retries and repeated "Save" clicks
+# return the original row instead of inserting a copy.  Upsert mode (query
+# `?upsert=1`, header `X-Upsert: 1`, or SUBMIT_UPSERT=1 in env) replaces the
+# existing row for the same (rollNumber, semester, academicYear).
+SUBMIT_UPSERT = (os.getenv("SUBMIT_UPSERT") or "").strip().lower() in ("1", "true", "yes", "on")
+
+# New submissions are added to per-cohort score sketches (sketches.py) for percentile ranks;
+# PDF_PERCENTILE_LINE adds the student's cohort percentile to generated PDFs.
+SCORE_SKETCHES = (os.getenv("SCORE_SKETCHES") or "1").strip().lower() in ("1", "true", "yes", "on")
+PDF_PERCENTILE_LINE = (os.getenv("PDF_PERCENTILE_LINE") or "1").strip().lower() in ("1", "true", "yes", "on")
+
+# Grading rule sets (grading.py) are reloaded at most this often; /submit stores each new grade
+GRADING_RULES_TTL = float(os.getenv("GRADING_RULES_TTL") or 60)
+_rulebook_cache = auth_context.TTLCache(1, GRADING_RULES_TTL)
+
+# Must match the expression index created by dedup_submissions.py exactly,
+# otherwise Postgres cannot infer the arbiter index for ON CONFLICT.  Unique
+# indexes on a partitioned table must contain the partition key as a plain
+# column, hence academic_year rather than the JSON expression.
+UPSERT_KEY_SQL = "(data->'student'->>'rollNumber'), (data->'student'->>'semester'), academic_year"
+UPSERT_PREDICATE_SQL = "COALESCE(data->'student'->>'rollNumber', '') <> ''"
+
+
+def _truthy(value, default=False):
+    if value is None or value == "":
+        return default
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _academic_year(payload):
+    """Value for the academic_year column (the partition key); '' when the form has none."""
+    student = payload.get("student") if isinstance(payload, dict) else None
+    return str((student or {}).get("academicYear") or "").strip()
+
+
+def _upsert_key(payload):
+    """Return (rollNumber, semester, academicYear) as strings, or None when rollNumber is blank."""
+    student = payload.get("student") if isinstance(payload, dict) else None
+    student = student or {}
+    roll = str(student.get("rollNumber") or "").strip()
+    if not roll:
+        return None
+    sem = student.get("semester")
+    return (roll, "" if sem is None else str(sem), _academic_year(payload))
+
+
+def _insert_submission(payload, user_id=None, idempotency_key=None, upsert=False):
+    """Store a submission and return (id, created_at, created, grade).
+    `created` is False when an idempotent replay or an upsert matched an existing row;
+    `grade` is the stored grade (see grading.py) of a row written now, else None.
+    """
+    if use_supabase:
+        table = _supabase().table("submissions")
+        if idempotency_key:
+            resp = table.select("id,created_at").eq("idempotency_key", idempotency_key).execute()
+            if resp.data:
+                return resp.data[0].get("id"), resp.data[0].get("created_at"), False, None
+        insert_obj = {"data": payload, "academic_year": _academic_year(payload)}
         if user_id:
-            cur.execute("INSERT INTO submissions (data, user_id) VALUES (%s, %s) RETURNING id, created_at;", (Json(payload), user_id))
+            insert_obj["user_id"] = user_id
+        if idempotency_key:
+            insert_obj["idempotency_key"] = idempotency_key
+        key = _upsert_key(payload) if upsert else None
+        if key:
+            resp = (table.select("id,created_at")
+                    .eq("data->student->>rollNumber", key[0])
+                    .eq("data->student->>semester", key[1])
+                    .eq("academic_year", key[2])
+                    .limit(1).execute())
+            if resp.data:
+                existing = resp.data[0]
+                table.update(insert_obj).eq("id", existing.get("id")).execute()
+                return existing.get("id"), existing.get("created_at"), False, _grade(payload)
+        resp = table.insert(insert_obj).execute()
+        if hasattr(resp, "error") and resp.error:
+            raise RuntimeError(str(resp.error))
+        row = (resp.data or [{}])[0]
+        return row.get("id"), row.get("created_at"), True, _grade(payload)
+
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        if idempotency_key:
+            cur.execute("SELECT id, created_at FROM submissions WHERE idempotency_key=%s", (idempotency_key,))
+            existing = cur.fetchone()
+            if existing:
+                return existing[0], existing[1], False, None
+
+        wrote = True
+        if upsert and _upsert_key(payload):
+            # created_at defaults to now() and is never updated, so it tells inserts from updates
+            # (xmax cannot be read from a partitioned table)
+            cur.execute(
+                f"INSERT INTO submissions (data, academic_year, user_id, idempotency_key) VALUES (%s, %s, %s, %s) "
+                f"ON CONFLICT ({UPSERT_KEY_SQL}) WHERE {UPSERT_PREDICATE_SQL} DO UPDATE SET "
+                "data = EXCLUDED.data, "
+                "user_id = COALESCE(EXCLUDED.user_id, submissions.user_id), "
+                "idempotency_key = COALESCE(EXCLUDED.idempotency_key, submissions.idempotency_key) "
+                "RETURNING id, created_at, (created_at = now());",
+                (Json(payload), _academic_year(payload), user_id, idempotency_key),
+            )
+            row = cur.fetchone()
         else:
-            cur.execute("INSERT INTO submissions (data) VALUES (%s) RETURNING id, created_at;", (Json(payload),))
-        row = cur.fetchone()
+            cur.execute(
+                "INSERT INTO submissions (data, academic_year, user_id, idempotency_key) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (idempotency_key, academic_year) DO NOTHING RETURNING id, created_at, TRUE;",
+                (Json(payload), _academic_year(payload), user_id, idempotency_key),
+            )
+            row = cur.fetchone()
+            if row is None:
+                # A concurrent request with the same key won the race
+                cur.execute("SELECT id, created_at, FALSE FROM submissions WHERE idempotency_key=%s", (idempotency_key,))
+                row = cur.fetchone()
+                wrote = False
+        if row[2]:
+            _record_sketches(cur, payload)
+        grade = _record_grade(cur, row[0], payload) if wrote else None
         conn.commit()
+        return row[0], row[1], bool(row[2]), grade
+    finally:
         cur.close()
         conn.close()
 
-        return jsonify({"id": row[0], "created_at": row[1].isoformat()}), 201
+
+def _record_sketches(cur, payload):
+    """Add a new submission to its cohort's score sketches; never fails the submission."""
+    if not SCORE_SKETCHES:
+        return
+    try:
+        cur.execute("SAVEPOINT score_sketches;")
+    except psycopg2.Error:
+        return
+    try:
+        sketches.record(cur, payload)
+        cur.execute("RELEASE SAVEPOINT score_sketches;")
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        cur.execute("ROLLBACK TO SAVEPOINT score_sketches;")
+        app.logger.warning("score sketch update failed: %s", e)
 
 
-def _fetch_rows(filters=None, limit=None, offset=None):
-    """Return list of tuples (id, data_dict, created_at).
-    Supports either direct Postgres (psycopg2) or Supabase client.
+def _rulebook(version=None):
+    """Current grading rule sets (grading.RuleBook), cached for GRADING_RULES_TTL seconds.
+    Reloaded early when the data version (`version`, or the one this request already read) has moved
+    on since the load, as publishing a rule set bumps it.  While the database is unreachable the last
+    rules loaded (or the built-in ones) apply, so PDFs and emails still render.
     """
-    if use_supabase and supabase is not None:
-        # Supabase: fetch and return the raw rows
+    if version is None and has_request_context():
+        version = g.get("_data_version")
+    counter = version[0] if version else None
+    cached = _rulebook_cache.get("rules")
+    if cached is not None and (counter is None or cached[0] == counter):
+        return cached[1]
+    if use_supabase:
+        book = grading.RuleBook()
+    else:
         try:
-            resp = supabase.table("submissions").select("id,data,created_at").order("created_at", desc=True).execute()
-            rows = resp.data if hasattr(resp, "data") else resp
-            normalized = []
-            for r in rows:
-                normalized.append((r.get("id"), r.get("data"), r.get("created_at")))
-            return normalized
-        except Exception:
-            return []
+            conn = get_conn(readonly=True)
+            try:
+                cur = conn.cursor()
+                book = grading.load(cur)
+                cur.close()
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            app.logger.warning("grading rules unavailable, using the defaults: %s", e)
+            if cached is not None:
+                return cached[1]
+            return grading.RuleBook()  # not cached: the next call tries the database again
+    _rulebook_cache.set("rules", (counter, book))
+    return book
 
-    conn = get_conn()
-    cur = conn.cursor()
+
+def _university(payload):
+    student = payload.get("student") if isinstance(payload, dict) else None
+    return student.get("universityName") if isinstance(student, dict) else None
+
+
+def _grade(payload, rulebook=None):
+    """Grade of a submission under its university's current rules, without storing it."""
+    return grading.grade(payload, (rulebook or _rulebook()).lookup(_university(payload))[2])
+
+
+def _record_grade(cur, submission_id, payload):
+    """Grade a written submission and store the grade in the same transaction; never fails the submission."""
+    try:
+        rule_id, _version, rules = _rulebook().lookup(_university(payload))
+        result = grading.grade(payload, rules)
+    except Exception as e:
+        app.logger.warning("grading failed: %s", e)
+        return None
+    if result is None or rule_id is None:
+        return result
+    try:
+        cur.execute("SAVEPOINT submission_grade;")
+    except psycopg2.Error:
+        return result
+    try:
+        grading.store(cur, submission_id, rule_id, result)
+        cur.execute("RELEASE SAVEPOINT submission_grade;")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT submission_grade;")
+        app.logger.warning("storing grade failed: %s", e)
+    return result
+
+
+@app.route("/submit", methods=["POST"])
+def submit():
+    try:
+        payload = request.get_json(force=True)
+        if payload is None:
+            return jsonify({"error":"invalid json"}), 400
+        # try to resolve user from Authorization header
+        user_id = _request_user_id()
+
+        idempotency_key = (request.headers.get("Idempotency-Key") or "").strip() or None
+        upsert = _truthy(request.args.get("upsert") or request.headers.get("X-Upsert"), SUBMIT_UPSERT)
+
+        rid, created, was_created, grade = _insert_submission(payload, user_id, idempotency_key, upsert)
+        router.note_write(user_id)
+        created_iso = created.isoformat() if hasattr(created, "isoformat") else created
+        body = {"id": rid, "created_at": created_iso, "created": was_created}
+        if grade is not None:
+            body["grade"] = grade
+        return jsonify(body), (201 if was_created else 200)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _build_where(filters):
+    """Return (where_sql, params) for the optional q/course/semester/year/user filters.
+    academic_year compares the plain column so a partitioned table prunes to one partition.
+    """
     where_clauses = []
     params = []
     if filters:
         q = filters.get("q")
         course = filters.get("course")
         semester = filters.get("semester")
+        academic_year = filters.get("academic_year")
         user_only = filters.get("user_only")
         user_id = filters.get("user_id")
         if q:
@@ -144,15 +512,49 @@ def _fetch_rows(filters=None, limit=None, offset=None):
         if semester:
             where_clauses.append("data->'student'->>'semester' = %s")
             params.append(str(semester))
+        if academic_year:
+            where_clauses.append("academic_year = %s")
+            params.append(str(academic_year).strip())
         if user_only and user_id:
             where_clauses.append("user_id = %s")
             params.append(int(user_id))
 
     where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    return where_sql, params
+
+
+def _page_sql(limit, offset):
     limit_sql = f"LIMIT {int(limit)}" if limit else "LIMIT 100"
     offset_sql = f"OFFSET {int(offset)}" if offset else ""
-    sql = f"SELECT id, data, created_at FROM submissions {where_sql} ORDER BY created_at DESC {limit_sql} {offset_sql};"
+    return f"{limit_sql} {offset_sql}"
+
+
+def _rows_sql(filters=None, limit=None, offset=None):
+    """Return (sql, params) selecting (id, data, created_at) rows, newest first."""
+    where_sql, params = _build_where(filters)
+    sql = f"SELECT id, data, created_at FROM submissions {where_sql} ORDER BY created_at DESC {_page_sql(limit, offset)};"
+    return sql, params
+
+
+def _fetch_rows(filters=None, limit=None, offset=None):
+    """Return list of tuples (id, data_dict, created_at).
+    Supports either direct Postgres (psycopg2) or Supabase client.
+    """
+    if use_supabase:
+        # Supabase: fetch and return the raw rows
+        try:
+            resp = _supabase().table("submissions").select("id,data,created_at").order("created_at", desc=True).execute()
+            rows = resp.data if hasattr(resp, "data") else resp
+            normalized = []
+            for r in rows:
+                normalized.append((r.get("id"), r.get("data"), r.get("created_at")))
+            return normalized
+        except Exception:
+            return []
 
+    conn = get_conn(readonly=True)
+    cur = conn.cursor()
+    sql, params = _rows_sql(filters, limit, offset)
     cur.execute(sql, tuple(params))
     rows = cur.fetchall()
     cur.close()
@@ -170,11 +572,145 @@ def _fetch_rows(filters=None, limit=None, offset=None):
     return normalized
 
 
+# Summary projection for list views: only these JSON paths are extracted in SQL,
+# and totals/status are computed server-side instead of shipping every subject.
+SUMMARY_STUDENT_FIELDS = ("name", "rollNumber", "registrationNumber", "universityName", "courseName", "semester", "academicYear")
+SUMMARY_COMPUTED_FIELDS = ("percentage", "status", "totalObtained", "totalMax", "cgpa")
+DEFAULT_SUMMARY_FIELDS = ("name", "rollNumber", "courseName", "semester", "universityName", "academicYear", "percentage", "status")
+
+
+def _json_number_sql(expr, default):
+    """SQL for a JSON text value cast to float, falling back to `default` for blanks/non-numbers."""
+    return f"(CASE WHEN {expr} ~ '^\\s*-?[0-9]+(\\.[0-9]+)?\\s*$' THEN ({expr})::float8 ELSE {default} END)"
+
+
+# A stored grade (grading.py) is read as is; the rows without one also return the two paths
+# grading.grade() reads, so they are graded in Python under their university's current rules.
+_GRADE_JOIN_SQL = "LEFT JOIN submission_grades AS g ON g.submission_id = submissions.id"
+_GRADE_COLUMNS_SQL = (", g.total_obtained, g.total_max, g.percentage, g.status, g.cgpa, "
+                      "CASE WHEN g.submission_id IS NULL THEN jsonb_build_object('student', "
+                      "jsonb_build_object('universityName', data->'student'->'universityName'), "
+                      "'subjects', data->'subjects') END")
+
+
+# Per-subject entries of the filtered submissions, read from the facts by catalog subject id (see
+# subject_catalog.py), as NOT NULL (id, subject index, marks, max) for distribution.decode_copy();
+# the index is 1-based in the subject ids array, 0 for any other subject.
+_DISTRIBUTION_FILTERS = ("course", "semester", "academic_year")
+
+
+def _facts_where(filters):
+    """Return (where_sql, params) over submission_subject_facts, matching as /analytics/cube does."""
+    keys = [k for k in _DISTRIBUTION_FILTERS if (filters or {}).get(k)]
+    where_sql = f"WHERE {' AND '.join(cube.FILTERS[k] for k in keys)}" if keys else ""
+    return where_sql, [str(filters[k]).strip() for k in keys]
+
+
+def _subject_entries_sql(filters):
+    """Return (sql, params) of the entries plus each one's rule set index (distribution.DISTRIBUTION_COLUMNS);
+    the subject ids and the rule book's university keys (grading.ruleset_index) go before `params`.
+    """
+    where_sql, params = _facts_where(filters)
+    sql = ("SELECT submission_id::int8, COALESCE(array_position(%s::int[], subject_id), 0)::int4, marks, max_marks, "
+           f"COALESCE(array_position(%s::text[], university_key), 0)::int4 FROM submission_subject_facts {where_sql}")
+    return sql, params
+
+
+DISTRIBUTION_MAX_SUBJECTS = int(os.getenv("DISTRIBUTION_MAX_SUBJECTS") or 50)
+
+# /analytics/cube: row limit per answer, and per-process cache of answers keyed by query and data version
+CUBE_MAX_ROWS = int(os.getenv("CUBE_MAX_ROWS") or 5000)
+_cube_cache = auth_context.TTLCache(int(os.getenv("CUBE_CACHE_SIZE") or 256), float(os.getenv("CUBE_CACHE_TTL") or 600))
+
+# Subject catalog for /analytics, reloaded after every write (new spellings arrive with submissions)
+_catalog_cache = auth_context.TTLCache(4, 600)
+
+# /analytics/trends reads materialized views; TRENDS_REFRESH_INTERVAL > 0 keeps them fresh from this process
+if DATABASE_URL and not use_supabase:
+    trends.start_scheduler(get_conn)
+
+
+def _summary_row(rid, created, student, fields, grade=None):
+    """`grade` is a grading.grade() result; the computed fields are None without one."""
+    out = {"id": rid, "created_at": created}
+    out["student"] = {f: student.get(f) for f in fields if f in SUMMARY_STUDENT_FIELDS}
+    if any(f in SUMMARY_COMPUTED_FIELDS for f in fields):
+        out.update({f: (grade or {}).get(f) for f in fields if f in SUMMARY_COMPUTED_FIELDS})
+    return out
+
+
+def _summary_fields(fields_arg, view):
+    """Parse ?fields= / ?view=summary into (fields, error); fields is None for the full view."""
+    if not fields_arg and view != "summary":
+        return None, None
+    fields = [f.strip() for f in fields_arg.split(",") if f.strip()] if fields_arg else list(DEFAULT_SUMMARY_FIELDS)
+    unknown = [f for f in fields if f not in SUMMARY_STUDENT_FIELDS + SUMMARY_COMPUTED_FIELDS]
+    if unknown:
+        return None, f"unknown fields: {', '.join(unknown)}"
+    return fields, None
+
+
+def _summary_sql(filters=None, limit=None, offset=None, fields=DEFAULT_SUMMARY_FIELDS):
+    """Return (sql, params) selecting (id, created_at, student_jsonb[, total_obtained, total_max, percentage, status, cgpa, ungraded_doc])."""
+    student_fields = [f for f in fields if f in SUMMARY_STUDENT_FIELDS]
+    need_totals = any(f in SUMMARY_COMPUTED_FIELDS for f in fields)
+    where_sql, params = _build_where(filters)
+    # jsonb_build_object keeps one result column regardless of how many paths are requested
+    student_sql = "jsonb_build_object(" + ", ".join(f"'{f}', data->'student'->'{f}'" for f in student_fields) + ")" if student_fields else "'{}'::jsonb"
+    totals_cols = _GRADE_COLUMNS_SQL if need_totals else ""
+    totals_join = _GRADE_JOIN_SQL if need_totals else ""
+    sql = (f"SELECT id, created_at, {student_sql}{totals_cols} FROM submissions {totals_join} "
+           f"{where_sql} ORDER BY created_at DESC {_page_sql(limit, offset)};")
+    return sql, params
+
+
+def _row_grade(row, rulebook=None):
+    """grading.grade()-style dict from the _GRADE_COLUMNS_SQL columns of a row (from index 3 on);
+    ungraded rows are graded under `rulebook` (default _rulebook()).
+    """
+    if row[8] is None:
+        return None if row[4] is None else {"totalObtained": float(row[3]), "totalMax": float(row[4]),
+                                            "percentage": float(row[5]), "status": row[6],
+                                            "cgpa": None if row[7] is None else float(row[7])}
+    doc = json.loads(row[8]) if isinstance(row[8], str) else row[8]
+    return _grade(doc, rulebook)
+
+
+def _summary_from_row(row, fields, rulebook=None):
+    """Summary dict of a _summary_sql() row; ungraded rows are graded under `rulebook` (default _rulebook())."""
+    student = row[2] or {}
+    if isinstance(student, str):
+        student = json.loads(student)
+    if len(row) <= 3:
+        return _summary_row(row[0], row[1], student, fields)
+    return _summary_row(row[0], row[1], student, fields, _row_grade(row, rulebook))
+
+
+def _fetch_summaries(filters=None, limit=None, offset=None, fields=DEFAULT_SUMMARY_FIELDS):
+    """Like _fetch_rows but returns summary dicts with only the requested fields."""
+    if use_supabase:
+        out = []
+        for rid, data, created in _fetch_rows(filters, limit, offset):
+            data = data if isinstance(data, dict) else {}
+            need_totals = any(f in SUMMARY_COMPUTED_FIELDS for f in fields)
+            out.append(_summary_row(rid, created, data.get("student") or {}, fields, _grade(data) if need_totals else None))
+        return out
+
+    sql, params = _summary_sql(filters, limit, offset, fields)
+    conn = get_conn(readonly=True)
+    cur = conn.cursor()
+    cur.execute(sql, tuple(params))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [_summary_from_row(row, fields) for row in rows]
+
+
 def _get_submission_by_id(sid):
     """Return tuple (id, data_dict, created_at) or None"""
-    if use_supabase and supabase is not None:
+    if use_supabase:
         try:
-            resp = supabase.table("submissions").select("id,data,created_at").eq("id", sid).execute()
+            resp = _supabase().table("submissions").select("id,data,created_at").eq("id", sid).execute()
             rows = resp.data if hasattr(resp, "data") else resp
             if not rows:
                 return None
@@ -202,6 +738,11 @@ def _get_submission_by_id(sid):
 
 def _generate_pdf_bytes(submission_data: dict) -> bytes:
     """Generate a highly professional PDF (bytes) from submission JSON using reportlab + matplotlib."""
+    with metrics.PDF_RENDER.time():
+        return _render_pdf_bytes(submission_data)
+
+
+def _render_pdf_bytes(submission_data: dict) -> bytes:
     try:
         from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as RLImage, HRFlowable
         from reportlab.lib.pagesizes import A4
@@ -281,6 +822,7 @@ def _generate_pdf_bytes(submission_data: dict) -> bytes:
     elements.append(Paragraph("ACADEMIC RECORD", section_title))
     
     table_data = [["Course Title", "Maximum Marks", "Marks Obtained", "Status"]]
+    rules = _rulebook().lookup(_university(submission_data))[2]
     total_max = 0.0
     total_obt = 0.0
     
@@ -289,7 +831,7 @@ def _generate_pdf_bytes(submission_data: dict) -> bytes:
         marks = float(s.get('marksObtained') or 0)
         total_max += maxm
         total_obt += marks
-        status = "PASS" if marks >= (0.4 * maxm if maxm else 0) else "FAIL"
+        status = "PASS" if grading.subject_passed(marks, maxm, rules) else "FAIL"
         
         table_data.append([
             str(s.get('name') or ''), 
@@ -331,13 +873,19 @@ def _generate_pdf_bytes(submission_data: dict) -> bytes:
 
     # 4. Final Verdict & Summary
     perc = (total_obt / total_max * 100) if total_max else 0.0
-    status_text = "PASS" if perc >= 40 else "FAIL"
-    status_color = "#059669" if status_text == "PASS" else "#DC2626"
+    result = grading.grade(submission_data, rules)
+    status_text = result["status"].upper() if result else "FAIL"
+    status_color = "#DC2626" if not result or result["status"] == rules["failLabel"] else "#059669"
     
     summary_data = [
         [Paragraph(f"<b>FINAL PERCENTAGE:</b> {perc:.2f}%", bold_text), 
          Paragraph(f"<b>OVERALL VERDICT:</b> <font color='{status_color}'>{status_text}</font>", bold_text)]
     ]
+    if result and result["cgpa"] is not None:
+        summary_data.append([Paragraph(f"<b>CGPA:</b> {result['cgpa']:.2f}", bold_text), ""])
+    cohort = _cohort_percentile(submission_data)
+    if cohort:
+        summary_data.append([Paragraph(f"<b>COHORT PERCENTILE:</b> {cohort[0]:.1f} (of {cohort[1]} students in this course and semester)", normal_text), ""])
     summary_tbl = Table(summary_data, colWidths=[250, 250])
     summary_tbl.setStyle(TableStyle([
         ('BACKGROUND', (0,0), (-1,-1), rl_colors.HexColor('#F9FAFB')),
@@ -347,6 +895,8 @@ def _generate_pdf_bytes(submission_data: dict) -> bytes:
         ('ALIGN', (0,0), (0,0), 'LEFT'),
         ('ALIGN', (1,0), (1,0), 'RIGHT')
     ]))
+    if cohort:
+        summary_tbl.setStyle(TableStyle([('SPAN', (0,1), (1,1)), ('TOPPADDING', (0,1), (-1,1), 0)]))
     elements.append(summary_tbl)
     elements.append(Spacer(1, 25))
 
@@ -394,23 +944,35 @@ def _generate_pdf_bytes(submission_data: dict) -> bytes:
     return buf.read()
 
 
-def _send_via_sendgrid(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str) -> (bool, str):
-    """Send bytes via SendGrid API. Returns (ok, message)."""
+def _sendgrid_request(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str,
+                      html_body: str = '', text_body: str = '') -> tuple:
+    """Return (request kwargs, None) for the SendGrid send API, or (None, error) when unconfigured.
+    The kwargs work with both requests.post and httpx.AsyncClient.post.
+    """
     key = os.getenv('SENDGRID_API_KEY') or os.getenv('SENDGRID_KEY')
     if not key:
-        return False, 'no-sendgrid-key'
-    try:
-        import requests
-        import base64
-        b64 = base64.b64encode(pdf_bytes).decode('ascii')
-        payload = {
-            "personalizations": [{"to": [{"email": to_email}], "subject": subject}],
-            "from": {"email": from_email},
-            "content": [{"type": "text/plain", "value": f"Please find attached the result PDF for {filename}."}],
-            "attachments": [{"content": b64, "type": "application/pdf", "filename": filename}],
-        }
-        headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-        resp = requests.post("https://api.sendgrid.com/v3/mail/send", json=payload, headers=headers, timeout=30)
+        return None, 'no-sendgrid-key'
+    b64 = base64.b64encode(pdf_bytes).decode('ascii')
+    payload = {
+        "personalizations": [{"to": [{"email": to_email}], "subject": subject}],
+        "from": {"email": from_email},
+        # SendGrid requires text/plain before text/html
+        "content": [{"type": "text/plain", "value": text_body or f"Please find attached the result PDF for {filename}."}]
+                   + ([{"type": "text/html", "value": html_body}] if html_body else []),
+        "attachments": [{"content": b64, "type": "application/pdf", "filename": filename}],
+    }
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
+    return {"url": "https://api.sendgrid.com/v3/mail/send", "json": payload, "headers": headers}, None
+
+
+def _send_via_sendgrid(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str,
+                       html_body: str = '', text_body: str = '') -> (bool, str):
+    """Send bytes via SendGrid API. Returns (ok, message)."""
+    req, err = _sendgrid_request(pdf_bytes, filename, to_email, subject, from_email, html_body, text_body)
+    if err:
+        return False, err
+    try:
+        resp = http_sessions.post('sendgrid', **req)
         if not resp.ok:
             return False, f'sendgrid:{resp.status_code}:{resp.text}'
         return True, 'sent-via-sendgrid'
@@ -418,25 +980,35 @@ def _send_via_sendgrid(pdf_bytes: bytes, filename: str, to_email: str, subject:
         return False, f'sendgrid-exception:{str(e)}'
 
 
-def _send_via_mailgun(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str) -> (bool, str):
-    """Send bytes via Mailgun API. Requires MAILGUN_API_KEY and MAILGUN_DOMAIN env vars."""
+def _mailgun_request(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str,
+                     html_body: str = '', text_body: str = '') -> tuple:
+    """Return (request kwargs, None) for the Mailgun messages API, or (None, error) when unconfigured."""
     key = os.getenv('MAILGUN_API_KEY') or os.getenv('MAILGUN_KEY') or os.getenv('MAILGUN_API')
     domain = os.getenv('MAILGUN_DOMAIN')
     if not key or not domain:
-        return False, 'no-mailgun-config'
-    try:
-        import requests
-        url = f'https://api.mailgun.net/v3/{domain}/messages'
-        data = {
-            'from': from_email,
-            'to': to_email,
-            'subject': subject,
-            'text': f'Please find attached the result PDF for {filename}.'
-        }
-        files = {
-            'attachment': (filename, io.BytesIO(pdf_bytes), 'application/pdf')
-        }
-        resp = requests.post(url, auth=('api', key), data=data, files=files, timeout=30)
+        return None, 'no-mailgun-config'
+    data = {
+        'from': from_email,
+        'to': to_email,
+        'subject': subject,
+        'text': text_body or f'Please find attached the result PDF for {filename}.'
+    }
+    if html_body:
+        data['html'] = html_body
+    files = {
+        'attachment': (filename, io.BytesIO(pdf_bytes), 'application/pdf')
+    }
+    return {"url": f'https://api.mailgun.net/v3/{domain}/messages', "auth": ('api', key), "data": data, "files": files}, None
+
+
+def _send_via_mailgun(pdf_bytes: bytes, filename: str, to_email: str, subject: str, from_email: str,
+                      html_body: str = '', text_body: str = '') -> (bool, str):
+    """Send bytes via Mailgun API. Requires MAILGUN_API_KEY and MAILGUN_DOMAIN env vars."""
+    req, err = _mailgun_request(pdf_bytes, filename, to_email, subject, from_email, html_body, text_body)
+    if err:
+        return False, err
+    try:
+        resp = http_sessions.post('mailgun', **req)
         if not resp.ok:
             return False, f'mailgun:{resp.status_code}:{resp.text}'
         return True, 'sent-via-mailgun'
@@ -444,137 +1016,253 @@ def _send_via_mailgun(pdf_bytes: bytes, filename: str, to_email: str, subject: s
         return False, f'mailgun-exception:{str(e)}'
 
 
-def _send_via_mailtrap(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
-                       from_email: str, from_name: str = '', html_body: str = '', text_body: str = '') -> tuple:
-    """Send bytes via Mailtrap Send API using API token."""
+def _mailtrap_request(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
+                      from_email: str, from_name: str = '', html_body: str = '', text_body: str = '') -> tuple:
+    """Return (request kwargs, None) for the Mailtrap send API, or (None, error) when unconfigured.
+    Uses the Bearer auth header; send the variants of _mailtrap_auth_variants() instead.
+    """
     token = os.getenv('MAILTRAP_API_TOKEN') or os.getenv('MAILTRAP_TOKEN')
     inbox_id = os.getenv('MAILTRAP_INBOX_ID')
     if not token:
-        return False, 'no-mailtrap-token'
+        return None, 'no-mailtrap-token'
     if not inbox_id:
-        return False, 'no-mailtrap-inbox'
-    try:
-        import requests
-        import base64
-        b64 = base64.b64encode(pdf_bytes).decode('ascii')
-        payload = {
-            "from": {"email": from_email, "name": from_name} if from_name else {"email": from_email},
-            "to": [{"email": to_email}],
-            "subject": subject,
-            "html": html_body,
-            "text": text_body or f"Please find attached the result PDF for {filename}.",
-            "attachments": [{"content": b64, "filename": filename, "type": "application/pdf"}]
-        }
-        # Prefer sandbox endpoint with inbox id (as used in test_mailtrap.py)
-        url = os.getenv('MAILTRAP_API_URL') or f'https://sandbox.api.mailtrap.io/api/send/{inbox_id}'
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
-        if resp.ok:
-            return True, 'sent-via-mailtrap'
-        # fallback: try an alternative header name
-        headers2 = {"Api-Token": token, "Content-Type": "application/json"}
-        resp2 = requests.post(url, json=payload, headers=headers2, timeout=30)
-        if resp2.ok:
-            return True, 'sent-via-mailtrap'
-        return False, f'mailtrap:{resp.status_code}:{resp.text} | {resp2.status_code}:{resp2.text}'
+        return None, 'no-mailtrap-inbox'
+    b64 = base64.b64encode(pdf_bytes).decode('ascii')
+    payload = {
+        "from": {"email": from_email, "name": from_name} if from_name else {"email": from_email},
+        "to": [{"email": to_email}],
+        "subject": subject,
+        "text": text_body or f"Please find attached the result PDF for {filename}.",
+        "attachments": [{"content": b64, "filename": filename, "type": "application/pdf"}]
+    }
+    if html_body:
+        payload["html"] = html_body
+    # Prefer sandbox endpoint with inbox id (as used in test_mailtrap.py)
+    url = os.getenv('MAILTRAP_API_URL') or f'https://sandbox.api.mailtrap.io/api/send/{inbox_id}'
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    return {"url": url, "json": payload, "headers": headers}, None
+
+
+def _mailtrap_alt_auth(req: dict) -> dict:
+    """Same request using Mailtrap's alternative `Api-Token` header."""
+    token = req["headers"]["Authorization"].split(" ", 1)[1]
+    return dict(req, headers={"Api-Token": token, "Content-Type": "application/json"})
+
+
+# Mailtrap auth header that last got a message accepted ('bearer' or 'api-token'); tried first
+_mailtrap_auth = 'bearer'
+
+
+def _mailtrap_auth_variants(req: dict) -> list:
+    """[(scheme, request)] to try in order: the scheme that worked last, then the other one.
+    Move on to the next only when the previous answer was 401/403; record a success with
+    _mailtrap_auth_worked().
+    """
+    variants = [('bearer', req), ('api-token', _mailtrap_alt_auth(req))]
+    return variants if _mailtrap_auth == 'bearer' else variants[::-1]
+
+
+def _mailtrap_auth_worked(scheme: str) -> None:
+    global _mailtrap_auth
+    _mailtrap_auth = scheme
+
+
+def _send_via_mailtrap(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
+                       from_email: str, from_name: str = '', html_body: str = '', text_body: str = '') -> tuple:
+    """Send bytes via Mailtrap Send API using API token."""
+    req, err = _mailtrap_request(pdf_bytes, filename, to_email, subject, from_email, from_name, html_body, text_body)
+    if err:
+        return False, err
+    try:
+        errors = []
+        for scheme, variant in _mailtrap_auth_variants(req):
+            resp = http_sessions.post('mailtrap', **variant)
+            if resp.ok:
+                _mailtrap_auth_worked(scheme)
+                return True, 'sent-via-mailtrap'
+            errors.append(f'{resp.status_code}:{resp.text}')
+            if resp.status_code not in (401, 403):
+                break  # not an auth problem: the other header would fail the same way
+        return False, 'mailtrap:' + ' | '.join(errors)
     except Exception as e:
         return False, f'mailtrap-exception:{str(e)}'
 
 
+def _smtp_config() -> tuple:
+    """(host, port, user, password) from SMTP_HOST / SMTP_PORT / SMTP_USER / SMTP_PASSWORD."""
+    return (os.getenv('SMTP_HOST'), int(os.getenv('SMTP_PORT') or 0),
+            os.getenv('SMTP_USER') or os.getenv('SMTP_USERNAME'),
+            os.getenv('SMTP_PASSWORD') or os.getenv('SMTP_PASS'))
+
+
+def _smtp_connect():
+    """Open an SMTP connection, with TLS and login as configured; the caller closes it."""
+    import smtplib
+    smtp_host, smtp_port, smtp_user, smtp_pass = _smtp_config()
+    if smtp_port == 465:
+        server = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=60)
+    else:
+        server = smtplib.SMTP(smtp_host, smtp_port, timeout=60)
+        server.ehlo()
+        # SMTP_STARTTLS=0 only for local sinks such as `loadtest.py smtp-stub`
+        if (os.getenv('SMTP_STARTTLS') or '1') != '0':
+            server.starttls()
+            server.ehlo()
+    try:
+        if smtp_user and smtp_pass:
+            server.login(smtp_user, smtp_pass)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def _smtp_message(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
+                  from_email: str, from_name: str = '', html_body: str = '', text_body: str = '') -> bytes:
+    """Build a full multipart/mixed MIME message with HTML body + PDF attachment."""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.base import MIMEBase
+    from email import encoders
+    from email.utils import formataddr
+
+    # Build MIME message
+    msg = MIMEMultipart('mixed')
+    msg['Subject'] = subject
+    msg['From']    = formataddr((from_name, from_email)) if from_name else from_email
+    msg['To']      = to_email
+
+    # Body (HTML preferred, plain text fallback)
+    body_alt = MIMEMultipart('alternative')
+    plain = text_body or f'Please find the attached academic result PDF: {filename}'
+    body_alt.attach(MIMEText(plain, 'plain', 'utf-8'))
+    if html_body:
+        body_alt.attach(MIMEText(html_body, 'html', 'utf-8'))
+    msg.attach(body_alt)
+
+    # PDF attachment
+    part = MIMEBase('application', 'pdf')
+    part.set_payload(pdf_bytes)
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    msg.attach(part)
+    return msg.as_bytes()
+
+
 def _send_via_smtp(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
                    from_email: str, from_name: str = '', html_body: str = '', text_body: str = '') -> tuple:
     """Send via SMTP — reliable for large PDF attachments.
     Uses SMTP_HOST / SMTP_PORT / SMTP_USER / SMTP_PASSWORD from env.
-    Builds a full multipart/mixed MIME message with HTML body + PDF attachment.
     """
-    smtp_host = os.getenv('SMTP_HOST')
-    smtp_port = int(os.getenv('SMTP_PORT') or 0)
-    smtp_user = os.getenv('SMTP_USER') or os.getenv('SMTP_USERNAME')
-    smtp_pass = os.getenv('SMTP_PASSWORD') or os.getenv('SMTP_PASS')
-
+    smtp_host, smtp_port, _, _ = _smtp_config()
     if not smtp_host or not smtp_port:
         return False, 'no-smtp-config'
 
     try:
-        import smtplib
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.text import MIMEText
-        from email.mime.base import MIMEBase
-        from email import encoders
-        from email.utils import formataddr
-
-        # Build MIME message
-        msg = MIMEMultipart('mixed')
-        msg['Subject'] = subject
-        msg['From']    = formataddr((from_name, from_email)) if from_name else from_email
-        msg['To']      = to_email
-
-        # Body (HTML preferred, plain text fallback)
-        body_alt = MIMEMultipart('alternative')
-        plain = text_body or f'Please find the attached academic result PDF: {filename}'
-        body_alt.attach(MIMEText(plain, 'plain', 'utf-8'))
-        if html_body:
-            body_alt.attach(MIMEText(html_body, 'html', 'utf-8'))
-        msg.attach(body_alt)
-
-        # PDF attachment
-        part = MIMEBase('application', 'pdf')
-        part.set_payload(pdf_bytes)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 'attachment', filename=filename)
-        msg.attach(part)
-
-        # Send
-        if smtp_port == 465:
-            with smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=60) as server:
-                if smtp_user and smtp_pass:
-                    server.login(smtp_user, smtp_pass)
-                server.sendmail(from_email, [to_email], msg.as_bytes())
-        else:
-            with smtplib.SMTP(smtp_host, smtp_port, timeout=60) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                if smtp_user and smtp_pass:
-                    server.login(smtp_user, smtp_pass)
-                server.sendmail(from_email, [to_email], msg.as_bytes())
-
+        message = _smtp_message(pdf_bytes, filename, to_email, subject, from_email, from_name, html_body, text_body)
+        with _smtp_connect() as server:
+            server.sendmail(from_email, [to_email], message)
         return True, 'sent-via-smtp'
 
     except Exception as exc:
         return False, f'smtp-exception: {exc}'
 
 
-def _send_bytes_via_providers(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
-                               data: dict = None) -> tuple:
-    """Send email with PDF attachment.
-    Strategy: SMTP first (most reliable for attachments), REST API fallback.
-    """
+@contextlib.contextmanager
+def _smtp_session():
+    """One SMTP connection for a batch of mail_scheduler messages; reconnects once when the server drops it."""
+    import smtplib
+    smtp_host, smtp_port, _, _ = _smtp_config()
+    if not smtp_host or not smtp_port:
+        yield lambda m: (False, 'no-smtp-config')
+        return
+    from_email, from_name = _sender()
+    server = [_smtp_connect()]
+
+    def send(m):
+        message = _smtp_message(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, from_name, m.html_body, m.text_body)
+        try:
+            try:
+                server[0].sendmail(from_email, [m.to_email], message)
+            except smtplib.SMTPServerDisconnected:
+                server[0] = _smtp_connect()
+                server[0].sendmail(from_email, [m.to_email], message)
+            return True, 'sent-via-smtp'
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as exc:
+            return False, f'smtp-exception: {exc}'
+    try:
+        yield send
+    finally:
+        try:
+            server[0].quit()
+        except Exception:
+            server[0].close()
+
+
+def _sender() -> tuple:
+    """Return (from_email, from_name) for outgoing result emails."""
     from_email = os.getenv('SMTP_FROM') or os.getenv('MAILTRAP_FROM') or 'mailtrap@demomailtrap.com'
     from_name  = os.getenv('SMTP_FROM_NAME') or os.getenv('MAILTRAP_FROM_NAME') or 'UniResult Portal'
+    return from_email, from_name
+
+
+def _result_filename(data: dict) -> str:
+    return f"{(data.get('student') or {}).get('name','result').replace(' ','_')}_Sem{(data.get('student') or {}).get('semester','')}_Result.pdf"
+
+
+def _result_bodies(data: dict) -> tuple:
+    """(html, text) email bodies summarising a submission (email_templates.py); ('', '') without one."""
+    if not isinstance(data, dict):
+        return '', ''
+    try:
+        return email_templates.render_result(data, _rulebook().lookup(_university(data))[2])
+    except Exception as e:
+        # The PDF is the result; a broken template must not stop it from being sent
+        app.logger.warning("rendering the result email failed: %s", e)
+        return '', ''
+
+
+def _mail_transports() -> dict:
+    """mail_scheduler Transports for every provider, sending as _sender()."""
+    from_email, from_name = _sender()
+
+    def full(fn):
+        return lambda m: fn(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, from_name, m.html_body, m.text_body)
 
-    html_body = _build_result_html(data) if data else ''
-    text_body = 'Your academic result PDF is attached to this email.' if html_body else ''
+    def without_name(fn):
+        return lambda m: fn(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, m.html_body, m.text_body)
 
-    # 1. Try SMTP (primary - handles large PDFs reliably)
-    ok, msg = _send_via_smtp(
-        pdf_bytes, filename, to_email, subject,
-        from_email, from_name, html_body, text_body
-    )
-    if ok:
-        return True, msg
+    return {
+        'smtp': mail_scheduler.Transport('smtp', full(_send_via_smtp), session=_smtp_session),
+        'mailtrap': mail_scheduler.Transport('mailtrap', full(_send_via_mailtrap)),
+        'sendgrid': mail_scheduler.Transport('sendgrid', without_name(_send_via_sendgrid)),
+        'mailgun': mail_scheduler.Transport('mailgun', without_name(_send_via_mailgun)),
+    }
+
+
+_mail = None
+_mail_lock = threading.Lock()
 
-    smtp_err = msg  # save for consolidated error
 
-    # 2. Fallback: Mailtrap REST API
-    ok2, msg2 = _send_via_mailtrap(
-        pdf_bytes, filename, to_email, subject,
-        from_email, from_name, html_body, text_body
-    )
-    if ok2:
-        return True, msg2
+def _mail_scheduler():
+    """Process-wide mail_scheduler.Scheduler: one token bucket per provider shared by all requests."""
+    global _mail
+    if _mail is None:
+        with _mail_lock:
+            if _mail is None:
+                usage = mail_scheduler.DailyUsage(None if use_supabase else get_conn)
+                _mail = mail_scheduler.Scheduler(_mail_transports(), usage)
+    return _mail
 
-    return False, f'Both transports failed | SMTP: {smtp_err} | REST: {msg2}'
+
+def _send_bytes_via_providers(pdf_bytes: bytes, filename: str, to_email: str, subject: str,
+                               data: dict = None) -> tuple:
+    """Send email with PDF attachment; `data` (the submission) adds the templated summary body.
+    Providers are tried in EMAIL_PROVIDERS order (SMTP first: most reliable for attachments),
+    each within its rate and daily quota (mail_scheduler.py).
+    """
+    html_body, text_body = _result_bodies(data)
+    return _mail_scheduler().send(mail_scheduler.Message(pdf_bytes, filename, to_email, subject, html_body, text_body))
 
 
 def _save_failed_pdf(pdf_bytes: bytes, filename: str, to_email: str) -> str:
@@ -615,13 +1303,13 @@ def email_submission():
 
         pdf_bytes = _generate_pdf_bytes(data)
 
-        filename = f"{(data.get('student') or {}).get('name','result').replace(' ','_')}_Sem{(data.get('student') or {}).get('semester','')}_Result.pdf"
+        filename = _result_filename(data)
         sendgrid_key = os.getenv('SENDGRID_API_KEY') or os.getenv('SENDGRID_KEY')
         sendgrid_from = os.getenv('SENDGRID_FROM') or os.getenv('SMTP_FROM') or os.getenv('EMAIL_FROM') or 'no-reply@example.com'
         subject = payload.get('subject') or f"Result — {(data.get('student') or {}).get('name','Student')}"
 
         # Try providers in order (SendGrid, Mailgun, SMTP)
-        ok, msg = _send_bytes_via_providers(pdf_bytes, filename, to_email, subject)
+        ok, msg = _send_bytes_via_providers(pdf_bytes, filename, to_email, subject, data)
         if not ok:
             # save PDF locally for manual sending
             saved = _save_failed_pdf(pdf_bytes, filename, to_email)
@@ -650,9 +1338,9 @@ def email_now():
             return jsonify({'error': 'recipient email not provided in payload or student record'}), 400
 
         pdf_bytes = _generate_pdf_bytes(data)
-        filename = f"{(data.get('student') or {}).get('name','result').replace(' ','_')}_Sem{(data.get('student') or {}).get('semester','')}_Result.pdf"
+        filename = _result_filename(data)
 
-        ok, msg = _send_bytes_via_providers(pdf_bytes, filename, to_email, subject)
+        ok, msg = _send_bytes_via_providers(pdf_bytes, filename, to_email, subject, data)
         if not ok:
             saved = _save_failed_pdf(pdf_bytes, filename, to_email)
             details = {'error': msg}
@@ -664,12 +1352,83 @@ def email_now():
         return jsonify({'error': str(e)}), 500
 
 
+def _data_version():
+    """Return (version, updated_at) of the submissions write counter, or None if unavailable.
+    Read once per request: the ETag check and the version-keyed caches behind it share the value.
+    """
+    if use_supabase:
+        return None
+    if has_request_context() and "_data_version" in g:
+        return g._data_version
+    try:
+        conn = get_conn(readonly=True)
+        cur = conn.cursor()
+        cur.execute("SELECT version, updated_at FROM data_versions WHERE name = 'submissions';")
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception:
+        row = None
+    if has_request_context():
+        g._data_version = row
+    return row
+
+
+def _validator_etag(counter, full_path, user_only=None, auth_header=None):
+    """ETag for a read endpoint: write counter + query scope (+ caller for user-scoped lists)."""
+    scope = full_path
+    if user_only:
+        auth = auth_header or ""
+        decoded = _decode_token(auth.split(" ", 1)[1].strip()) if auth.startswith("Bearer ") else None
+        scope += f"|user={(decoded or {}).get('user_id')}"
+    return f"{counter}-{hashlib.sha1(scope.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _conditional_get(view=None, validator=None):
+    """Answer If-None-Match / If-Modified-Since with 304 before running the view.
+    The ETag combines the submissions write counter (or `validator()`'s (counter, modified))
+    with the full query string and, for user-scoped listings, the caller's user id.
+    """
+    if view is None:
+        return functools.partial(_conditional_get, validator=validator)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = (validator or _data_version)()
+        if version is None:
+            return view(*args, **kwargs)
+        counter, modified = version
+        etag = _validator_etag(counter, request.full_path, request.args.get("user_only"), request.headers.get("Authorization"))
+        modified = modified.replace(microsecond=0)
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and modified <= since
+        if not_modified:
+            resp = Response(status=304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(etag, weak=True)
+        resp.last_modified = modified
+        # Let browsers keep the body but always revalidate
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.vary.add("Authorization")
+        return resp
+    return wrapper
+
+
 @app.route("/submissions", methods=["GET"])
+@_conditional_get
 def list_submissions():
     try:
         q = request.args.get("q")
         course = request.args.get("course")
         semester = request.args.get("semester")
+        academic_year = request.args.get("academic_year")
         limit = request.args.get("limit")
         offset = request.args.get("offset")
         user_only = request.args.get("user_only")
@@ -682,125 +1441,453 @@ def list_submissions():
             if decoded:
                 user_id = decoded.get("user_id")
 
-        rows = _fetch_rows(filters={"q": q, "course": course, "semester": semester, "user_only": user_only, "user_id": user_id}, limit=limit, offset=offset)
+        filters = {"q": q, "course": course, "semester": semester, "academic_year": academic_year,
+                   "user_only": user_only, "user_id": user_id}
+
+        # ?view=summary or ?fields=name,rollNumber,percentage,... skips shipping full documents
+        fields, err = _summary_fields(request.args.get("fields"), request.args.get("view"))
+        if err:
+            return jsonify({"error": err}), 400
+        if fields:
+            return jsonify(_fetch_summaries(filters, limit=limit, offset=offset, fields=fields))
+
+        rows = _fetch_rows(filters=filters, limit=limit, offset=offset)
         out = []
         for rid, data, created in rows:
-            created_iso = created.isoformat() if hasattr(created, "isoformat") else created
-            out.append({"id": rid, "data": data, "created_at": created_iso})
+            out.append({"id": rid, "data": data, "created_at": created})
         return jsonify(out)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _subject_catalog(version=None):
+    """{normalized spelling: (subject id, name)} from the subject catalog, cached until the next write.
+    `version` is the data_versions row when the caller already has it (Flask views reuse the request's).
+    """
+    if use_supabase:
+        return {}
+    version = version or _data_version()
+    key = version[0] if version else None
+    catalog = _catalog_cache.get(key)
+    if catalog is None:
+        conn = get_conn(readonly=True)
+        try:
+            cur = conn.cursor()
+            catalog = subject_catalog.load(cur)
+            cur.close()
+        finally:
+            conn.close()
+        _catalog_cache.set(key, catalog)
+    return catalog
+
+
+def _compute_analytics(rows, catalog=None, rulebook=None):
+    """Aggregate (id, data, created_at) rows into the /analytics response body.
+    Subjects are grouped by catalog id (see subject_catalog.py), or by normalized name when
+    `catalog` does not know the spelling; averages are keyed by the catalog or first-seen name.
+    Pass/fail follows each submission's university rule set from `rulebook` (grading.RuleBook).
+    """
+    catalog = catalog or {}
+    rulebook = rulebook or grading.RuleBook()
+    subject_stats = {}
+    totals = 0.0
+    count = 0
+    pass_count = 0
+    semester_stats = {}
+
+    for rid, data, created in rows:
+        if not isinstance(data, dict):
+            continue
+        subjects = data.get("subjects", []) or []
+        rules = rulebook.lookup(_university(data))[2]
+        total_marks = 0.0
+        total_max = 0.0
+        passed = True
+        for s in subjects:
+            name = str(s.get("name", "")).strip()
+            key = subject_catalog.normalize(name)
+            marks = float(s.get("marksObtained") or 0)
+            maxm = float(s.get("maxMarks") or 100)
+            total_marks += marks
+            total_max += maxm
+            if not grading.subject_passed(marks, maxm, rules):
+                passed = False
+            if key:
+                sid, label = catalog.get(key) or (key, name)
+                st = subject_stats.setdefault(sid, {"name": label, "sum": 0.0, "count": 0})
+                st["sum"] += marks
+                st["count"] += 1
+        if total_max > 0:
+            perc = (total_marks / total_max) * 100
+            totals += perc
+            count += 1
+            if passed and perc >= rules["aggregatePassPercent"]:
+                pass_count += 1
+            sem = data.get("student", {}).get("semester")
+            try:
+                sem_k = str(int(sem)) if sem is not None else "0"
+            except Exception:
+                sem_k = str(sem or "0")
+            se = semester_stats.setdefault(sem_k, {"sum": 0.0, "count": 0})
+            se["sum"] += perc
+            se["count"] += 1
+
+    overall_avg = (totals / count) if count else 0
+    pass_rate = (pass_count / count * 100) if count else 0
+    subject_averages = {v["name"]: (v["sum"] / v["count"]) for v in subject_stats.values()}
+    semester_averages = {k: (v["sum"] / v["count"]) for k, v in semester_stats.items()}
+
+    return {
+        "overallAverage": overall_avg,
+        "passRate": pass_rate,
+        "subjectAverages": subject_averages,
+        "semesterAverages": semester_averages,
+        "count": count,
+    }
+
+
+# Ungraded rows (loaded outside /submit and not re-graded yet) considered by /toppers, newest first
+TOPPERS_UNGRADED_LIMIT = int(os.getenv("TOPPERS_UNGRADED_LIMIT") or 10000)
+
+
+def _toppers_sql(filters, limit):
+    """Return (sql, params) selecting (id, created_at, student_jsonb, <_GRADE_COLUMNS_SQL>): the `limit`
+    best stored grades, then the newest ungraded rows for grading in Python.
+    """
+    where_sql, params = _build_where(filters)
+    where_sql = f"{where_sql} AND" if where_sql else "WHERE"
+    select = f"SELECT id, created_at, data->'student'{_GRADE_COLUMNS_SQL} FROM submissions {_GRADE_JOIN_SQL}"
+    sql = (f"({select} {where_sql} g.submission_id IS NOT NULL ORDER BY g.percentage DESC, created_at LIMIT {int(limit)}) "
+           f"UNION ALL ({select} {where_sql} g.submission_id IS NULL ORDER BY created_at DESC LIMIT {TOPPERS_UNGRADED_LIMIT});")
+    return sql, params + params
+
+
+def _topper(rid, created, student, grade):
+    if grade is None:
+        return None  # no subjects
+    if isinstance(student, str):
+        student = json.loads(student)
+    return {"id": rid, "student": student or {}, "percentage": grade["percentage"], "status": grade["status"],
+            "cgpa": grade["cgpa"], "totalObtained": grade["totalObtained"], "totalMax": grade["totalMax"],
+            "created_at": created}
+
+
+def _rank_toppers(entries, limit):
+    """Rank _topper() entries by percentage; ties share a rank."""
+    entries = sorted((e for e in entries if e), key=lambda x: (-x["percentage"], x.get("created_at", "")))
+    ranked = []
+    prev_perc = None
+    rank = 0
+    for i, e in enumerate(entries[:limit]):
+        if prev_perc is None or e["percentage"] != prev_perc:
+            rank = i + 1
+            prev_perc = e["percentage"]
+        e["rank"] = rank
+        ranked.append(e)
+    return ranked
+
+
+def _toppers_from_rows(rows, limit, rulebook=None):
+    """Ranked toppers from _toppers_sql() rows; the ungraded ones are graded under `rulebook`."""
+    return _rank_toppers([_topper(r[0], r[1], r[2], _row_grade(r, rulebook)) for r in rows], limit)
+
+
 @app.route("/analytics", methods=["GET"])
+@_conditional_get
 def analytics():
     try:
         course = request.args.get("course")
         semester = request.args.get("semester")
-        rows = _fetch_rows(filters={"course": course, "semester": semester}, limit=10000)
-
-        subject_stats = {}
-        totals = 0.0
-        count = 0
-        pass_count = 0
-        semester_stats = {}
-
-        for rid, data, created in rows:
-            if not isinstance(data, dict):
-                continue
-            subjects = data.get("subjects", []) or []
-            total_marks = 0.0
-            total_max = 0.0
-            passed = True
-            for s in subjects:
-                name = str(s.get("name", "")).strip()
-                marks = float(s.get("marksObtained") or 0)
-                maxm = float(s.get("maxMarks") or 100)
-                total_marks += marks
-                total_max += maxm
-                if marks < maxm * 0.4:
-                    passed = False
-                if name:
-                    st = subject_stats.setdefault(name, {"sum": 0.0, "count": 0})
-                    st["sum"] += marks
-                    st["count"] += 1
-            if total_max > 0:
-                perc = (total_marks / total_max) * 100
-                totals += perc
-                count += 1
-                if passed:
-                    pass_count += 1
-                sem = data.get("student", {}).get("semester")
-                try:
-                    sem_k = str(int(sem)) if sem is not None else "0"
-                except Exception:
-                    sem_k = str(sem or "0")
-                se = semester_stats.setdefault(sem_k, {"sum": 0.0, "count": 0})
-                se["sum"] += perc
-                se["count"] += 1
-
-        overall_avg = (totals / count) if count else 0
-        pass_rate = (pass_count / count * 100) if count else 0
-        subject_averages = {k: (v["sum"] / v["count"]) for k, v in subject_stats.items()}
-        semester_averages = {k: (v["sum"] / v["count"]) for k, v in semester_stats.items()}
-
-        return jsonify({
-            "overallAverage": overall_avg,
-            "passRate": pass_rate,
-            "subjectAverages": subject_averages,
-            "semesterAverages": semester_averages,
-            "count": count,
-        })
+        academic_year = request.args.get("academic_year")
+        rows = _fetch_rows(filters={"course": course, "semester": semester, "academic_year": academic_year}, limit=10000)
+        return jsonify(_compute_analytics(rows, _subject_catalog(), _rulebook()))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/toppers", methods=["GET"])
+@_conditional_get
 def toppers():
     try:
         limit = int(request.args.get("limit") or 10)
         course = request.args.get("course")
         semester = request.args.get("semester")
+        academic_year = request.args.get("academic_year")
+
+        filters = {"course": course, "semester": semester, "academic_year": academic_year}
+        if use_supabase:
+            rows = _fetch_rows(filters=filters, limit=10000)
+            return jsonify(_rank_toppers([_topper(rid, created, data.get("student"), _grade(data))
+                                          for rid, data, created in rows if isinstance(data, dict)], limit))
+        sql, params = _toppers_sql(filters, limit)
+        conn = get_conn(readonly=True)
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        return jsonify(_toppers_from_rows(rows, limit))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        rows = _fetch_rows(filters={"course": course, "semester": semester}, limit=10000)
-        entries = []
-        for rid, data, created in rows:
-            if not isinstance(data, dict):
-                continue
-            subjects = data.get("subjects", []) or []
-            total_marks = 0.0
-            total_max = 0.0
-            for s in subjects:
-                marks = float(s.get("marksObtained") or 0)
-                maxm = float(s.get("maxMarks") or 100)
-                total_marks += marks
-                total_max += maxm
-            perc = (total_marks / total_max * 100) if total_max > 0 else 0
-            entries.append({
-                "id": rid,
-                "student": data.get("student", {}),
-                "percentage": perc,
-                "totalObtained": total_marks,
-                "totalMax": total_max,
-                "created_at": created.isoformat() if hasattr(created, "isoformat") else created,
-            })
-
-        entries.sort(key=lambda x: (-x["percentage"], x.get("created_at", "")))
-        ranked = []
-        prev_perc = None
-        rank = 0
-        for i, e in enumerate(entries):
-            if prev_perc is None or e["percentage"] != prev_perc:
-                rank = i + 1
-                prev_perc = e["percentage"]
-            e["rank"] = rank
-            ranked.append(e)
-
-        return jsonify(ranked[:limit])
+
+def _distribution_percentiles(arg):
+    """Return (percentiles, error) for ?percentiles=10,50,90; defaults when absent."""
+    import distribution
+
+    if not arg:
+        return distribution.DEFAULT_PERCENTILES, None
+    try:
+        qs = [float(q) for q in arg.split(",") if q.strip()]
+    except ValueError:
+        qs = []
+    if not qs or not all(0 <= q <= 100 for q in qs):
+        return None, "percentiles must be comma-separated numbers between 0 and 100"
+    return qs, None
+
+
+def _subject_names_sql(filters):
+    """Return (sql, params) for the (subject id, name) of the DISTRIBUTION_MAX_SUBJECTS most frequent subjects."""
+    where_sql, params = _facts_where(filters)
+    sql = ("SELECT subject_id, subjects.name FROM submission_subject_facts JOIN subjects ON subjects.id = subject_id "
+           f"{where_sql} GROUP BY 1, 2 ORDER BY count(*) DESC, 2 LIMIT {DISTRIBUTION_MAX_SUBJECTS};")
+    return sql, params
+
+
+def _distribution_arrays(filters):
+    """(names, ids, subjects, marks, maxm, rule_index, rulesets) for distribution.summarize().
+    The marks come back through a binary COPY decoded straight into NumPy arrays.
+    """
+    import distribution
+
+    book = _rulebook()
+    if use_supabase:
+        return distribution.from_rows(_fetch_rows(filters=filters), DISTRIBUTION_MAX_SUBJECTS, book)
+
+    keys, _rule_ids, rulesets = grading.ruleset_index(book)
+    conn = get_conn(readonly=True)
+    try:
+        cur = conn.cursor()
+        sql, params = _subject_names_sql(filters)
+        cur.execute(sql, tuple(params))
+        subjects = cur.fetchall()
+        names = [name for _sid, name in subjects]
+        query, params = _subject_entries_sql(filters)
+        params = ([sid for sid, _name in subjects], keys, *params)
+        buf = io.BytesIO()
+        start = time.perf_counter()
+        cur.copy_expert(cur.mogrify(f"COPY ({query}) TO STDOUT (FORMAT binary)", params).decode("utf-8"), buf)
+        elapsed = time.perf_counter() - start
+        metrics.DB_QUERY.observe(elapsed, "COPY")
+        query_log.record(query, params, elapsed, cur.rowcount)
+        cur.close()
+    finally:
+        conn.close()
+    return (names, *distribution.decode_copy(buf.getbuffer(), distribution.DISTRIBUTION_COLUMNS), rulesets)
+
+
+@app.route("/analytics/distribution", methods=["GET"])
+@_conditional_get
+def analytics_distribution():
+    try:
+        try:
+            import distribution
+        except ImportError as e:
+            raise RuntimeError(f"Distribution analytics needs numpy: {e}")
+        percentiles, err = _distribution_percentiles(request.args.get("percentiles"))
+        if err:
+            return jsonify({"error": err}), 400
+        filters = {"course": request.args.get("course"), "semester": request.args.get("semester"),
+                   "academic_year": request.args.get("academic_year")}
+        return jsonify(distribution.summarize(*_distribution_arrays(filters), percentiles=percentiles))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _percentile_ranks(course, semester, values):
+    """{subject key: {"score", "percentileRank", "count"}} for `values` against the merged cohort sketches."""
+    conn = get_conn(readonly=True)
+    try:
+        cur = conn.cursor()
+        digests = sketches.load(cur, course, semester, list(values))
+        cur.close()
+    finally:
+        conn.close()
+    out = {}
+    for key, value in values.items():
+        digest = digests.get(key)
+        rank = digest.rank(value) if digest is not None else None
+        out[key] = {"score": round(value, 4), "percentileRank": None if rank is None else round(rank, 2),
+                    "count": int(digest.count) if digest is not None else 0}
+    return out
+
+
+def _cohort_percentile(submission_data):
+    """(percentile rank, cohort size) of a submission's overall percentage, or None (for the PDF)."""
+    if not (PDF_PERCENTILE_LINE and SCORE_SKETCHES) or use_supabase or not DATABASE_URL:
+        return None
+    value = sketches.scores(submission_data).get(sketches.OVERALL)
+    if value is None:
+        return None
+    try:
+        course, semester = sketches.cohort_key(submission_data.get("student"))
+        rank = _percentile_ranks(course, semester, {sketches.OVERALL: value})[sketches.OVERALL]
+    except Exception:
+        return None
+    if rank["percentileRank"] is None or rank["count"] < 2:
+        return None
+    return rank["percentileRank"], rank["count"]
+
+
+@app.route("/analytics/percentile-rank", methods=["GET"])
+@_conditional_get
+def percentile_rank():
+    """Percentile of a score (or of a stored submission) within its course/semester cohort.
+    ?submission_id=7 ranks that submission's overall percentage and every subject in its own cohort;
+    otherwise ?score= is ranked for `subject` (default: overall percentage) among the cohorts matching
+    `course` and `semester`, either of which may be omitted to merge all of them.
+    """
+    if use_supabase or not DATABASE_URL:
+        return jsonify({"error": "percentile ranks need DATABASE_URL (score sketches live in Postgres)"}), 501
+    try:
+        sid = request.args.get("submission_id")
+        if sid:
+            try:
+                row = _get_submission_by_id(int(sid))
+            except ValueError:
+                return jsonify({"error": "submission_id must be an integer"}), 400
+            if not row:
+                return jsonify({"error": "submission not found"}), 404
+            data = row[1] if isinstance(row[1], dict) else {}
+            catalog = _subject_catalog()
+            values = sketches.scores(data, catalog)
+            if not values:
+                return jsonify({"error": "submission has no marks"}), 400
+            course, semester = sketches.cohort_key(data.get("student"))
+            ranks = _percentile_ranks(course, semester, values)
+            overall = ranks.pop(sketches.OVERALL)
+            names = {sketches.subject_key(subject_id): name for subject_id, name in catalog.values()}
+            return jsonify({"id": row[0], "course": course, "semester": semester, "overall": overall,
+                            "subjects": {names.get(k, k): v for k, v in ranks.items()}})
+
+        try:
+            score = float(request.args.get("score"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "score (a percentage) or submission_id is required"}), 400
+        key = sketches.OVERALL
+        if request.args.get("subject"):
+            entry = _subject_catalog().get(subject_catalog.normalize(request.args.get("subject")))
+            if entry is None:
+                return jsonify({"score": round(score, 4), "percentileRank": None, "count": 0,
+                                "subject": request.args.get("subject")})
+            key = sketches.subject_key(entry[0])
+        rank = _percentile_ranks(request.args.get("course"), request.args.get("semester"), {key: score})[key]
+        return jsonify(dict(rank, subject=request.args.get("subject") or None))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/analytics/cube", methods=["GET"])
+@_conditional_get
+def analytics_cube():
+    """Group-by over per-subject facts with client-chosen dimensions and measures (see cube.py)."""
+    if use_supabase or not DATABASE_URL:
+        return jsonify({"error": "cube queries need DATABASE_URL"}), 501
+    try:
+        try:
+            dims, measures, sets, filters = cube.parse(request.args)
+        except cube.CubeError as e:
+            return jsonify({"error": str(e)}), 400
+        sql, params = cube.build(dims, measures, sets, filters, CUBE_MAX_ROWS)
+        # The submissions write counter also covers the facts, which triggers update in the same transaction
+        version = _data_version()
+        key = (version[0], sql, tuple(params)) if version else None
+        body = _cube_cache.get(key) if key else None
+        if body is None:
+            conn = get_conn(readonly=True)
+            try:
+                cur = conn.cursor()
+                cur.execute(sql, tuple(params))
+                rows = cur.fetchall()
+                cur.close()
+            finally:
+                conn.close()
+            body = cube.shape(rows, dims, measures, CUBE_MAX_ROWS)
+            if key:
+                _cube_cache.set(key, body)
+        return jsonify(body)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _trends_version():
+    """ETag validator for /analytics/trends: changes on a refresh as well as on a write (the `stale` flag)."""
+    if use_supabase:
+        return None
+    try:
+        conn = get_conn(readonly=True)
+        cur = conn.cursor()
+        current = trends.state(cur)
+        cur.close()
+        conn.close()
+    except Exception:
+        return None
+    if current is None:
+        return None
+    refreshed, refreshed_at, version, changed_at = current
+    return f"{refreshed}.{version}", max(refreshed_at, changed_at)
+
+
+@app.route("/analytics/trends", methods=["GET"])
+@_conditional_get(validator=_trends_version)
+def analytics_trends():
+    """Year-over-year series per course and semester (and subject) from the trend views (see trends.py)."""
+    if use_supabase or not DATABASE_URL:
+        return jsonify({"error": "trends need DATABASE_URL"}), 501
+    try:
+        args = {k: (request.args.get(k) or "").strip() or None
+                for k in ("course", "semester", "subject", "from_year", "to_year")}
+        sql, params, per_subject = trends.build(**args)
+        conn = get_conn(readonly=True)
+        try:
+            cur = conn.cursor()
+            current = trends.state(cur)
+            if current is None:
+                return jsonify({"error": "trend views missing (run `python migrate.py`)"}), 503
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        refreshed, refreshed_at, version, _changed = current
+        return jsonify({
+            "series": trends.shape(rows, per_subject),
+            "refreshedAt": refreshed_at.isoformat(),
+            "stale": refreshed != version,
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _retry_later(message, status, wait):
+    resp = jsonify({"error": message})
+    resp.status_code = status
+    resp.headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+    return resp
+
+
+def _auth_throttled(email=None):
+    """429 response when this client (or account) is over its auth rate, else None."""
+    limited = password_hashing.throttle(request.remote_addr, email)
+    return _retry_later(limited[0], 429, limited[1]) if limited else None
+
+
+def _hashing_busy():
+    return _retry_later("authentication is busy, try again shortly", 503, 1)
+
+
 @app.route("/auth/register", methods=["POST"])
 def auth_register():
     try:
@@ -810,6 +1897,9 @@ def auth_register():
         password = payload.get("password")
         if not email or not password:
             return jsonify({"error": "email and password required"}), 400
+        throttled = _auth_throttled()
+        if throttled:
+            return throttled
 
         conn = get_conn()
         cur = conn.cursor()
@@ -819,15 +1909,20 @@ def auth_register():
             conn.close()
             return jsonify({"error": "user exists"}), 400
 
-        pwd_hash = generate_password_hash(password)
-        cur.execute("INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s) RETURNING id, name, email", (name, email, pwd_hash))
+        try:
+            pwd_hash = password_hashing.hash_password(password)
+        except (password_hashing.Busy, FuturesTimeout):
+            cur.close()
+            conn.close()
+            return _hashing_busy()
+        cur.execute("INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s) RETURNING id, name, email, created_at", (name, email, pwd_hash))
         row = cur.fetchone()
         conn.commit()
         cur.close()
         conn.close()
 
         user_id = row[0]
-        token = _create_token(user_id)
+        token = _create_token(user_id, _user_profile(row))
         return jsonify({"token": token, "user": {"id": user_id, "name": row[1], "email": row[2]}}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -841,24 +1936,45 @@ def auth_login():
         password = payload.get("password")
         if not email or not password:
             return jsonify({"error": "email and password required"}), 400
+        throttled = _auth_throttled(email)
+        if throttled:
+            return throttled
 
         conn = get_conn()
         cur = conn.cursor()
-        cur.execute("SELECT id, name, email, password_hash FROM users WHERE email=%s", (email,))
+        cur.execute("SELECT id, name, email, created_at, password_hash FROM users WHERE email=%s", (email,))
         row = cur.fetchone()
         cur.close()
         conn.close()
         if not row:
             return jsonify({"error": "invalid credentials"}), 401
-        user_id, name, email, pwd_hash = row[0], row[1], row[2], row[3]
-        if not check_password_hash(pwd_hash, password):
+        user_id, name, email, pwd_hash = row[0], row[1], row[2], row[4]
+        try:
+            valid = password_hashing.verify_password(pwd_hash, password)
+        except (password_hashing.Busy, FuturesTimeout):
+            return _hashing_busy()
+        if not valid:
             return jsonify({"error": "invalid credentials"}), 401
-        token = _create_token(user_id)
+        if password_hashing.needs_rehash(pwd_hash):
+            password_hashing.rehash_later(password, functools.partial(_store_rehash, user_id, pwd_hash))
+        token = _create_token(user_id, _user_profile(row))
         return jsonify({"token": token, "user": {"id": user_id, "name": name, "email": email}})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _store_rehash(user_id, old_hash, new_hash):
+    """Replace a hash made with outdated parameters, unless the password changed meanwhile."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s", (new_hash, user_id, old_hash))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
 @app.route("/auth/me", methods=["GET"])
 def auth_me():
     try:
@@ -869,15 +1985,19 @@ def auth_me():
         if not decoded or not decoded.get("user_id"):
             return jsonify({"error": "invalid token"}), 401
         user_id = int(decoded.get("user_id"))
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, email, created_at FROM users WHERE id=%s", (user_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-        if not row:
-            return jsonify({"error": "user not found"}), 404
-        return jsonify({"id": row[0], "name": row[1], "email": row[2], "created_at": row[3].isoformat() if row[3] else None})
+        profile = auth_context.embedded_profile(decoded) or auth_context.cached_profile(user_id)
+        if profile is None:
+            conn = get_conn()
+            cur = conn.cursor()
+            cur.execute("SELECT id, name, email, created_at FROM users WHERE id=%s", (user_id,))
+            row = cur.fetchone()
+            cur.close()
+            conn.close()
+            if not row:
+                return jsonify({"error": "user not found"}), 404
+            profile = _user_profile(row)
+            auth_context.store_profile(user_id, profile)
+        return jsonify(profile)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,431 @@
+"""Asyncio serving mode for the I/O-bound endpoints.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+
+Serves /submissions, /analytics, /analytics/distribution, /toppers, /auth/*, /email-now and
+/email-submission with the same request and response semantics as app.py, but
+over an asyncpg pool and a shared httpx.AsyncClient: a slow query or provider
+call parks a coroutine instead of a whole worker.  SQL builders, aggregation,
+tokens and email payloads come from app.py; CPU-bound steps (aggregation,
+PDF rendering, blocking SMTP) run in worker threads, and password hashing on
+the shared bounded pool of password_hashing.py.
+Writes (/submit) stay on the Flask app.
+"""
+import os
+import re
+import json
+import time
+import io
+import asyncio
+import functools
+import contextlib
+
+import asyncpg
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.http import parse_etags, parse_date, http_date
+
+import app as core
+import auth_context
+import metrics
+import compression
+import grading
+import http_sessions
+import mail_scheduler
+import password_hashing
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN") or 2)
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX") or 20)
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS") or 100)
+
+pool = None
+http = None
+
+_PLACEHOLDER = re.compile(r"%s")
+
+
+def _pg(sql):
+    """Rewrite psycopg2 `%s` placeholders as asyncpg `$n`."""
+    counter = iter(range(1, 1 << 16))
+    return _PLACEHOLDER.sub(lambda _: f"${next(counter)}", sql)
+
+
+def _json(obj, status=200):
+    return Response(core.app.json.dumps(obj), status_code=status, media_type="application/json")
+
+
+def _bearer_user_id(request):
+    auth = request.headers.get("authorization")
+    if auth and auth.startswith("Bearer "):
+        decoded = core._decode_token(auth.split(" ", 1)[1].strip())
+        if decoded:
+            return decoded.get("user_id")
+    return None
+
+
+async def _init_conn(conn):
+    for typename in ("json", "jsonb"):
+        await conn.set_type_codec(typename, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global pool, http
+    if not core.DATABASE_URL:
+        raise RuntimeError("The async serving mode needs DATABASE_URL (Supabase client mode is not supported)")
+    pool = await asyncpg.create_pool(core.DATABASE_URL, min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX, init=_init_conn)
+    # retries= repeats failed connection attempts only, which cannot have delivered anything
+    http = httpx.AsyncClient(timeout=http_sessions.EMAIL_HTTP_TIMEOUT, transport=httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS), retries=http_sessions.EMAIL_HTTP_RETRIES))
+    try:
+        yield
+    finally:
+        await http.aclose()
+        await pool.close()
+
+
+def _handles_errors(handler):
+    """Same contract as the Flask views: unexpected exceptions become {"error": ...} 500s."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        try:
+            return await handler(request)
+        except Exception as e:
+            return _json({"error": str(e)}, 500)
+    return wrapper
+
+
+def _conditional_get(handler):
+    """Async port of app._conditional_get: answer 304 before running the query."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        try:
+            async with pool.acquire() as conn:
+                version = await conn.fetchrow("SELECT version, updated_at FROM data_versions WHERE name = 'submissions';")
+        except asyncpg.PostgresError:
+            version = None
+        if version is None:
+            return await handler(request)
+        request.state.data_version = (version["version"], version["updated_at"])  # for the version-keyed caches
+        counter, modified = version["version"], version["updated_at"].replace(microsecond=0)
+        full_path = f"{request.url.path}?{request.url.query}"
+        etag = core._validator_etag(counter, full_path, request.query_params.get("user_only"), request.headers.get("authorization"))
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            not_modified = parse_etags(if_none_match).contains_weak(etag)
+        else:
+            since = parse_date(request.headers.get("if-modified-since"))
+            not_modified = since is not None and modified <= since
+        if not_modified:
+            resp = Response(status_code=304)
+        else:
+            resp = await handler(request)
+            if resp.status_code != 200:
+                return resp
+        resp.headers["ETag"] = f'W/"{etag}"'
+        resp.headers["Last-Modified"] = http_date(modified)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.headers.append("Vary", "Authorization")
+        return resp
+    return wrapper
+
+
+def _data_version(request):
+    """The data_versions row _conditional_get read for this request, if any."""
+    return getattr(request.state, "data_version", None)
+
+
+async def _fetch_rows(filters, limit=None, offset=None):
+    sql, params = core._rows_sql(filters, limit, offset)
+    async with pool.acquire() as conn:
+        with metrics.DB_QUERY.time("SELECT"):
+            rows = await conn.fetch(_pg(sql), *params)
+    return [(r["id"], r["data"], r["created_at"]) for r in rows]
+
+
+@_handles_errors
+@_conditional_get
+async def list_submissions(request):
+    args = request.query_params
+    filters = {"q": args.get("q"), "course": args.get("course"), "semester": args.get("semester"),
+               "academic_year": args.get("academic_year"),
+               "user_only": args.get("user_only"), "user_id": _bearer_user_id(request)}
+    fields, err = core._summary_fields(args.get("fields"), args.get("view"))
+    if err:
+        return _json({"error": err}, 400)
+    if fields:
+        sql, params = core._summary_sql(filters, args.get("limit"), args.get("offset"), fields)
+        async with pool.acquire() as conn:
+            with metrics.DB_QUERY.time("SELECT"):
+                rows = await conn.fetch(_pg(sql), *params)
+        book = await asyncio.to_thread(core._rulebook, _data_version(request))
+        return _json([core._summary_from_row(tuple(r), fields, book) for r in rows])
+
+    rows = await _fetch_rows(filters, args.get("limit"), args.get("offset"))
+    return _json([{"id": rid, "data": data, "created_at": created} for rid, data, created in rows])
+
+
+def _scope_filters(args):
+    return {"course": args.get("course"), "semester": args.get("semester"), "academic_year": args.get("academic_year")}
+
+
+@_handles_errors
+@_conditional_get
+async def analytics(request):
+    args = request.query_params
+    rows = await _fetch_rows(_scope_filters(args), limit=10000)
+    return _json(await asyncio.to_thread(lambda: core._compute_analytics(rows, core._subject_catalog(_data_version(request)), core._rulebook(_data_version(request)))))
+
+
+async def _distribution_arrays(request, filters):
+    """Async port of app._distribution_arrays: subject names, then a binary COPY of the marks."""
+    import distribution
+
+    book = await asyncio.to_thread(core._rulebook, _data_version(request))
+    keys, _rule_ids, rulesets = grading.ruleset_index(book)
+    sql, params = core._subject_names_sql(filters)
+    entries_sql, entries_params = core._subject_entries_sql(filters)
+    buf = io.BytesIO()
+
+    async def collect(chunk):
+        buf.write(chunk)
+
+    async with pool.acquire() as conn:
+        with metrics.DB_QUERY.time("SELECT"):
+            subjects = await conn.fetch(_pg(sql), *params)
+        names = [r["name"] for r in subjects]
+        with metrics.DB_QUERY.time("COPY"):
+            await conn.copy_from_query(_pg(entries_sql), [r["subject_id"] for r in subjects], keys, *entries_params,
+                                       output=collect, format="binary")
+    return (names, *distribution.decode_copy(buf.getbuffer(), distribution.DISTRIBUTION_COLUMNS), rulesets)
+
+
+@_handles_errors
+@_conditional_get
+async def analytics_distribution(request):
+    try:
+        import distribution
+    except ImportError as e:
+        raise RuntimeError(f"Distribution analytics needs numpy: {e}")
+    args = request.query_params
+    percentiles, err = core._distribution_percentiles(args.get("percentiles"))
+    if err:
+        return _json({"error": err}, 400)
+    arrays = await _distribution_arrays(request, _scope_filters(args))
+    return _json(await asyncio.to_thread(distribution.summarize, *arrays, percentiles=percentiles))
+
+
+@_handles_errors
+@_conditional_get
+async def toppers(request):
+    args = request.query_params
+    limit = int(args.get("limit") or 10)
+    sql, params = core._toppers_sql(_scope_filters(args), limit)
+    async with pool.acquire() as conn:
+        with metrics.DB_QUERY.time("SELECT"):
+            rows = await conn.fetch(_pg(sql), *params)
+    book = await asyncio.to_thread(core._rulebook, _data_version(request))
+    return _json(await asyncio.to_thread(core._toppers_from_rows, [tuple(r) for r in rows], limit, book))
+
+
+def _retry_later(message, status, wait):
+    resp = _json({"error": message}, status)
+    resp.headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+    return resp
+
+
+async def _hash_on_pool(operation, fn, *args):
+    """Await a password_hashing pool job; None when the pool is saturated."""
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(password_hashing.submit(operation, fn, *args)),
+                                      password_hashing.PASSWORD_HASH_TIMEOUT)
+    except (password_hashing.Busy, asyncio.TimeoutError):
+        return None
+
+
+@_handles_errors
+async def auth_register(request):
+    payload = await request.json()
+    name = payload.get("name")
+    email = (payload.get("email") or "").strip().lower()
+    password = payload.get("password")
+    if not email or not password:
+        return _json({"error": "email and password required"}, 400)
+    limited = password_hashing.throttle(request.client.host if request.client else None)
+    if limited:
+        return _retry_later(limited[0], 429, limited[1])
+
+    async with pool.acquire() as conn:
+        if await conn.fetchval("SELECT id FROM users WHERE email=$1", email):
+            return _json({"error": "user exists"}, 400)
+        pwd_hash = await _hash_on_pool("hash", password_hashing.new_hash, password)
+        if pwd_hash is None:
+            return _retry_later("authentication is busy, try again shortly", 503, 1)
+        row = await conn.fetchrow("INSERT INTO users (name, email, password_hash) VALUES ($1, $2, $3) RETURNING id, name, email, created_at", name, email, pwd_hash)
+
+    token = core._create_token(row["id"], core._user_profile((row["id"], row["name"], row["email"], row["created_at"])))
+    return _json({"token": token, "user": {"id": row["id"], "name": row["name"], "email": row["email"]}}, 201)
+
+
+@_handles_errors
+async def auth_login(request):
+    payload = await request.json()
+    email = (payload.get("email") or "").strip().lower()
+    password = payload.get("password")
+    if not email or not password:
+        return _json({"error": "email and password required"}, 400)
+    limited = password_hashing.throttle(request.client.host if request.client else None, email)
+    if limited:
+        return _retry_later(limited[0], 429, limited[1])
+
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT id, name, email, created_at, password_hash FROM users WHERE email=$1", email)
+    if not row:
+        return _json({"error": "invalid credentials"}, 401)
+    valid = await _hash_on_pool("verify", password_hashing.check_password_hash, row["password_hash"], password)
+    if valid is None:
+        return _retry_later("authentication is busy, try again shortly", 503, 1)
+    if not valid:
+        return _json({"error": "invalid credentials"}, 401)
+    if password_hashing.needs_rehash(row["password_hash"]):
+        password_hashing.rehash_later(password, functools.partial(core._store_rehash, row["id"], row["password_hash"]))
+    token = core._create_token(row["id"], core._user_profile((row["id"], row["name"], row["email"], row["created_at"])))
+    return _json({"token": token, "user": {"id": row["id"], "name": row["name"], "email": row["email"]}})
+
+
+@_handles_errors
+async def auth_me(request):
+    auth = request.headers.get("authorization")
+    if not auth or not auth.startswith("Bearer "):
+        return _json({"error": "missing token"}, 401)
+    decoded = core._decode_token(auth.split(" ", 1)[1].strip())
+    if not decoded or not decoded.get("user_id"):
+        return _json({"error": "invalid token"}, 401)
+    user_id = int(decoded.get("user_id"))
+    profile = auth_context.embedded_profile(decoded) or auth_context.cached_profile(user_id)
+    if profile is None:
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT id, name, email, created_at FROM users WHERE id=$1", user_id)
+        if not row:
+            return _json({"error": "user not found"}, 404)
+        profile = core._user_profile(tuple(row))
+        auth_context.store_profile(user_id, profile)
+    return _json(profile)
+
+
+async def _send_rest(provider, req):
+    """POST a request built by app._<provider>_request over the shared async client."""
+    try:
+        if provider != 'mailtrap':
+            resp = await http.post(**req)
+            if resp.is_success:
+                return True, f'sent-via-{provider}'
+            return False, f'{provider}:{resp.status_code}:{resp.text}'
+        errors = []
+        for scheme, variant in core._mailtrap_auth_variants(req):
+            resp = await http.post(**variant)
+            if resp.is_success:
+                core._mailtrap_auth_worked(scheme)
+                return True, 'sent-via-mailtrap'
+            errors.append(f'{resp.status_code}:{resp.text}')
+            if resp.status_code not in (401, 403):
+                break
+        return False, 'mailtrap:' + ' | '.join(errors)
+    except Exception as e:
+        return False, f'{provider}-exception:{str(e)}'
+
+
+async def _deliver(transport, m):
+    """mail_scheduler deliver hook: REST providers over the async client, SMTP in a worker thread."""
+    from_email, from_name = core._sender()
+    if transport.name == 'mailtrap':
+        req, err = core._mailtrap_request(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, from_name, m.html_body, m.text_body)
+    elif transport.name == 'sendgrid':
+        req, err = core._sendgrid_request(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, m.html_body, m.text_body)
+    elif transport.name == 'mailgun':
+        req, err = core._mailgun_request(m.pdf_bytes, m.filename, m.to_email, m.subject, from_email, m.html_body, m.text_body)
+    else:
+        return await asyncio.to_thread(transport.send, m)
+    return (False, err) if err else await _send_rest(transport.name, req)
+
+
+async def _send_bytes_via_providers(pdf_bytes, filename, to_email, subject, data=None):
+    """Async counterpart of app._send_bytes_via_providers, with the same provider order and quotas."""
+    html_body, text_body = await asyncio.to_thread(core._result_bodies, data)  # may load the grading rules
+    message = mail_scheduler.Message(pdf_bytes, filename, to_email, subject, html_body, text_body)
+    return await core._mail_scheduler().send_async(message, _deliver)
+
+
+async def _email_result(data, to_email, subject, include_message):
+    pdf_bytes = await asyncio.to_thread(core._generate_pdf_bytes, data)
+    filename = core._result_filename(data)
+    ok, msg = await _send_bytes_via_providers(pdf_bytes, filename, to_email, subject, data)
+    if not ok:
+        saved = await asyncio.to_thread(core._save_failed_pdf, pdf_bytes, filename, to_email)
+        details = {'error': msg}
+        if saved:
+            details['saved'] = f"/failed-emails/{saved}"
+        return _json(details, 500)
+    return _json({'ok': True, 'message': msg} if include_message else {'ok': True})
+
+
+@_handles_errors
+async def email_submission(request):
+    payload = await request.json()
+    sid = payload.get('id') or payload.get('submission_id')
+    if not sid:
+        return _json({'error': 'missing submission id'}, 400)
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT id, data, created_at FROM submissions WHERE id=$1", int(sid))
+    if not row:
+        return _json({'error': 'submission not found'}, 404)
+    data = row["data"]
+    to_email = (payload.get('email') or (data.get('student') or {}).get('email'))
+    if not to_email:
+        return _json({'error': 'no recipient email found in submission; provide email in body'}, 400)
+    subject = payload.get('subject') or f"Result — {(data.get('student') or {}).get('name','Student')}"
+    return await _email_result(data, to_email, subject, include_message=False)
+
+
+@_handles_errors
+async def email_now(request):
+    payload = await request.json()
+    if not payload:
+        return _json({'error': 'missing json payload'}, 400)
+    data = payload.get('result') or payload.get('data') or payload
+    to_email = payload.get('email') or (data.get('student') or {}).get('email')
+    subject = payload.get('subject') or f"Result — {(data.get('student') or {}).get('name','Student')}"
+    if not to_email:
+        return _json({'error': 'recipient email not provided in payload or student record'}, 400)
+    return await _email_result(data, to_email, subject, include_message=True)
+
+
+async def index(_request):
+    return _json({"status": "ok"})
+
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET"]),
+        Route("/submissions", list_submissions, methods=["GET"]),
+        Route("/analytics", analytics, methods=["GET"]),
+        Route("/analytics/distribution", analytics_distribution, methods=["GET"]),
+        Route("/toppers", toppers, methods=["GET"]),
+        Route("/auth/register", auth_register, methods=["POST"]),
+        Route("/auth/login", auth_login, methods=["POST"]),
+        Route("/auth/me", auth_me, methods=["GET"]),
+        Route("/email-submission", email_submission, methods=["POST"]),
+        Route("/email-now", email_now, methods=["POST"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(GZipMiddleware, minimum_size=compression.COMPRESS_MIN_SIZE),
+    ],
+    lifespan=lifespan,
+)
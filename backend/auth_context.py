@@ -0,0 +1,101 @@
+"""Cache of verified bearer tokens and user profiles.
+
+A token is verified once and its claims are kept for AUTH_CACHE_TTL seconds
+(never past its own exp) under the SHA-256 of the token, so repeated requests
+with the same token skip the signature check.  Profiles for /auth/me come
+from the token itself when it embeds one (AUTH_EMBED_PROFILE, on by default),
+otherwise from a per-user cache in front of the users table.
+
+The app never changes a user's name or email after registration, so
+nothing is invalidated.  Both caches are per process and hold at most
+AUTH_CACHE_SIZE entries; a change made directly in the users table shows in
+/auth/me once the cached profile expires (AUTH_CACHE_TTL) and, for profiles
+embedded in tokens, once the user logs in again (tokens live 24 hours).  Set
+AUTH_EMBED_PROFILE=0 where users are edited outside the app to bound that
+staleness by AUTH_CACHE_TTL alone.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL") or 300)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE") or 10000)
+AUTH_EMBED_PROFILE = (os.getenv("AUTH_EMBED_PROFILE") or "1").strip().lower() in ("1", "true", "yes", "on")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_claims = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_profiles = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def claims(token, verify):
+    """Claims of `token`, verified with verify(token) on a cache miss; None when invalid."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = _claims.get(key)
+    if cached is not None:
+        if cached.get("exp") and cached["exp"] <= time.time():
+            _claims.pop(key)
+            return None
+        return cached
+    decoded = verify(token)
+    if decoded:
+        lifetime = decoded["exp"] - time.time() if decoded.get("exp") else AUTH_CACHE_TTL
+        _claims.set(key, decoded, lifetime)
+    return decoded
+
+
+def embedded_profile(decoded):
+    """The profile carried in the token, if any."""
+    profile = (decoded or {}).get("profile")
+    if not profile or not decoded.get("user_id"):
+        return None
+    return profile
+
+
+def cached_profile(user_id):
+    return _profiles.get(int(user_id))
+
+
+def store_profile(user_id, profile):
+    _profiles.set(int(user_id), profile)
@@ -0,0 +1,368 @@
+"""Benchmark suite for the backend hot paths.
+
+Run against a local, disposable Postgres database -- `generate` writes synthetic
+rows into `submissions` and `run --submit` inserts (and then deletes) more.
+
+Usage:
+    python benchmark.py generate --students 100000 --min-subjects 4 --max-subjects 9 --truncate
+    python benchmark.py run --output bench_results.json
+    python benchmark.py coldstart --runs 10 --budget-ms 250
+    python benchmark.py compare baseline.json bench_results.json --threshold 10
+
+`--database-url` overrides DATABASE_URL for all subcommands.
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COURSES = ["B.Tech CSE", "B.Tech ECE", "BCA", "MCA", "B.Sc Physics", "B.Com", "BBA", "M.Tech CSE"]
+UNIVERSITIES = ["State University", "Aryabhatta Knowledge University", "Patliputra University"]
+SUBJECTS = [
+    "Mathematics", "Physics", "Chemistry", "Data Structures", "Operating Systems", "Computer Networks",
+    "Database Systems", "Digital Electronics", "English", "Economics", "Accounting", "Statistics",
+    "Software Engineering", "Machine Learning", "Discrete Mathematics", "Environmental Science",
+]
+ACADEMIC_YEARS = ["2021-22", "2022-23", "2023-24", "2024-25", "2025-26"]
+BENCH_ROLL_PREFIX = "BENCH-SUBMIT-"
+
+
+def synthetic_submission(rng, i, min_subjects, max_subjects):
+    """Return one submission document shaped like the web client's ResultData."""
+    n_subjects = rng.randint(min_subjects, max_subjects)
+    subjects = []
+    for j, name in enumerate(rng.sample(SUBJECTS, min(n_subjects, len(SUBJECTS)))):
+        max_marks = rng.choice((50, 100, 100, 100))
+        # Skewed towards passing marks with a realistic failing tail
+        marks = max(0, min(max_marks, int(rng.gauss(0.62, 0.18) * max_marks)))
+        subjects.append({"id": f"s{i}-{j}", "name": name, "maxMarks": max_marks, "marksObtained": marks})
+    return {
+        "id": f"bench-{i}",
+        "student": {
+            "name": f"Student {i:07d}",
+            "rollNumber": f"R{i:07d}",
+            "registrationNumber": f"REG-{i:07d}",
+            "universityName": rng.choice(UNIVERSITIES),
+            "courseName": rng.choice(COURSES),
+            "semester": rng.randint(1, 8),
+            "academicYear": rng.choice(ACADEMIC_YEARS),
+            "email": f"student{i}@example.com",
+        },
+        "subjects": subjects,
+    }
+
+
+def cmd_generate(args):
+    import psycopg2
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    cur = conn.cursor()
+    if args.truncate:
+        cur.execute("TRUNCATE submissions RESTART IDENTITY;")
+        conn.commit()
+
+    base_time = datetime.now(timezone.utc) - timedelta(days=365 * len(ACADEMIC_YEARS))
+    written = 0
+    start = time.perf_counter()
+    while written < args.students:
+        batch = min(args.batch_size, args.students - written)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for i in range(written, written + batch):
+            doc = synthetic_submission(rng, i, args.min_subjects, args.max_subjects)
+            created = base_time + timedelta(seconds=i * 60)
+            writer.writerow([json.dumps(doc, separators=(",", ":")), doc["student"]["academicYear"], created.isoformat()])
+        buf.seek(0)
+        cur.copy_expert("COPY submissions (data, academic_year, created_at) FROM STDIN WITH (FORMAT csv)", buf)
+        conn.commit()
+        written += batch
+        print(f"Inserted {written}/{args.students}", file=sys.stderr)
+
+    cur.execute("ANALYZE submissions;")
+    conn.commit()
+    cur.close()
+    import trends
+    import grading
+    trends.refresh_after_import(conn)
+    grading.regrade_after_import(conn)
+    conn.close()
+    print(f"Generated {written} submissions in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+def _time(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "min_s": samples[0],
+        "median_s": statistics.median(samples),
+        "p95_s": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "mean_s": statistics.fmean(samples),
+    }
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def cmd_run(args):
+    import app as backend
+
+    client = backend.app.test_client()
+
+    def get(path):
+        def call():
+            resp = client.get(path)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{path}: {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+        return call
+
+    conn = backend.get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM submissions;")
+    row_count = cur.fetchone()[0]
+    cur.execute("SELECT data FROM submissions ORDER BY id LIMIT 1;")
+    sample = cur.fetchone()
+    cur.close()
+    conn.close()
+    sample_doc = sample[0] if sample else synthetic_submission(random.Random(args.seed), 0, 6, 6)
+
+    course, semester = COURSES[0], "3"
+    cases = {
+        "fetch_rows.no_filter": lambda: backend._fetch_rows(filters={}, limit=100),
+        "fetch_rows.q": lambda: backend._fetch_rows(filters={"q": "Student 00012"}, limit=100),
+        "fetch_rows.course": lambda: backend._fetch_rows(filters={"course": course}, limit=100),
+        "fetch_rows.semester": lambda: backend._fetch_rows(filters={"semester": semester}, limit=100),
+        "fetch_rows.user_only": lambda: backend._fetch_rows(filters={"user_only": "1", "user_id": 1}, limit=100),
+        "fetch_rows.course_semester_10k": lambda: backend._fetch_rows(filters={"course": course, "semester": semester}, limit=10000),
+        "analytics.all": get("/analytics"),
+        "analytics.course_semester": get(f"/analytics?course={course}&semester={semester}"),
+        "toppers.all": get("/toppers"),
+        "toppers.course_semester": get(f"/toppers?course={course}&semester={semester}"),
+        "generate_pdf_bytes": lambda: backend._generate_pdf_bytes(sample_doc),
+    }
+    if args.only:
+        cases = {k: v for k, v in cases.items() if any(k.startswith(p) for p in args.only)}
+
+    results = {}
+    for name, fn in cases.items():
+        repeat = max(1, args.repeat // 4) if name == "generate_pdf_bytes" else args.repeat
+        results[name] = _time(fn, repeat)
+        print(f"{name:36s} median {results[name]['median_s'] * 1000:9.2f} ms", file=sys.stderr)
+
+    if args.submit:
+        rng = random.Random(args.seed)
+        docs = []
+        for i in range(args.submit):
+            doc = synthetic_submission(rng, i, 6, 6)
+            doc["student"]["rollNumber"] = f"{BENCH_ROLL_PREFIX}{i}"
+            docs.append(doc)
+        start = time.perf_counter()
+        for doc in docs:
+            resp = client.post("/submit", json=doc)
+            if resp.status_code not in (200, 201):
+                raise RuntimeError(f"/submit: {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+        elapsed = time.perf_counter() - start
+        results["submit.throughput"] = {"requests": len(docs), "total_s": elapsed, "rps": len(docs) / elapsed}
+        print(f"{'submit.throughput':36s} {len(docs) / elapsed:9.1f} req/s", file=sys.stderr)
+        conn = backend.get_conn()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM submissions WHERE data->'student'->>'rollNumber' LIKE %s;", (BENCH_ROLL_PREFIX + "%",))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_rev": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rows": row_count,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+# Runs in a fresh interpreter per sample, like a serverless cold start of api/submit.py
+COLDSTART_SCRIPT = r"""
+import sys, json, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import submit
+t1 = time.perf_counter()
+
+class Request:
+    method = "POST"
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+def call(doc):
+    start = time.perf_counter()
+    resp = submit.handler(Request(json.dumps(doc)))
+    if resp["statusCode"] not in (200, 201):
+        raise SystemExit(resp["body"])
+    return (time.perf_counter() - start) * 1000
+
+docs = json.loads(sys.stdin.read())
+first = call(docs[0])
+warm = [call(d) for d in docs[1:]]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_ms": first, "warm_ms": warm}))
+"""
+
+
+def cmd_coldstart(args):
+    import app as backend
+
+    api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+    rng = random.Random(args.seed)
+    samples, warm = [], []
+    for run in range(args.runs):
+        docs = []
+        for i in range(args.warm + 1):
+            doc = synthetic_submission(rng, i, 6, 6)
+            doc["student"]["rollNumber"] = f"{BENCH_ROLL_PREFIX}cold-{run}-{i}"
+            docs.append(doc)
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", COLDSTART_SCRIPT, api_dir], input=json.dumps(docs),
+                             capture_output=True, text=True, env=os.environ.copy())
+        if out.returncode != 0:
+            raise RuntimeError(f"api/submit.py failed: {out.stderr.strip() or out.stdout.strip()}")
+        result = json.loads(out.stdout)
+        result["process_ms"] = (time.perf_counter() - start) * 1000
+        samples.append(result)
+        warm.extend(result.pop("warm_ms"))
+
+    # The long-running Flask server on the same database, for comparison
+    client = backend.app.test_client()
+    flask_ms = []
+    for i in range(max(args.warm, 1) * args.runs):
+        doc = synthetic_submission(rng, i, 6, 6)
+        doc["student"]["rollNumber"] = f"{BENCH_ROLL_PREFIX}flask-{i}"
+        start = time.perf_counter()
+        resp = client.post("/submit", json=doc)
+        flask_ms.append((time.perf_counter() - start) * 1000)
+        if resp.status_code not in (200, 201):
+            raise RuntimeError(f"/submit: {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+
+    conn = backend.get_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM submissions WHERE data->'student'->>'rollNumber' LIKE %s;", (BENCH_ROLL_PREFIX + "%",))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    cold = [s["import_ms"] + s["first_ms"] for s in samples]
+    report = {
+        "runs": args.runs,
+        "import_ms": statistics.median(s["import_ms"] for s in samples),
+        "first_invocation_ms": statistics.median(s["first_ms"] for s in samples),
+        "cold_start_ms": statistics.median(cold),
+        "process_ms": statistics.median(s["process_ms"] for s in samples),
+        "warm_invocation_ms": statistics.median(warm) if warm else None,
+        "flask_submit_ms": statistics.median(flask_ms),
+        "budget_ms": args.budget_ms,
+    }
+    for key, value in report.items():
+        if isinstance(value, float):
+            print(f"{key:24s} {value:9.2f}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["cold_start_ms"] > args.budget_ms:
+        print(f"cold start {report['cold_start_ms']:.1f} ms exceeds the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)["results"]
+    with open(args.current) as f:
+        cur = json.load(f)["results"]
+
+    regressions = 0
+    for name in sorted(set(base) & set(cur)):
+        if "median_s" in base[name]:
+            old, new = base[name]["median_s"], cur[name]["median_s"]
+            change = (new - old) / old * 100 if old else 0.0
+        else:
+            # throughput: higher is better, report as a slowdown percentage
+            old, new = base[name]["rps"], cur[name]["rps"]
+            change = (old - new) / old * 100 if old else 0.0
+        flag = "REGRESSION" if change > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{name:36s} {old:12.6f} -> {new:12.6f} {change:+7.1f}% {flag}")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend benchmark suite")
+    parser.add_argument("--database-url", help="override DATABASE_URL")
+    parser.add_argument("--seed", type=int, default=42)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="insert synthetic submissions")
+    gen.add_argument("--students", type=int, default=10000)
+    gen.add_argument("--min-subjects", type=int, default=4)
+    gen.add_argument("--max-subjects", type=int, default=8)
+    gen.add_argument("--batch-size", type=int, default=20000)
+    gen.add_argument("--truncate", action="store_true", help="empty submissions first")
+
+    run = sub.add_parser("run", help="time the hot paths and emit JSON results")
+    run.add_argument("--repeat", type=int, default=20)
+    run.add_argument("--submit", type=int, default=200, help="number of /submit requests for the throughput case (0 to skip)")
+    run.add_argument("--only", nargs="*", help="only run cases whose name starts with one of these prefixes")
+    run.add_argument("--output", help="write JSON results to this file instead of stdout")
+
+    cold = sub.add_parser("coldstart", help="time api/submit.py cold and warm invocations against the Flask /submit")
+    cold.add_argument("--runs", type=int, default=10, help="fresh interpreters to start")
+    cold.add_argument("--warm", type=int, default=20, help="warm invocations per interpreter")
+    cold.add_argument("--budget-ms", type=float, default=250.0,
+                      help="fail when the median import + first invocation exceeds this")
+    cold.add_argument("--output", help="write the JSON report to this file")
+
+    cmp_ = sub.add_parser("compare", help="compare two result files; exits 1 on regressions")
+    cmp_.add_argument("baseline")
+    cmp_.add_argument("current")
+    cmp_.add_argument("--threshold", type=float, default=10.0, help="percent slowdown that counts as a regression")
+
+    args = parser.parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    if args.command != "compare" and not os.getenv("DATABASE_URL"):
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+
+    {"generate": cmd_generate, "run": cmd_run, "coldstart": cmd_coldstart, "compare": cmd_compare}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Negotiated gzip/brotli compression for large JSON and text responses.
+
+Responses smaller than COMPRESS_MIN_SIZE bytes, already-encoded responses and
+file downloads (direct passthrough) are left untouched.  Brotli is used when the
+`brotli` package is installed and the client accepts it, gzip otherwise.
+"""
+import os
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE") or 1024)
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL") or 5)
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY") or 4)
+
+_COMPRESSIBLE = ("application/json", "text/")
+
+
+def _accepted(header):
+    """Return {encoding: q} from an Accept-Encoding header."""
+    out = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token.strip().lower()] = q
+    return out
+
+
+def choose_encoding(header):
+    accepted = _accepted(header)
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def init_app(app):
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or "Content-Encoding" in response.headers
+                or not (response.mimetype or "").startswith(_COMPRESSIBLE)):
+            return response
+        response.vary.add("Accept-Encoding")
+        length = response.calculate_content_length()
+        if length is not None and length < COMPRESS_MIN_SIZE:
+            return response
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if encoding == "br":
+            data = brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            data = gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        return response
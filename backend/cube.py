@@ -0,0 +1,148 @@
+"""Cube queries over submission_subject_facts for /analytics/cube.
+
+The client names the dimensions to group by and the measures to compute; the
+query is a single GROUP BY (optionally CUBE, ROLLUP or explicit GROUPING
+SETS) over the per-subject facts table that triggers keep in step with
+submissions (migration 0004), so a new dashboard view needs no backend code.
+Only names from DIMENSIONS and MEASURES ever reach the SQL text; filter
+values are parameters.
+
+Scores are marks as a percentage of the subject's maxMarks and `passed`
+means at least the passPercent of the current grading rule set of the
+submission's university (grading.py; the subject_results view of migration
+0010 joins each fact to it).  Without the subject dimension a row aggregates
+subject entries, so `count` counts entries while `students` counts
+submissions.  Subjects are grouped by their catalog id (migration 0006) and
+reported under the catalog name.
+"""
+
+# API name -> column of FROM_SQL
+DIMENSIONS = {
+    "universityName": "university",
+    "courseName": "course",
+    "semester": "semester",
+    "academicYear": "academic_year",
+    "subject": "subjects.name",
+}
+
+# API name -> aggregate; "students" is special-cased in build()
+MEASURES = {
+    "avg": "avg(score)",
+    "avg_marks": "avg(marks)",
+    "count": "count(*)",
+    "students": None,
+    "pass_rate": "avg(passed::int) * 100",
+    "min": "min(score)",
+    "max": "max(score)",
+    "stddev": "stddev_pop(score)",
+}
+DEFAULT_MEASURES = ("avg", "count", "pass_rate")
+
+# Query parameter -> condition on one parameter; any spelling of a subject finds its catalog id
+FILTERS = {
+    "university": "lower(university) = lower(%s)",
+    "course": "lower(course) = lower(%s)",
+    "semester": "semester = %s",
+    "academic_year": "academic_year = %s",
+    "subject": "subject_id = subject_lookup(%s)",
+}
+
+FROM_SQL = "subject_results LEFT JOIN subjects ON subjects.id = subject_results.subject_id"
+
+TOTALS = ("none", "rollup", "cube")
+
+
+class CubeError(ValueError):
+    """Invalid cube request; the message is safe to return to the client."""
+
+
+def _names(value, allowed, kind):
+    names = [n.strip() for n in (value or "").split(",") if n.strip()]
+    unknown = [n for n in names if n not in allowed]
+    if unknown:
+        raise CubeError(f"unknown {kind}: {', '.join(unknown)} (allowed: {', '.join(allowed)})")
+    return list(dict.fromkeys(names))
+
+
+def parse(args):
+    """Validate query args into (dimensions, measures, sets, filters).
+    `sets` is a list of dimension lists (GROUPING SETS), or the string "rollup"/"cube", or None.
+    """
+    dims = _names(args.get("dimensions"), DIMENSIONS, "dimension")
+    measures = _names(args.get("measures"), MEASURES, "measure") or list(DEFAULT_MEASURES)
+    sets = None
+    if args.get("sets") is not None:
+        # sets=courseName,semester;courseName;  -> GROUPING SETS ((course, semester), (course), ())
+        sets = [_names(part, DIMENSIONS, "dimension") for part in args.get("sets").split(";")]
+        missing = [d for d in dims if not any(d in s for s in sets)]
+        if missing:
+            raise CubeError(f"dimensions not in any grouping set: {', '.join(missing)}")
+        for s in sets:
+            dims.extend(d for d in s if d not in dims)
+    else:
+        totals = (args.get("totals") or "none").strip().lower()
+        if totals not in TOTALS:
+            raise CubeError(f"totals must be one of {', '.join(TOTALS)}")
+        if totals != "none":
+            sets = totals
+    filters = {k: str(args.get(k)).strip() for k in FILTERS if args.get(k)}
+    return dims, measures, sets, filters
+
+
+def _students_sql(dims, filters):
+    # Every submission has exactly one ordinal-1 fact, so counting those counts submissions without
+    # a DISTINCT; once rows are split by subject (or filtered to one), each entry is a submission.
+    per_submission = "count(*) FILTER (WHERE ordinal = 1)"
+    if "subject" in filters:
+        return "count(*)"
+    if "subject" in dims:
+        return f"CASE WHEN GROUPING({DIMENSIONS['subject']}) = 0 THEN count(*) ELSE {per_submission} END"
+    return per_submission
+
+
+def build(dims, measures, sets, filters, max_rows):
+    """Return (sql, params) selecting dims, a GROUPING() bitmask and measures, at most max_rows + 1 rows."""
+    cols = [DIMENSIONS[d] for d in dims]
+    where, params = [], []
+    for key, value in filters.items():
+        where.append(FILTERS[key])
+        params.append(value)
+
+    select = list(cols)
+    select.append(f"GROUPING({', '.join(cols)})" if cols else "0")
+    for m in measures:
+        select.append(_students_sql(dims, filters) if m == "students" else MEASURES[m])
+
+    if sets == "cube":
+        group_sql = f"GROUP BY CUBE({', '.join(cols)})"
+    elif sets == "rollup":
+        group_sql = f"GROUP BY ROLLUP({', '.join(cols)})"
+    elif sets is not None:
+        group_sql = "GROUP BY GROUPING SETS (" + ", ".join(
+            "(" + ", ".join(DIMENSIONS[d] for d in s) + ")" for s in sets) + ")"
+    else:
+        group_sql = f"GROUP BY {', '.join(cols)}" if cols else ""
+    if sets is not None and not cols:
+        group_sql = ""
+
+    order_sql = f"ORDER BY {', '.join(str(i + 1) for i in range(len(cols) + 1))}" if cols else ""
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    sql = (f"SELECT {', '.join(select)} FROM {FROM_SQL} {where_sql} {group_sql} "
+           f"{order_sql} LIMIT {int(max_rows) + 1};")
+    return sql, params
+
+
+def shape(rows, dims, measures, max_rows):
+    """Response body for the rows of build(); `rolledUp` lists the dimensions a row totals over."""
+    out = []
+    n = len(dims)
+    for row in rows[:max_rows]:
+        grouping = int(row[n])
+        item = {d: row[i] for i, d in enumerate(dims)}
+        # GROUPING(a, b, c) sets bit (n - 1 - i) when dimension i is aggregated away
+        item["rolledUp"] = [d for i, d in enumerate(dims) if grouping & (1 << (n - 1 - i))]
+        for j, m in enumerate(measures):
+            value = row[n + 1 + j]
+            item[m] = round(float(value), 4) if value is not None and m not in ("count", "students") else value
+        out.append(item)
+    return {"dimensions": dims, "measures": measures, "rows": out, "truncated": len(rows) > max_rows}
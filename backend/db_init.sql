@@ -1,6 +1,15 @@
+-- Minimal bootstrap for psql users; the full schema is in migrations/ (python migrate.py)
 -- Create submissions table to store arbitrary form data as JSON
 CREATE TABLE IF NOT EXISTS submissions (
     id SERIAL PRIMARY KEY,
     data JSONB NOT NULL,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
+
+-- Academic year (partition key when partitioned, see partitions.py)
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS academic_year TEXT NOT NULL DEFAULT '';
+CREATE INDEX IF NOT EXISTS idx_submissions_academic_year ON submissions (academic_year);
+
+-- Idempotency keys sent by clients on POST /submit
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_submissions_idempotency_year ON submissions (idempotency_key, academic_year);
@@ -0,0 +1,114 @@
+"""Read-replica routing for read-only queries.
+
+Replicas come from DATABASE_REPLICA_URLS (comma separated) and are used
+round-robin.  A daemon thread probes every replica each
+REPLICA_CHECK_INTERVAL seconds for reachability and replay lag (at most
+REPLICA_PROBE_TIMEOUT seconds per connect), so requests only read the last
+known state and never wait on a probe.  A replica that is down or more than
+REPLICA_MAX_LAG_SECONDS behind is skipped until a probe finds it usable
+again; until the first probe, and when no replica qualifies, reads go to the
+primary.  Users who wrote within REPLICA_STICKY_SECONDS read from the primary
+so they see their own writes (the REPLICA_STICKY_MAX_USERS most recent
+writers per process).
+"""
+import os
+import sys
+import time
+import threading
+import itertools
+
+import psycopg2
+
+import auth_context
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS") or 5)
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL") or 10)
+REPLICA_PROBE_TIMEOUT = int(os.getenv("REPLICA_PROBE_TIMEOUT") or 2)
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS") or 30)
+REPLICA_STICKY_MAX_USERS = int(os.getenv("REPLICA_STICKY_MAX_USERS") or 10000)
+
+# 0 when the replica has replayed everything it received, otherwise seconds since the last replayed commit
+_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END;
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, primary_url, replica_urls=None):
+        self.primary_url = primary_url
+        self.replicas = [u.strip() for u in (replica_urls or "").split(",") if u.strip()]
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self._state = {url: {"healthy": False, "lag": None} for url in self.replicas}
+        self._writes = auth_context.TTLCache(REPLICA_STICKY_MAX_USERS, REPLICA_STICKY_SECONDS)
+        self._lock = threading.Lock()
+        self._prober = None
+        self._prober_pid = None
+
+    def _probe(self, url):
+        try:
+            conn = psycopg2.connect(url, connect_timeout=REPLICA_PROBE_TIMEOUT,
+                                    options=f"-c statement_timeout={REPLICA_PROBE_TIMEOUT * 1000}")
+            try:
+                cur = conn.cursor()
+                cur.execute(_LAG_SQL)
+                lag = float(cur.fetchone()[0] or 0)
+                cur.close()
+            finally:
+                conn.close()
+            return lag <= REPLICA_MAX_LAG_SECONDS, lag
+        except Exception:
+            return False, None
+
+    def probe_all(self):
+        """Probe every replica once and record the results."""
+        for url in self.replicas:
+            healthy, lag = self._probe(url)
+            self._state[url] = {"healthy": healthy, "lag": lag}
+
+    def _run_prober(self):
+        while True:
+            try:
+                self.probe_all()
+            except Exception as e:
+                print(f"Replica probe failed: {e}", file=sys.stderr)
+            time.sleep(REPLICA_CHECK_INTERVAL)
+
+    def _ensure_prober(self):
+        # Started on first use and again in a forked worker, where the parent's thread does not exist
+        if self._prober is not None and self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober is not None and self._prober_pid == os.getpid():
+                return
+            self._prober = threading.Thread(target=self._run_prober, name="replica-probe", daemon=True)
+            self._prober_pid = os.getpid()
+            self._prober.start()
+
+    def read_url(self):
+        """Next replica URL the last probe found usable, or the primary when none qualifies."""
+        if not self.replicas:
+            return self.primary_url
+        self._ensure_prober()
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                url = next(self._cycle)
+            if self._state[url]["healthy"]:
+                return url
+        return self.primary_url
+
+    def mark_failed(self, url):
+        """Take a replica out of rotation until a probe finds it usable (e.g. after a failed connect)."""
+        state = self._state.get(url)
+        if state is not None:
+            state["healthy"] = False
+
+    def note_write(self, user_id):
+        if self.replicas and user_id:
+            self._writes.set(user_id, True)
+
+    def recent_writer(self, user_id):
+        return bool(user_id) and self._writes.get(user_id) is not None
@@ -0,0 +1,82 @@
+"""One-off job: remove duplicate submissions and create the upsert unique index.
+
+Duplicates are rows sharing (rollNumber, semester, academicYear); the most recent
+row (by created_at, then id) is kept.  Rows without a roll number are left alone.
+Run init_db.py first so the academic_year column is present and backfilled.
+
+Usage:
+    python dedup_submissions.py            # delete duplicates and create the index
+    python dedup_submissions.py --dry-run  # only report what would be deleted
+"""
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Keep in sync with UPSERT_KEY_SQL / UPSERT_PREDICATE_SQL in app.py
+KEY_SQL = "(data->'student'->>'rollNumber'), (data->'student'->>'semester'), academic_year"
+PREDICATE_SQL = "COALESCE(data->'student'->>'rollNumber', '') <> ''"
+
+DUPLICATES_SQL = f"""
+SELECT id FROM (
+    SELECT id, row_number() OVER (PARTITION BY {KEY_SQL} ORDER BY created_at DESC, id DESC) AS rn
+    FROM submissions
+    WHERE {PREDICATE_SQL}
+) ranked
+WHERE rn > 1
+"""
+
+# The earlier index keyed on the academicYear JSON expression cannot be used on a partitioned table
+INDEX_SQL = f"""
+DROP INDEX IF EXISTS idx_submissions_upsert_key;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_submissions_upsert_year ON submissions ({KEY_SQL}) WHERE {PREDICATE_SQL};
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove duplicate submissions per (rollNumber, semester, academicYear).")
+    parser.add_argument("--dry-run", action="store_true", help="report duplicates without deleting anything")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows deleted per transaction")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+
+    import psycopg2
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
+
+    cur.execute(f"SELECT count(*) FROM ({DUPLICATES_SQL}) d;")
+    total = cur.fetchone()[0]
+    print(f"Found {total} duplicate submission rows")
+    if args.dry_run:
+        cur.close()
+        conn.close()
+        return
+
+    deleted = 0
+    while True:
+        cur.execute(f"DELETE FROM submissions WHERE id IN ({DUPLICATES_SQL} LIMIT %s);", (args.batch_size,))
+        n = cur.rowcount
+        conn.commit()
+        deleted += n
+        if n:
+            print(f"Deleted {deleted}/{total}")
+        if n < args.batch_size:
+            break
+
+    cur.execute(INDEX_SQL)
+    conn.commit()
+    print("Created/verified unique index idx_submissions_upsert_year")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Vectorized mark distributions for /analytics/distribution.
+
+Marks arrive as flat arrays with one element per subject entry (submission
+id, subject index, marks, max marks), normally decoded straight from a binary
+COPY so no Python object is built per mark.  They are scattered into a
+students x subjects matrix stored column-major, so every subject is one
+contiguous column of scores (marks as a percentage of that subject's
+maxMarks, NaN where a student has no such subject).  Percentiles, grade
+bands, standard deviations and the correlation between subjects are then
+whole-array operations, which keeps a few hundred thousand students well
+under a second once the data is loaded.
+
+Pass/fail and the bands follow the grading rule sets (grading.py): each
+student is graded under the current rule set of their university, so the
+overall bands count the grades' statuses, and a subject score passes at that
+rule set's passPercent and is banded by the same cut-offs as the overall
+percentage.
+"""
+import numpy as np
+
+import grading
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+# Column types (big-endian, as COPY sends them) of the rows decode_copy() reads by default:
+# (id int8, subject int4, marks float8, max float8); DISTRIBUTION_COLUMNS adds the rule set index
+ENTRY_COLUMNS = (">i8", ">i4", ">f8", ">f8")
+DISTRIBUTION_COLUMNS = ENTRY_COLUMNS + (">i4",)
+
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _copy_row(columns):
+    """Fixed-width row of a binary COPY: field count, then length and value of each column."""
+    fields = [("fields", ">i2")]
+    for i, column in enumerate(columns):
+        fields += [(f"len{i}", ">i4"), (f"col{i}", column)]
+    return np.dtype(fields)
+
+
+def decode_copy(data, columns=ENTRY_COLUMNS):
+    """One array per column from `COPY ... TO STDOUT (FORMAT binary)` output.
+    The columns must be NOT NULL and of the fixed-width `columns` types, in that order.
+    """
+    row = _copy_row(columns)
+    data = memoryview(data)
+    if bytes(data[:11]) != _COPY_SIGNATURE:
+        raise ValueError("not a binary COPY stream")
+    start = 19 + int.from_bytes(data[15:19], "big")  # signature, flags, header extension
+    end = len(data) - 2  # int16 -1 trailer
+    if (end - start) % row.itemsize:
+        raise ValueError("unexpected binary COPY row layout")
+    rows = np.frombuffer(data[start:end], dtype=row)
+    if rows.size and not ((rows["fields"] == len(columns)).all()
+                          and all((rows[f"len{i}"] == np.dtype(c).itemsize).all() for i, c in enumerate(columns))):
+        raise ValueError("unexpected binary COPY row layout")
+    return tuple(rows[f"col{i}"].astype(np.dtype(c).newbyteorder("=")) for i, c in enumerate(columns))
+
+
+def _number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def from_rows(rows, max_subjects, rulebook):
+    """(names, ids, subjects, marks, maxm, rule_index, rulesets) from (id, data, created_at) rows; used
+    without Postgres.  Subjects are the `max_subjects` most frequent names, numbered from 1; 0 marks any
+    other subject.  Rule sets come from `rulebook` (grading.RuleBook), indexed as grading.ruleset_index().
+    """
+    keys, _rule_ids, rulesets = grading.ruleset_index(rulebook)
+    rule_of = {k: i + 1 for i, k in enumerate(keys)}
+    entries = []
+    frequency = {}
+    for rid, data, _created in rows:
+        subjects = data.get("subjects") if isinstance(data, dict) else None
+        student = data.get("student") if isinstance(data, dict) else None
+        rule = rule_of.get(grading.university_key(student.get("universityName") if isinstance(student, dict) else None), 0)
+        for s in subjects if isinstance(subjects, list) else []:
+            name = str(s.get("name", "")).strip()
+            marks = _number(s.get("marksObtained"), 0.0)
+            maxm = _number(s.get("maxMarks"), 0.0) or 100.0
+            entries.append((rid, name, marks, maxm, rule))
+            if name:
+                frequency[name] = frequency.get(name, 0) + 1
+    names = sorted(frequency, key=lambda n: (-frequency[n], n))[:max_subjects]
+    index = {n: i + 1 for i, n in enumerate(names)}
+    ids = np.fromiter((e[0] for e in entries), dtype=np.int64, count=len(entries))
+    subjects = np.fromiter((index.get(e[1], 0) for e in entries), dtype=np.int32, count=len(entries))
+    marks = np.fromiter((e[2] for e in entries), dtype=np.float64, count=len(entries))
+    maxm = np.fromiter((e[3] for e in entries), dtype=np.float64, count=len(entries))
+    rule_index = np.fromiter((e[4] for e in entries), dtype=np.int32, count=len(entries))
+    return names, ids, subjects, marks, maxm, rule_index, rulesets
+
+
+def _band_names(rulesets):
+    """Every band name of the rule sets, from the top, then their fail labels."""
+    return list(dict.fromkeys([b["name"] for r in rulesets for b in r["bands"]] + [r["failLabel"] for r in rulesets]))
+
+
+def _subject_bands(scores, rule, rulesets, band_names):
+    """(band index into band_names, passed) per students x subjects score; index -1 where there is no score."""
+    codes = np.full(scores.shape, -1, dtype=np.int16, order="F")
+    passed = np.zeros(scores.shape, dtype=bool, order="F")
+    for i, r in enumerate(rulesets):
+        rows = rule == i
+        if not rows.any():
+            continue
+        sub = scores[rows]
+        sub_codes = np.where(np.isnan(sub), -1, band_names.index(r["failLabel"])).astype(np.int16)
+        with np.errstate(invalid="ignore"):
+            sub_passed = sub >= r["passPercent"]
+            # Bands are sorted from the top: apply the lowest first so a higher one overwrites it
+            for band in reversed(r["bands"]):
+                sub_codes[sub_passed & (sub >= band["min"])] = band_names.index(band["name"])
+        codes[rows] = sub_codes
+        passed[rows] = sub_passed
+    return codes, passed
+
+
+def _column_percentiles(sorted_scores, counts, qs):
+    """Linear-interpolated percentiles (numpy's default method) of NaN-padded, column-sorted scores."""
+    cols = np.arange(sorted_scores.shape[1])
+    last = np.maximum(counts - 1, 0)
+    out = np.empty((len(qs), sorted_scores.shape[1]))
+    for i, q in enumerate(qs):
+        pos = last * (q / 100.0)
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo + 1, last)
+        low, high = sorted_scores[lo, cols], sorted_scores[hi, cols]
+        out[i] = low + (high - low) * (pos - lo)
+    out[:, counts == 0] = np.nan
+    return out
+
+
+def _correlation(scores, present):
+    """Pearson correlation of every pair of columns over the students that have both."""
+    x = np.where(present, scores, 0.0)
+    p = present.astype(np.float64)
+    n = p.T @ p                   # students having both subjects
+    sx = x.T @ p                  # sum of subject i over those students
+    sxx = (x * x).T @ p
+    sxy = x.T @ x
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sx.T / n
+        var_i = sxx - sx * sx / n
+        corr = cov / np.sqrt(var_i * var_i.T)
+    corr[(n < 2) | ~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def _clean(values, digits=4):
+    """Nested lists of rounded floats with NaN as None, for JSON."""
+    arr = np.asarray(np.round(np.asarray(values, dtype=np.float64), digits))
+    out = arr.astype(object)
+    out[np.isnan(arr)] = None
+    return out.tolist()
+
+
+def summarize(names, ids, subjects, marks, maxm, rule_index, rulesets, percentiles=DEFAULT_PERCENTILES):
+    """The /analytics/distribution body for flat per-subject-entry arrays.
+    `subjects` holds 1-based indexes into `names` (0: counted in totals only); `rule_index` picks each
+    entry's rule set from `rulesets` (validated, see grading.py), the same for every entry of a student.
+    """
+    qs = [float(q) for q in percentiles]
+    labels = [f"p{q:g}" for q in qs]
+    student = np.unique(ids, return_inverse=True)[1]
+
+    # Grades over every subject, as grading.regrade stores them
+    _ids, rule, _obtained, _total, percentage, status, _cgpa, _failed = grading.grade_arrays(ids, rule_index, marks, maxm, rulesets)
+    n = percentage.size
+    failed = status == np.array([r["failLabel"] for r in rulesets], dtype=object)[rule]
+    band_names = _band_names(rulesets)
+    overall_bands = {name: int((status == name).sum()) for name in band_names}
+
+    # students x subjects, column-major so each subject is contiguous; a repeated subject keeps its last entry
+    k = len(names)
+    scores = np.full((n, k), np.nan, order="F")
+    named = subjects > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores[student[named], subjects[named] - 1] = marks[named] / maxm[named] * 100
+    present = ~np.isnan(scores)
+    counts = present.sum(axis=0)
+    filled = np.where(present, scores, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = filled.sum(axis=0) / counts
+        stds = np.sqrt(np.where(present, (scores - means) ** 2, 0.0).sum(axis=0) / counts)
+    ordered = np.sort(scores, axis=0)  # NaN sorts last
+    subject_pct = _column_percentiles(ordered, counts, qs)
+    # Per-subject bands use the student's rule set on the subject's own score
+    codes, passed = _subject_bands(scores, rule, rulesets, band_names)
+    subject_bands = np.stack([(codes == b).sum(axis=0) for b in range(len(band_names))])
+    subject_passed = passed.sum(axis=0)
+    last = np.maximum(counts - 1, 0)
+
+    subjects_out = {}
+    for j, name in enumerate(names):
+        if not counts[j]:
+            continue
+        subjects_out[name] = {
+            "count": int(counts[j]),
+            "mean": _clean(means[j]),
+            "std": _clean(stds[j]),
+            "min": _clean(ordered[0, j]),
+            "max": _clean(ordered[last[j], j]),
+            "passRate": _clean(subject_passed[j] / counts[j] * 100),
+            "percentiles": dict(zip(labels, _clean(subject_pct[:, j]))),
+            "bands": dict(zip(band_names, (int(c) for c in subject_bands[:, j]))),
+        }
+
+    kept = [j for j, name in enumerate(names) if counts[j]]
+    overall_pct = np.percentile(percentage, qs) if n else np.full(len(qs), np.nan)
+    return {
+        "count": int(n),
+        "overall": {
+            "mean": _clean(percentage.mean()) if n else None,
+            "std": _clean(percentage.std()) if n else None,
+            "min": _clean(percentage.min()) if n else None,
+            "max": _clean(percentage.max()) if n else None,
+            "passRate": _clean((~failed).mean() * 100) if n else 0,
+            "percentiles": dict(zip(labels, _clean(overall_pct))),
+            "bands": overall_bands,
+        },
+        "subjects": subjects_out,
+        "correlation": {
+            "subjects": [names[j] for j in kept],
+            "matrix": _clean(_correlation(scores[:, kept], present[:, kept])),
+        },
+    }
@@ -0,0 +1,81 @@
+"""HTML and plain-text bodies of result emails, from Jinja templates.
+
+The templates (templates/email/result.html and result.txt, or the same names
+under EMAIL_TEMPLATE_DIR) are compiled the first time they are used and kept
+for the life of the process; each message only fills in the summary of its
+submission.  Compiled templates are also written to a bytecode cache keyed by
+the template source, so new workers skip the parse as long as a template is
+unchanged.  Editing a template takes effect after a restart.
+
+render_result() gives the same (html, text) pair to every transport (SMTP,
+Mailtrap, SendGrid, Mailgun).
+"""
+import os
+import threading
+
+import grading
+
+TEMPLATE_DIR = os.getenv("EMAIL_TEMPLATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+# Compiled template bytecode; empty uses Jinja's per-user directory under the system temp dir
+TEMPLATE_CACHE_DIR = os.getenv("EMAIL_TEMPLATE_CACHE_DIR") or None
+
+HTML_TEMPLATE = "result.html"
+TEXT_TEMPLATE = "result.txt"
+
+_env = None
+_env_lock = threading.Lock()
+
+
+def environment():
+    """The process-wide Jinja environment (created on first use; Jinja is imported lazily)."""
+    global _env
+    if _env is None:
+        with _env_lock:
+            if _env is None:
+                import jinja2
+                try:
+                    bytecode_cache = jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE_DIR) if TEMPLATE_CACHE_DIR else jinja2.FileSystemBytecodeCache()
+                except Exception:
+                    bytecode_cache = None  # unwritable temp dir: compile in memory only
+                _env = jinja2.Environment(
+                    loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+                    autoescape=jinja2.select_autoescape(["html"]),
+                    bytecode_cache=bytecode_cache,
+                    auto_reload=False,
+                    trim_blocks=True,
+                    lstrip_blocks=True,
+                    keep_trailing_newline=True,
+                )
+                _env.filters["marks"] = _format_marks
+    return _env
+
+
+def _format_marks(value):
+    return f"{value:g}" if isinstance(value, float) else value
+
+
+def result_context(data, rules):
+    """Template variables for one submission under a validated rule set (see grading.py)."""
+    student = data.get("student") if isinstance(data, dict) else None
+    student = student if isinstance(student, dict) else {}
+    subjects = data.get("subjects") if isinstance(data, dict) else None
+    subjects = subjects if isinstance(subjects, list) else []
+    rows = []
+    for s, (marks, maxm) in zip(subjects, grading.subject_marks(data)):
+        name = s.get("name") if isinstance(s, dict) else None
+        rows.append({"name": str(name or "").strip(), "marks": marks, "max": maxm,
+                     "passed": grading.subject_passed(marks, maxm, rules)})
+    result = grading.grade(data, rules)
+    return {
+        "student": {k: ("" if v is None else v) for k, v in student.items()},
+        "subjects": rows,
+        "result": result,
+        "failed": result is None or result["status"] == rules["failLabel"],
+    }
+
+
+def render_result(data, rules):
+    """(html, text) bodies of the result email for a submission."""
+    env = environment()
+    context = result_context(data, rules)
+    return env.get_template(HTML_TEMPLATE).render(context), env.get_template(TEXT_TEMPLATE).render(context)
@@ -0,0 +1,479 @@
+"""Grading rules engine: versioned rule sets per university, grades stored per submission.
+
+A rule set (JSON, see DEFAULT_RULES) gives the pass mark per subject as a
+percentage of its maxMarks, an optional pass mark on the overall percentage,
+the class bands by overall percentage, and the grade points per subject score
+from which the CGPA (the mean over the submission's subjects) is taken.  Rule
+sets live in grading_rules (migration 0007), one version after another per
+university (lower-cased universityName; '' for everyone else), and the newest
+version is the current one.
+
+/submit grades a submission with its university's current rules and stores
+the result in submission_grades in the same transaction; list views read the
+stored grade instead of working it out per request.  After publishing a new
+version, `regrade` recomputes the stored grades from submission_subject_facts
+in batches: each batch arrives as one binary COPY decoded into NumPy arrays
+(as /analytics/distribution does) and is graded with whole-array operations,
+so re-grading a few hundred thousand submissions takes seconds.
+
+Usage:
+    python grading.py rules                                   # current and past rule sets
+    python grading.py publish rules.json [--university "Example University"] [--regrade]
+    python grading.py regrade [--all] [--batch-size 20000]    # missing and outdated grades (--all: every grade)
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import argparse
+
+import trends
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Version 1 as seeded by migration 0007; a published rule set may leave out any key to keep these
+DEFAULT_RULES = {
+    "passPercent": 40,
+    "aggregatePassPercent": 0,
+    "failLabel": "Fail",
+    "bands": [{"name": "Distinction", "min": 75}, {"name": "First Class", "min": 60},
+              {"name": "Second Class", "min": 50}, {"name": "Pass", "min": 0}],
+    "gradePoints": [{"min": 90, "points": 10}, {"min": 80, "points": 9}, {"min": 70, "points": 8},
+                    {"min": 60, "points": 7}, {"min": 55, "points": 6}, {"min": 50, "points": 5},
+                    {"min": 40, "points": 4}],
+    "failPoints": 0,
+}
+
+# Grades feed the ETags and version-keyed caches of the read endpoints, so changing them bumps the write counter
+BUMP_VERSION_SQL = "UPDATE data_versions SET version = version + 1, updated_at = clock_timestamp() WHERE name = 'submissions';"
+
+# Same as the numeric test in subject_facts() (migration 0004)
+_NUMERIC = re.compile(r"^\s*-?[0-9]+(\.[0-9]+)?\s*$")
+
+
+class GradingError(ValueError):
+    """Invalid rule set; the message is safe to show to the operator."""
+
+
+def _percent(rules, key):
+    value = rules.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 100:
+        raise GradingError(f"{key} must be a number from 0 to 100")
+    return float(value)
+
+
+def _steps(rules, key, value_key, value_check):
+    steps = rules.get(key)
+    if not isinstance(steps, list):
+        raise GradingError(f"{key} must be a list")
+    out = []
+    for step in steps:
+        if not isinstance(step, dict) or set(step) != {"min", value_key}:
+            raise GradingError(f"each of {key} needs exactly 'min' and '{value_key}'")
+        minimum = step["min"]
+        if isinstance(minimum, bool) or not isinstance(minimum, (int, float)) or not 0 <= minimum <= 100:
+            raise GradingError(f"{key}: min must be a number from 0 to 100")
+        out.append({"min": float(minimum), value_key: value_check(step[value_key])})
+    out.sort(key=lambda s: -s["min"])
+    if len({s["min"] for s in out}) != len(out):
+        raise GradingError(f"{key}: every min must be different")
+    return out
+
+
+def _name(value):
+    if not isinstance(value, str) or not value.strip():
+        raise GradingError("band names must be non-empty strings")
+    return value.strip()
+
+
+def _points(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise GradingError("grade points must be numbers")
+    return float(value)
+
+
+def validate(rules):
+    """Rule set with defaults filled in, bands and grade points sorted from the top; raises GradingError."""
+    if not isinstance(rules, dict):
+        raise GradingError("a rule set must be a JSON object")
+    unknown = sorted(set(rules) - set(DEFAULT_RULES))
+    if unknown:
+        raise GradingError(f"unknown keys: {', '.join(unknown)} (allowed: {', '.join(DEFAULT_RULES)})")
+    merged = dict(DEFAULT_RULES, **rules)
+    out = {
+        "passPercent": _percent(merged, "passPercent"),
+        "aggregatePassPercent": _percent(merged, "aggregatePassPercent"),
+        "failLabel": _name(merged["failLabel"]),
+        "bands": _steps(merged, "bands", "name", _name),
+        "gradePoints": _steps(merged, "gradePoints", "points", _points),
+        "failPoints": _points(merged["failPoints"]),
+    }
+    if not out["bands"]:
+        raise GradingError("bands must not be empty")
+    return out
+
+
+def university_key(name):
+    return str(name or "").strip().lower()
+
+
+class RuleBook:
+    """Current rule set per university; lookup() falls back to the '' rule set, then DEFAULT_RULES."""
+
+    def __init__(self, rows=()):
+        self.current = {}
+        for rule_id, university, version, rules in rows:
+            self.current[university] = (rule_id, version, validate(rules))
+        if "" not in self.current:
+            self.current[""] = (None, 0, validate(DEFAULT_RULES))
+
+    def lookup(self, university):
+        """(rule id, version, rules) for a universityName; rule id is None for the built-in defaults."""
+        return self.current.get(university_key(university)) or self.current[""]
+
+
+def ruleset_index(book):
+    """(university keys, rule ids, rule sets) for grade_arrays(): rule set 0 is the default ('') one
+    and rule set i > 0 belongs to keys[i - 1], so SQL's array_position(keys, university_key) picks it.
+    """
+    keys = sorted(k for k in book.current if k)
+    rule_ids = [book.current[""][0]] + [book.current[k][0] for k in keys]
+    rulesets = [book.current[""][2]] + [book.current[k][2] for k in keys]
+    return keys, rule_ids, rulesets
+
+
+def load(cur):
+    """RuleBook of the newest version per university; built-in defaults before migration 0007."""
+    cur.execute("SELECT to_regclass('grading_rules') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return RuleBook()
+    cur.execute("SELECT DISTINCT ON (university) id, university, version, rules FROM grading_rules "
+                "ORDER BY university, version DESC;")
+    return RuleBook(cur.fetchall())
+
+
+def _number(value, default):
+    if isinstance(value, bool):
+        return default
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else default
+    if isinstance(value, str) and _NUMERIC.match(value):
+        return float(value)
+    return default
+
+
+def subject_marks(data):
+    """[(marks, maxMarks)] of a submission, with the facts table's defaults: 0 marks, 100 maxMarks."""
+    subjects = data.get("subjects") if isinstance(data, dict) else None
+    out = []
+    for s in subjects if isinstance(subjects, list) else []:
+        s = s if isinstance(s, dict) else {}
+        out.append((_number(s.get("marksObtained"), 0.0), _number(s.get("maxMarks"), 0.0) or 100.0))
+    return out
+
+
+def subject_passed(marks, maxm, rules):
+    return marks >= maxm * rules["passPercent"] / 100
+
+
+def _step(value, steps, key, below):
+    for step in steps:
+        if value >= step["min"]:
+            return step[key]
+    return below
+
+
+def grade(data, rules):
+    """Grade of one submission under a validated rule set; None when it has no subjects."""
+    entries = subject_marks(data)
+    if not entries:
+        return None
+    total_obt = sum(m for m, _ in entries)
+    total_max = sum(x for _, x in entries)
+    percentage = total_obt / total_max * 100
+    failed_subjects = sum(1 for m, x in entries if not subject_passed(m, x, rules))
+    failed = failed_subjects > 0 or percentage < rules["aggregatePassPercent"]
+    status = rules["failLabel"] if failed else _step(percentage, rules["bands"], "name", rules["failLabel"])
+    points = [_step(m / x * 100, rules["gradePoints"], "points", rules["failPoints"])
+              if subject_passed(m, x, rules) else rules["failPoints"] for m, x in entries]
+    return {
+        "totalObtained": total_obt,
+        "totalMax": total_max,
+        "percentage": percentage,
+        "status": status,
+        "cgpa": sum(points) / len(points) if rules["gradePoints"] else None,
+        "failedSubjects": failed_subjects,
+    }
+
+
+def grade_arrays(ids, rule_index, marks, maxm, rulesets):
+    """Vectorized grade() over flat per-subject arrays; rule_index picks each entry's rule set.
+    Returns (submission ids, rule set index, total obtained, total max, percentage, status, cgpa, failed subjects),
+    one element per submission, with status as an object array of names and cgpa NaN when there is no scale.
+    """
+    import numpy as np
+
+    student_ids, student = np.unique(ids, return_inverse=True)
+    n = student_ids.size
+    rule = np.zeros(n, dtype=np.intp)
+    rule[student] = rule_index  # every entry of a submission carries the same index
+
+    pass_percent = np.array([r["passPercent"] for r in rulesets])
+    aggregate_pass = np.array([r["aggregatePassPercent"] for r in rulesets])
+    entry_passed = marks >= maxm * pass_percent[rule_index] / 100
+    obtained = np.bincount(student, weights=marks, minlength=n)
+    total = np.bincount(student, weights=maxm, minlength=n)
+    failed_subjects = np.bincount(student, weights=~entry_passed, minlength=n).astype(np.int64)
+    percentage = obtained / total * 100  # maxMarks is never 0 in the facts
+    failed = (failed_subjects > 0) | (percentage < aggregate_pass[rule])
+
+    status = np.empty(n, dtype=object)
+    points = np.empty(marks.size)
+    scores = marks / maxm * 100
+    for i, r in enumerate(rulesets):
+        # Steps are sorted from the top, so the number of minimums above a value is its step's index
+        students = rule == i
+        if students.any():
+            mins = np.array([b["min"] for b in r["bands"]])
+            names = np.array([b["name"] for b in r["bands"]] + [r["failLabel"]], dtype=object)
+            band = (percentage[students, None] < mins).sum(axis=1)
+            band[failed[students]] = len(r["bands"])
+            status[students] = names[band]
+        entries = rule_index == i
+        if entries.any():
+            mins = np.array([s["min"] for s in r["gradePoints"]])
+            scale = np.array([s["points"] for s in r["gradePoints"]] + [r["failPoints"]])
+            points[entries] = scale[(scores[entries, None] < mins).sum(axis=1)]
+    points[~entry_passed] = np.array([r["failPoints"] for r in rulesets])[rule_index[~entry_passed]]
+    cgpa = np.bincount(student, weights=points, minlength=n) / np.bincount(student, minlength=n)
+    has_scale = np.array([bool(r["gradePoints"]) for r in rulesets])
+    cgpa[~has_scale[rule]] = np.nan
+    return student_ids, rule, obtained, total, percentage, status, cgpa, failed_subjects
+
+
+def store(cur, submission_id, rule_id, result):
+    """Upsert one submission's grade inside the caller's transaction."""
+    cur.execute(
+        "INSERT INTO submission_grades (submission_id, rule_id, total_obtained, total_max, percentage, status, cgpa, failed_subjects) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (submission_id) DO UPDATE SET "
+        "rule_id = EXCLUDED.rule_id, total_obtained = EXCLUDED.total_obtained, total_max = EXCLUDED.total_max, "
+        "percentage = EXCLUDED.percentage, status = EXCLUDED.status, cgpa = EXCLUDED.cgpa, "
+        "failed_subjects = EXCLUDED.failed_subjects, graded_at = NOW();",
+        (submission_id, rule_id, result["totalObtained"], result["totalMax"], result["percentage"],
+         result["status"], result["cgpa"], result["failedSubjects"]),
+    )
+
+
+def publish(cur, university, rules):
+    """Add the next version of a university's rule set (validated) and bump the data version, in the
+    caller's transaction; returns (rule id, version).
+    """
+    rules = validate(rules)
+    key = university_key(university)
+    cur.execute(
+        "INSERT INTO grading_rules (university, version, rules) "
+        "SELECT %s, COALESCE(max(version), 0) + 1, %s FROM grading_rules WHERE university = %s RETURNING id, version;",
+        (key, json.dumps(rules), key),
+    )
+    row = cur.fetchone()
+    cur.execute(BUMP_VERSION_SQL)
+    return row
+
+
+_BATCH_SQL = """SELECT f.submission_id::int8,
+       COALESCE(array_position(%(keys)s::text[], f.university_key), 0)::int4,
+       f.marks, f.max_marks
+FROM submission_subject_facts AS f
+WHERE f.submission_id BETWEEN %(lo)s AND %(hi)s"""
+# A grade is current when it was made with the current rule set of the submission's university
+_STALE_SQL = """ AND NOT EXISTS (
+    SELECT 1 FROM submission_grades AS g
+    WHERE g.submission_id = f.submission_id
+      AND g.rule_id = (%(rule_ids)s::int[])[COALESCE(array_position(%(keys)s::text[], f.university_key), 0) + 1])"""
+_GRADE_COLUMNS = "submission_id, rule_id, total_obtained, total_max, percentage, status, cgpa, failed_subjects"
+_UPSERT_SQL = f"""INSERT INTO submission_grades ({_GRADE_COLUMNS}) SELECT {_GRADE_COLUMNS} FROM batch_grades
+ON CONFLICT (submission_id) DO UPDATE SET
+    rule_id = EXCLUDED.rule_id, total_obtained = EXCLUDED.total_obtained, total_max = EXCLUDED.total_max,
+    percentage = EXCLUDED.percentage, status = EXCLUDED.status, cgpa = EXCLUDED.cgpa,
+    failed_subjects = EXCLUDED.failed_subjects, graded_at = NOW();"""
+
+
+def _regrade_batch(cur, params, full, rule_ids, rulesets):
+    import io
+    import numpy as np
+    import distribution
+
+    buf = io.BytesIO()
+    query = _BATCH_SQL + ("" if full else _STALE_SQL)
+    cur.copy_expert(cur.mogrify(f"COPY ({query}) TO STDOUT (FORMAT binary)", params).decode("utf-8"), buf)
+    ids, rule_index, marks, maxm = distribution.decode_copy(buf.getbuffer())
+    if not ids.size:
+        return 0
+    sid, rule, obtained, total, percentage, status, cgpa, failed = grade_arrays(ids, rule_index, marks, maxm, rulesets)
+    # COPY into a scratch table and upsert from there: a third of the time of bound arrays
+    cgpa_text = np.where(np.isnan(cgpa), "\\N", np.char.mod("%.4f", cgpa))
+    rows = zip(sid.tolist(), np.array(rule_ids)[rule].tolist(), obtained.tolist(), total.tolist(),
+               percentage.tolist(), status.tolist(), cgpa_text.tolist(), failed.tolist())
+    data = io.StringIO("".join(f"{a}\t{b}\t{c!r}\t{d!r}\t{e!r}\t{_copy_text(f)}\t{g}\t{h}\n" for a, b, c, d, e, f, g, h in rows))
+    cur.execute("CREATE TEMP TABLE batch_grades (LIKE submission_grades INCLUDING DEFAULTS) ON COMMIT DROP;")
+    cur.copy_expert(f"COPY batch_grades ({_GRADE_COLUMNS}) FROM STDIN", data)
+    cur.execute(_UPSERT_SQL)
+    cur.execute(BUMP_VERSION_SQL)
+    return int(sid.size)
+
+
+def _copy_text(value):
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def regrade(conn, full=False, batch_size=20000, progress=None):
+    """Recompute stored grades in batches of submission ids; only missing or outdated ones unless `full`.
+    Returns the number of submissions graded.  Each batch is its own REPEATABLE READ transaction, retried
+    when a concurrent /submit changes one of its submissions, so a fresher grade is never overwritten.
+    """
+    from psycopg2 import errors
+
+    cur = conn.cursor()
+    book = load(cur)
+    if book.current[""][0] is None:
+        raise GradingError("no default ('') rule set in grading_rules (run `python migrate.py`)")
+    keys, rule_ids, rulesets = ruleset_index(book)
+    cur.execute("SELECT min(submission_id), max(submission_id) FROM submission_subject_facts;")
+    lo, last = cur.fetchone()
+    conn.commit()
+    cur.close()
+    if lo is None:
+        return 0
+
+    conn.set_session(isolation_level="REPEATABLE READ")
+    graded = 0
+    try:
+        while lo <= last:
+            params = {"keys": keys, "rule_ids": rule_ids, "lo": lo, "hi": lo + batch_size - 1}
+            for attempt in range(5):
+                cur = conn.cursor()
+                try:
+                    count = _regrade_batch(cur, params, full, rule_ids, rulesets)
+                    conn.commit()
+                    break
+                except errors.SerializationFailure:
+                    conn.rollback()
+                    time.sleep(0.05 * (attempt + 1))
+                finally:
+                    cur.close()
+            else:
+                raise RuntimeError(f"submissions {params['lo']}-{params['hi']} kept changing; run regrade again")
+            graded += count
+            if progress:
+                progress(graded, params["hi"], last)
+            lo += batch_size
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level="DEFAULT")
+    return graded
+
+
+def regrade_after_import(conn):
+    """For bulk-import scripts, whose rows /submit never graded: regrade if the tables exist, and report it."""
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('submission_grades') IS NOT NULL;")
+    exists = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    if exists:
+        start = time.perf_counter()
+        graded = regrade(conn)
+        print(f"Graded {graded} submission(s) in {time.perf_counter() - start:.1f}s")
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def cmd_rules(args):
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("SELECT g.id, g.university, g.version, g.created_at, g.rules, "
+                "(SELECT count(*) FROM submission_grades AS s WHERE s.rule_id = g.id) "
+                "FROM grading_rules AS g ORDER BY g.university, g.version;")
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    current = {}
+    for row in rows:
+        current[row[1]] = row[0]
+    for rule_id, university, version, created, rules, graded in rows:
+        marker = "*" if current[university] == rule_id else " "
+        bands = ", ".join(f"{b['name']} {b['min']:g}" for b in rules.get("bands", []))
+        print(f"{marker} {university or '(default)'} v{version}  id={rule_id}  {created:%Y-%m-%d}  "
+              f"{graded} grade(s)  pass {rules.get('passPercent')}%  [{bands}]")
+
+
+def _print_progress(graded, hi, last):
+    print(f"Graded {graded} submission(s) (ids up to {min(hi, last)} of {last})", file=sys.stderr)
+
+
+def cmd_publish(args):
+    with open(args.file) as f:
+        try:
+            rules = json.load(f)
+        except json.JSONDecodeError as e:
+            raise SystemExit(f"{args.file}: {e}")
+    conn = _connect()
+    cur = conn.cursor()
+    try:
+        rule_id, version = publish(cur, args.university, rules)
+    except GradingError as e:
+        raise SystemExit(f"{args.file}: {e}")
+    conn.commit()
+    cur.close()
+    print(f"Published {args.university or 'default'} rules v{version} (id {rule_id})")
+    trends.refresh_after_import(conn)  # their pass rates follow the new pass marks
+    if args.regrade:
+        start = time.perf_counter()
+        graded = regrade(conn, batch_size=args.batch_size, progress=_print_progress)
+        print(f"Regraded {graded} submission(s) in {time.perf_counter() - start:.1f}s")
+    else:
+        print("Stored grades still use the previous rules: run `python grading.py regrade`")
+    conn.close()
+
+
+def cmd_regrade(args):
+    conn = _connect()
+    start = time.perf_counter()
+    graded = regrade(conn, full=args.all, batch_size=args.batch_size, progress=_print_progress)
+    conn.close()
+    print(f"Regraded {graded} submission(s) in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grading rule sets and stored grades")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rules", help="list rule set versions (* = current)")
+    pub = sub.add_parser("publish", help="add a new version of a rule set from a JSON file")
+    pub.add_argument("file")
+    pub.add_argument("--university", default="", help="universityName it applies to (default: every other university)")
+    pub.add_argument("--regrade", action="store_true", help="regrade affected submissions right away")
+    pub.add_argument("--batch-size", type=int, default=20000)
+    reg = sub.add_parser("regrade", help="recompute missing and outdated stored grades")
+    reg.add_argument("--all", action="store_true", help="recompute every stored grade")
+    reg.add_argument("--batch-size", type=int, default=20000, help="submission ids per batch")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+    {"rules": cmd_rules, "publish": cmd_publish, "regrade": cmd_regrade}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
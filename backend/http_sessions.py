@@ -0,0 +1,52 @@
+"""Shared requests sessions for the REST email providers (SendGrid, Mailgun, Mailtrap).
+
+A bare requests.post opens a new TCP and TLS connection for every message.
+Here each provider gets one requests.Session, created on first use and shared
+by every thread, whose urllib3 pool keeps up to EMAIL_HTTP_POOL_SIZE
+connections alive (enough for the sender threads of mail_scheduler plus the
+web workers of one process).  Failed connection attempts and 503 answers
+are retried EMAIL_HTTP_RETRIES times with backoff.  Neither can have
+delivered the message.  Errors after the request was sent are not retried,
+and neither are 429s: mail_scheduler moves on to the next provider instead.
+"""
+import os
+import threading
+
+EMAIL_HTTP_POOL_SIZE = int(os.getenv("EMAIL_HTTP_POOL_SIZE") or 10)
+EMAIL_HTTP_RETRIES = int(os.getenv("EMAIL_HTTP_RETRIES") or 2)
+EMAIL_HTTP_TIMEOUT = float(os.getenv("EMAIL_HTTP_TIMEOUT") or 30)
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _new_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=EMAIL_HTTP_RETRIES, connect=EMAIL_HTTP_RETRIES, read=0, other=0, status=EMAIL_HTTP_RETRIES,
+                  status_forcelist=(503,), allowed_methods=frozenset({"POST"}), backoff_factor=0.5,
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EMAIL_HTTP_POOL_SIZE, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def session(provider):
+    """The provider's process-wide requests.Session."""
+    s = _sessions.get(provider)
+    if s is None:
+        with _lock:
+            s = _sessions.get(provider)
+            if s is None:
+                s = _sessions[provider] = _new_session()
+    return s
+
+
+def post(provider, **kwargs):
+    """POST over the provider's session; kwargs as for requests.post (a `timeout` defaults to EMAIL_HTTP_TIMEOUT)."""
+    kwargs.setdefault("timeout", EMAIL_HTTP_TIMEOUT)
+    return session(provider).post(**kwargs)
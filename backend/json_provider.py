@@ -0,0 +1,59 @@
+"""Flask JSON provider backed by orjson when it is installed.
+
+Output stays the same as the stdlib provider (sorted keys, ISO-8601 datetimes),
+so handlers can return datetimes directly instead of calling .isoformat() per row.
+Set JSON_ENCODER=stdlib to force the built-in encoder.
+"""
+import os
+import uuid
+import decimal
+import datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = (os.getenv("JSON_ENCODER") or "auto").strip().lower()
+
+
+def _default(o):
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+    use_orjson = orjson is not None and JSON_ENCODER != "stdlib"
+
+    def _orjson_bytes(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if self.use_orjson and not kwargs:
+            return self._orjson_bytes(obj).decode("utf-8")
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # Debug mode pretty-prints; leave that to the stdlib path
+        if not self.use_orjson or self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,344 @@
+"""HTTP load generator and capture/replay harness for the Flask API.
+
+Run everything locally: the app against a local Postgres, with SMTP pointed at
+the bundled stub so email endpoints never leave the machine.
+
+    python loadtest.py smtp-stub --port 2525
+    # backend/.env: SMTP_HOST=127.0.0.1  SMTP_PORT=2525  SMTP_STARTTLS=0
+    python loadtest.py run --base-url http://127.0.0.1:5000 --rps 50 --duration 60 \
+        --mix submit=1,submissions=4,analytics=2,toppers=2,login=1 --output load.json
+    python loadtest.py replay captured.jsonl --base-url http://127.0.0.1:5000 --speed 2
+
+Requests are issued open-loop on a fixed schedule and latency is measured from
+the *scheduled* send time, so a saturated server shows up as rising latency
+instead of a silently lower request rate.  Captures for `replay` come from the
+app itself with REQUEST_CAPTURE_PATH set (see request_capture.py).
+
+Logins are spread round-robin over enough synthetic accounts that none exceeds
+AUTH_ACCOUNT_BURST/AUTH_ACCOUNT_PER_MINUTE over the run (override with
+--login-accounts).  Every request still comes from one IP, so raise
+AUTH_IP_BURST/AUTH_IP_PER_MINUTE on the server under test; any 429s are
+reported in their own column and left out of the served request rate.
+"""
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import synthetic_submission, COURSES
+from password_hashing import AUTH_ACCOUNT_BURST, AUTH_ACCOUNT_PER_MINUTE
+
+LOADTEST_EMAIL = "loadtest@example.test"
+LOADTEST_PASSWORD = "loadtest-password"
+DEFAULT_MIX = "submit=1,submissions=4,analytics=2,toppers=2,login=1"
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.throttled = {}
+        self.statuses = {}
+
+    def record(self, name, latency, status):
+        failed = status is None or status >= 500
+        with self._lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.errors[name] = self.errors.get(name, 0) + (1 if failed else 0)
+            self.throttled[name] = self.throttled.get(name, 0) + (1 if status == 429 else 0)
+            codes = self.statuses.setdefault(name, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def report(self, elapsed):
+        out = {"elapsed_s": elapsed, "endpoints": {}}
+        total = throttled = 0
+        for name, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            n = len(samples)
+            total += n
+            throttled += self.throttled.get(name, 0)
+
+            def pct(p):
+                return samples[min(n - 1, int(p / 100.0 * n))] * 1000
+
+            out["endpoints"][name] = {
+                "requests": n,
+                "errors": self.errors.get(name, 0),
+                "error_rate": self.errors.get(name, 0) / n,
+                "throttled": self.throttled.get(name, 0),
+                "throttled_rate": self.throttled.get(name, 0) / n,
+                "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99), "max_ms": samples[-1] * 1000,
+                "statuses": self.statuses.get(name, {}),
+            }
+        out["requests"] = total
+        out["throttled"] = throttled
+        out["achieved_rps"] = total / elapsed if elapsed else 0.0
+        # Rate-limited answers are cheap and would otherwise inflate throughput
+        out["served_rps"] = (total - throttled) / elapsed if elapsed else 0.0
+        return out
+
+
+def _print_report(report):
+    print(f"{'endpoint':14s} {'reqs':>7s} {'err%':>6s} {'429%':>6s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'max':>9s}")
+    for name, e in report["endpoints"].items():
+        print(f"{name:14s} {e['requests']:7d} {e['error_rate'] * 100:6.2f} {e['throttled_rate'] * 100:6.2f} "
+              f"{e['p50_ms']:8.1f}ms {e['p90_ms']:8.1f}ms {e['p99_ms']:8.1f}ms {e['max_ms']:8.1f}ms")
+    print(f"total {report['requests']} requests in {report['elapsed_s']:.1f}s ({report['achieved_rps']:.1f} req/s, "
+          f"{report['served_rps']:.1f} req/s not rate limited)")
+    if report["throttled"]:
+        print(f"warning: {report['throttled']} requests got 429; raise AUTH_IP_BURST/AUTH_IP_PER_MINUTE "
+              f"on the server or pass more --login-accounts")
+
+
+def _account_email(i):
+    return LOADTEST_EMAIL if i == 0 else f"loadtest+{i}@example.test"
+
+
+def _login_accounts(logins, duration_s):
+    """Accounts needed so `logins` spread round-robin stay within each account's token bucket."""
+    allowed = AUTH_ACCOUNT_BURST + AUTH_ACCOUNT_PER_MINUTE * duration_s / 60.0
+    return max(1, math.ceil(logins / allowed)) if allowed > 0 else 1
+
+
+class Client:
+    """Thread-local requests sessions plus the load-test account token."""
+
+    def __init__(self, base_url, timeout):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+        self.token = None
+
+    def session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = self._requests.Session()
+        return s
+
+    def login(self, accounts=1):
+        """Register the load-test accounts (existing ones are left alone) and log in as the first."""
+        throttled = 0
+        for i in range(accounts):
+            body = {"name": "Load Test", "email": _account_email(i), "password": LOADTEST_PASSWORD}
+            resp = self.session().post(f"{self.base_url}/auth/register", json=body, timeout=self.timeout)
+            throttled += resp.status_code == 429
+        body = {"email": LOADTEST_EMAIL, "password": LOADTEST_PASSWORD}
+        resp = self.session().post(f"{self.base_url}/auth/login", json=body, timeout=self.timeout)
+        if resp.ok:
+            self.token = resp.json().get("token")
+        if throttled or resp.status_code == 429:
+            print(f"warning: setup was rate limited registering {accounts} accounts; "
+                  f"raise AUTH_IP_BURST/AUTH_IP_PER_MINUTE on the server")
+
+    def send(self, method, path, params=None, body=None, auth=False):
+        headers = {"Authorization": f"Bearer {self.token}"} if auth and self.token else {}
+        resp = self.session().request(method, f"{self.base_url}{path}", params=params, json=body,
+                                      headers=headers, timeout=self.timeout)
+        return resp.status_code
+
+
+def _drive(client, schedule, concurrency, stats):
+    """Issue (offset_s, name, method, path, params, body, auth) tuples at their offsets."""
+    start = time.perf_counter()
+
+    def issue(due, name, method, path, params, body, auth):
+        try:
+            status = client.send(method, path, params, body, auth)
+        except Exception:
+            status = None
+        stats.record(name, time.perf_counter() - due, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, *req in schedule:
+            due = start + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, due, *req)
+    return time.perf_counter() - start
+
+
+def _synthetic_request(rng, name, seq, accounts=1):
+    course = rng.choice(COURSES)
+    semester = str(rng.randint(1, 8))
+    if name == "submit":
+        doc = synthetic_submission(rng, 9_000_000 + seq, 4, 8)
+        return "POST", "/submit", None, doc, True
+    if name == "submissions":
+        return "GET", "/submissions", {"q": f"Student {rng.randint(0, 999):03d}", "limit": "100"}, None, False
+    if name == "analytics":
+        params = {"course": course, "semester": semester} if rng.random() < 0.7 else {}
+        return "GET", "/analytics", params, None, False
+    if name == "toppers":
+        params = {"course": course, "semester": semester} if rng.random() < 0.7 else {}
+        return "GET", "/toppers", params, None, False
+    if name == "login":
+        body = {"email": _account_email(seq % accounts), "password": LOADTEST_PASSWORD}
+        return "POST", "/auth/login", None, body, False
+    raise ValueError(f"unknown endpoint in mix: {name}")
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def cmd_run(args):
+    rng = random.Random(args.seed)
+    mix = _parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    for name in names:
+        _synthetic_request(rng, name, 0)  # validate the mix up front
+
+    total = int(args.rps * args.duration)
+    logins = total * mix.get("login", 0) / sum(weights)
+    accounts = args.login_accounts or _login_accounts(logins, args.duration)
+    client = Client(args.base_url, args.timeout)
+    client.login(accounts)
+
+    def schedule():
+        seen = 0
+        for i in range(total):
+            name = rng.choices(names, weights)[0]
+            yield (i / args.rps, name) + _synthetic_request(rng, name, seen if name == "login" else i, accounts)
+            seen += name == "login"
+
+    stats = Stats()
+    elapsed = _drive(client, schedule(), args.concurrency, stats)
+    _finish(stats.report(elapsed), args.output)
+
+
+def cmd_replay(args):
+    entries = []
+    with open(args.capture, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda e: e["t"])
+    if not entries:
+        print("capture file is empty")
+        sys.exit(1)
+
+    t0 = entries[0]["t"]
+    logins = sum(1 for e in entries if isinstance(e.get("body"), dict) and e["body"].get("password")
+                 and e["path"] != "/auth/register")
+    accounts = args.login_accounts or _login_accounts(logins, (entries[-1]["t"] - t0) / args.speed)
+    client = Client(args.base_url, args.timeout)
+    client.login(accounts)
+
+    def schedule():
+        seen = 0
+        for e in entries:
+            body = e.get("body")
+            if isinstance(body, dict):
+                body = dict(body)
+                # Captures never contain credentials; substitute the load-test account
+                if e["path"] == "/auth/register":
+                    body["email"] = f"loadtest+{uuid.uuid4().hex[:12]}@example.test"
+                    body["password"] = LOADTEST_PASSWORD
+                elif body.get("password"):
+                    body["email"], body["password"] = _account_email(seen % accounts), LOADTEST_PASSWORD
+                    seen += 1
+                elif body.get("email"):
+                    body["email"] = LOADTEST_EMAIL
+            yield ((e["t"] - t0) / args.speed, e["path"], e["method"], e["path"], e.get("args") or None, body, e.get("auth"))
+
+    stats = Stats()
+    elapsed = _drive(client, schedule(), args.concurrency, stats)
+    _finish(stats.report(elapsed), args.output)
+
+
+def _finish(report, output):
+    _print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+class _SMTPStubHandler(socketserver.StreamRequestHandler):
+    """Accepts any message and discards it; enough for smtplib without STARTTLS."""
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self.reply("220 loadtest-smtp-stub ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode("utf-8", "replace").strip().split(" ", 1)[0].upper()
+            if cmd == "EHLO":
+                self.reply("250-loadtest-smtp-stub")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 SIZE 52428800")
+            elif cmd == "AUTH":
+                self.reply("235 authenticated")
+            elif cmd == "DATA":
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.server.messages += 1
+                self.reply("250 queued")
+            elif cmd == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+def cmd_smtp_stub(args):
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((args.host, args.port), _SMTPStubHandler) as server:
+        server.daemon_threads = True
+        server.messages = 0
+        print(f"SMTP stub listening on {args.host}:{args.port} (set SMTP_STARTTLS=0 in the app)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print(f"received {server.messages} messages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test / replay harness for the Flask API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("run", "replay"):
+        p = sub.add_parser(name)
+        p.add_argument("--base-url", default="http://127.0.0.1:5000")
+        p.add_argument("--concurrency", type=int, default=64, help="max in-flight requests")
+        p.add_argument("--timeout", type=float, default=30.0)
+        p.add_argument("--output", help="write the JSON report to this file")
+        p.add_argument("--login-accounts", type=int, default=0,
+                       help="accounts to spread logins over (default: enough to stay under AUTH_ACCOUNT_*)")
+        if name == "run":
+            p.add_argument("--rps", type=float, default=20.0, help="target requests per second")
+            p.add_argument("--duration", type=float, default=30.0, help="seconds")
+            p.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. " + DEFAULT_MIX)
+            p.add_argument("--seed", type=int, default=42)
+        else:
+            p.add_argument("capture", help="JSONL file written with REQUEST_CAPTURE_PATH")
+            p.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+
+    stub = sub.add_parser("smtp-stub", help="run a local SMTP sink for email endpoints")
+    stub.add_argument("--host", default="127.0.0.1")
+    stub.add_argument("--port", type=int, default=2525)
+
+    args = parser.parse_args()
+    {"run": cmd_run, "replay": cmd_replay, "smtp-stub": cmd_smtp_stub}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""Paced email delivery across providers, within each provider's quotas.
+
+Providers are tried in EMAIL_PROVIDERS order (default smtp, mailtrap,
+sendgrid, mailgun; unconfigured ones are skipped).  Each has a token bucket
+for its rate, EMAIL_<PROVIDER>_PER_SECOND messages per second with bursts of
+EMAIL_<PROVIDER>_BURST, and an optional daily quota EMAIL_<PROVIDER>_DAILY
+counted per UTC day in email_daily_usage (migration 0008), so every worker
+process and restart shares it.  0 means unlimited.
+
+send() delivers one message (the email endpoints): a provider whose bucket
+would make it wait longer than EMAIL_MAX_WAIT seconds, or whose daily quota
+is used up, is passed over for the next one instead of being called anyway.
+send_many() delivers a mailing: every provider works through the queue at its
+own rate in batches of EMAIL_BATCH_SIZE messages (one reservation against
+the daily quota and, for SMTP, one connection per batch).  Messages a
+provider fails on go back to the queue for the others, and a provider that
+runs out of quota or keeps failing leaves the rest to them (EMAIL_MAX_ATTEMPTS
+sends per message at most).
+
+Usage:
+    python mail_scheduler.py status
+    python mail_scheduler.py bulk --course BCA --semester 3 --academic-year 2025-26 [--dry-run]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+import metrics
+from password_hashing import TokenBucket
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+EMAIL_PROVIDERS = [p.strip().lower() for p in (os.getenv("EMAIL_PROVIDERS") or "smtp,mailtrap,sendgrid,mailgun").split(",") if p.strip()]
+# Longest a single send waits for a provider's rate limit before spilling over to the next provider
+EMAIL_MAX_WAIT = float(os.getenv("EMAIL_MAX_WAIT") or 2)
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE") or 50)
+# A provider that fails this many messages in a row is left out for the rest of a mailing
+EMAIL_MAX_CONSECUTIVE_FAILURES = int(os.getenv("EMAIL_MAX_CONSECUTIVE_FAILURES") or 5)
+# Sends per message in a mailing before it is given up (each provider once, then again from the start)
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS") or 3)
+
+# Messages per second when EMAIL_<PROVIDER>_PER_SECOND is unset
+DEFAULT_PER_SECOND = {"smtp": 5, "mailtrap": 1, "sendgrid": 10, "mailgun": 10}
+
+Message = namedtuple("Message", "pdf_bytes filename to_email subject html_body text_body")
+
+
+def _setting(provider, key, default):
+    return float(os.getenv(f"EMAIL_{provider.upper()}_{key}") or default)
+
+
+class Quota:
+    """Rate and daily limit of one provider, from EMAIL_<PROVIDER>_* settings."""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.per_second = _setting(provider, "PER_SECOND", DEFAULT_PER_SECOND.get(provider, 0))
+        self.burst = _setting(provider, "BURST", max(1.0, self.per_second)) if self.per_second > 0 else 0
+        self.daily = int(_setting(provider, "DAILY", 0))
+        self._bucket = TokenBucket(self.burst, self.per_second * 60, max_keys=1)
+
+    def acquire(self, max_wait=None):
+        """Take a token, sleeping until one is due; False (nothing taken) when that is over `max_wait` seconds."""
+        while True:
+            wait = self._bucket.take(self.provider)
+            if not wait:
+                return True
+            if max_wait is not None:
+                if wait > max_wait:
+                    return False
+                max_wait -= wait
+            time.sleep(wait)
+
+
+class DailyUsage:
+    """Messages per provider and UTC day: in email_daily_usage when `connect` is given, else in this process."""
+
+    def __init__(self, connect=None):
+        self.connect = connect
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).date()
+
+    def reserve(self, provider, n, limit):
+        """Count up to `n` messages against today's `limit` (0: unlimited, nothing recorded); returns how many fit."""
+        if limit <= 0 or n <= 0:
+            return n
+        if self.connect is not None:
+            try:
+                return self._update(provider, n, limit)
+            except Exception as e:
+                print(f"email_daily_usage unavailable, counting in process: {e}", file=sys.stderr)
+        with self._lock:
+            key = (provider, self._today())
+            used = self._counts.get(key, 0)
+            granted = max(0, min(n, limit - used))
+            self._counts[key] = used + granted
+        return granted
+
+    def refund(self, provider, n, limit):
+        """Return `n` reserved messages that were not sent."""
+        if limit <= 0 or n <= 0:
+            return
+        if self.connect is not None:
+            try:
+                self._update(provider, -n, limit)
+                return
+            except Exception:
+                pass
+        with self._lock:
+            key = (provider, self._today())
+            self._counts[key] = max(0, self._counts.get(key, 0) - n)
+
+    def used(self, provider):
+        """Messages counted today (only providers with a daily quota are counted)."""
+        if self.connect is not None:
+            conn = self.connect()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT sent FROM email_daily_usage WHERE provider = %s AND day = %s;", (provider, self._today()))
+                row = cur.fetchone()
+                conn.commit()
+                cur.close()
+                return row[0] if row else 0
+            finally:
+                conn.close()
+        with self._lock:
+            return self._counts.get((provider, self._today()), 0)
+
+    def _update(self, provider, n, limit):
+        day = self._today()
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO email_daily_usage (provider, day) VALUES (%s, %s) ON CONFLICT DO NOTHING;", (provider, day))
+            cur.execute("SELECT sent FROM email_daily_usage WHERE provider = %s AND day = %s FOR UPDATE;", (provider, day))
+            used = cur.fetchone()[0]
+            granted = max(0, min(n, limit - used)) if n > 0 else max(n, -used)
+            if granted:
+                cur.execute("UPDATE email_daily_usage SET sent = sent + %s WHERE provider = %s AND day = %s;", (granted, provider, day))
+            conn.commit()
+            cur.close()
+            return granted
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+class Transport:
+    """A provider's send(message) -> (ok, detail); `session`, if given, is a context manager
+    factory yielding such a send function that reuses one connection for a batch.
+    A detail starting with "no-" means the provider is not configured (nothing was sent).
+    """
+
+    def __init__(self, name, send, session=None):
+        self.name = name
+        self.send = send
+        self.session = session
+
+    def open(self):
+        return self.session() if self.session else contextlib.nullcontext(self.send)
+
+
+class _Item:
+    __slots__ = ("index", "tried", "errors")
+
+    def __init__(self, index):
+        self.index = index
+        self.tried = set()
+        self.errors = []
+
+
+def _failure(errors):
+    return "All transports failed | " + (" | ".join(errors) or "no provider available")
+
+
+class Scheduler:
+    """Delivers Messages through `transports` ({name: Transport}) in EMAIL_PROVIDERS order."""
+
+    def __init__(self, transports, usage=None, providers=None, max_wait=EMAIL_MAX_WAIT, batch_size=EMAIL_BATCH_SIZE):
+        names = [p for p in (providers or EMAIL_PROVIDERS) if p in transports]
+        self.transports = [transports[p] for p in names]
+        self.quotas = {p: Quota(p) for p in names}
+        self.usage = usage or DailyUsage()
+        self.max_wait = max_wait
+        self.batch_size = max(1, batch_size)
+
+    def _deliver(self, name, send, message):
+        start = time.perf_counter()
+        try:
+            ok, detail = send(message)
+        except Exception as e:
+            ok, detail = False, f"{name}-exception: {e}"
+        outcome = "sent" if ok else ("skipped" if str(detail).startswith("no-") else "failed")
+        metrics.EMAIL_SEND.observe(time.perf_counter() - start, name, outcome)
+        return ok, str(detail)
+
+    def _admit(self, name):
+        """Take a token and a daily slot of one provider for one message; returns None, or why not."""
+        quota = self.quotas[name]
+        if not quota.acquire(self.max_wait):
+            metrics.EMAIL_DEFERRED.inc(name, "rate")
+            return "rate limited"
+        if not self.usage.reserve(name, 1, quota.daily):
+            metrics.EMAIL_DEFERRED.inc(name, "daily")
+            return "daily quota reached"
+        return None
+
+    def send(self, message):
+        """Deliver one message through the first provider with quota left; returns (ok, detail)."""
+        errors = []
+        for t in self.transports:
+            reason = self._admit(t.name)
+            if reason:
+                errors.append(f"{t.name}: {reason}")
+                continue
+            ok, detail = self._deliver(t.name, t.send, message)
+            if ok:
+                return True, detail
+            if detail.startswith("no-"):
+                self.usage.refund(t.name, 1, self.quotas[t.name].daily)
+            errors.append(f"{t.name}: {detail}")
+        return False, _failure(errors)
+
+    async def send_async(self, message, deliver):
+        """send() for asyncio callers: `await deliver(transport, message)` does the sending,
+        waits for rate limits and quota bookkeeping run in a worker thread.
+        """
+        import asyncio
+
+        errors = []
+        for t in self.transports:
+            reason = await asyncio.to_thread(self._admit, t.name)
+            if reason:
+                errors.append(f"{t.name}: {reason}")
+                continue
+            start = time.perf_counter()
+            try:
+                ok, detail = await deliver(t, message)
+            except Exception as e:
+                ok, detail = False, f"{t.name}-exception: {e}"
+            detail = str(detail)
+            metrics.EMAIL_SEND.observe(time.perf_counter() - start, t.name,
+                                       "sent" if ok else ("skipped" if detail.startswith("no-") else "failed"))
+            if ok:
+                return True, detail
+            if detail.startswith("no-"):
+                await asyncio.to_thread(self.usage.refund, t.name, 1, self.quotas[t.name].daily)
+            errors.append(f"{t.name}: {detail}")
+        return False, _failure(errors)
+
+    def send_many(self, messages, progress=None):
+        """Deliver a list of messages with every provider at once; returns [(ok, detail)] in message order.
+        A failed message goes to a provider that has not tried it yet, for up to EMAIL_MAX_ATTEMPTS sends.
+        `progress(done, total)` is called after each finished message.
+        """
+        results = [None] * len(messages)
+        pending = deque(_Item(i) for i in range(len(messages)))
+        live = {t.name for t in self.transports}
+        cond = threading.Condition()
+        state = {"in_flight": 0, "done": 0}
+
+        def settle(item, result):
+            # with cond held
+            results[item.index] = result
+            state["done"] += 1
+            if progress:
+                progress(state["done"], len(messages))
+
+        def take(name):
+            with cond:
+                while True:
+                    batch, skipped = [], []
+                    while pending and len(batch) < self.batch_size:
+                        item = pending.popleft()
+                        (skipped if name in item.tried else batch).append(item)
+                    pending.extendleft(reversed(skipped))
+                    if batch:
+                        state["in_flight"] += len(batch)
+                        return batch
+                    if not state["in_flight"]:
+                        return []  # nothing this provider may take, and nothing in flight can come back
+                    cond.wait()
+
+        def release(items):
+            with cond:
+                state["in_flight"] -= len(items)
+                pending.extendleft(reversed(items))
+                cond.notify_all()
+
+        def finish(item, name, ok, detail):
+            with cond:
+                state["in_flight"] -= 1
+                if ok:
+                    settle(item, (True, detail))
+                else:
+                    item.tried.add(name)
+                    item.errors.append(f"{name}: {detail}")
+                    if not live - item.tried and live and len(item.errors) < EMAIL_MAX_ATTEMPTS:
+                        item.tried.clear()  # every remaining provider failed it once: another round
+                    if live - item.tried:
+                        pending.append(item)
+                    else:
+                        settle(item, (False, _failure(item.errors)))
+                cond.notify_all()
+
+        def retire(name):
+            with cond:
+                live.discard(name)
+                for item in [i for i in pending if not live - i.tried]:
+                    if live and len(item.errors) < EMAIL_MAX_ATTEMPTS:
+                        item.tried.clear()
+                        continue
+                    pending.remove(item)
+                    settle(item, (False, _failure(item.errors)))
+                cond.notify_all()
+
+        def run(t):
+            quota = self.quotas[t.name]
+            failures = 0
+            try:
+                while True:
+                    batch = take(t.name)
+                    if not batch:
+                        return
+                    granted = self.usage.reserve(t.name, len(batch), quota.daily)
+                    if granted < len(batch):
+                        release(batch[granted:])
+                        batch = batch[:granted]
+                    if not batch:
+                        metrics.EMAIL_DEFERRED.inc(t.name, "daily")
+                        return
+                    n = 0
+                    try:
+                        with t.open() as send:
+                            while n < len(batch):
+                                quota.acquire()
+                                ok, detail = self._deliver(t.name, send, messages[batch[n].index])
+                                if detail.startswith("no-"):
+                                    return  # not configured; the finally below hands the batch back
+                                finish(batch[n], t.name, ok, detail)
+                                n += 1
+                                failures = 0 if ok else failures + 1
+                                if failures >= EMAIL_MAX_CONSECUTIVE_FAILURES:
+                                    return
+                    except Exception as e:
+                        if n < len(batch):
+                            # The connection broke: the current message counts as failed here
+                            finish(batch[n], t.name, False, f"{t.name}-exception: {e}")
+                            n += 1
+                        return
+                    finally:
+                        if n < len(batch):
+                            release(batch[n:])
+                            self.usage.refund(t.name, len(batch) - n, quota.daily)
+            finally:
+                retire(t.name)
+
+        threads = [threading.Thread(target=run, args=(t,), name=f"mail-{t.name}", daemon=True) for t in self.transports]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [r or (False, _failure([])) for r in results]
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def cmd_status(args):
+    usage = DailyUsage(_connect if DATABASE_URL else None)
+    print(f"{'provider':<10} {'per second':>10} {'burst':>6} {'daily':>8} {'used today':>11}")
+    for provider in EMAIL_PROVIDERS:
+        quota = Quota(provider)
+        print(f"{provider:<10} {quota.per_second or 'unlimited':>10} {quota.burst:>6g} {quota.daily or 'unlimited':>8} "
+              f"{usage.used(provider) if quota.daily else '-':>11}")
+
+
+def cmd_bulk(args):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import app as core
+
+    filters = {k: v for k, v in (("course", args.course), ("semester", args.semester),
+                                 ("academic_year", args.academic_year), ("q", args.q)) if v}
+    rows = [(rid, data) for rid, data, _ in core._fetch_rows(filters, args.limit, None)
+            if isinstance(data, dict) and (data.get("student") or {}).get("email")]
+    print(f"{len(rows)} submission(s) with a student email", file=sys.stderr)
+    if args.dry_run or not rows:
+        return
+
+    def render(chunk):
+        out = []
+        for rid, data in chunk:
+            html_body, text_body = core._result_bodies(data)
+            subject = f"Result — {(data.get('student') or {}).get('name', 'Student')}"
+            out.append(Message(core._generate_pdf_bytes(data), core._result_filename(data),
+                               data["student"]["email"], subject, html_body, text_body))
+        return out
+
+    scheduler = core._mail_scheduler()
+    chunks = [rows[i:i + args.chunk] for i in range(0, len(rows), args.chunk)]
+    sent = failed = 0
+    start = time.perf_counter()
+    # Render the next chunk's PDFs while the current one is being sent
+    with ThreadPoolExecutor(max_workers=1) as renderer:
+        upcoming = renderer.submit(render, chunks[0])
+        for k in range(len(chunks)):
+            messages = upcoming.result()
+            if k + 1 < len(chunks):
+                upcoming = renderer.submit(render, chunks[k + 1])
+            for message, (ok, detail) in zip(messages, scheduler.send_many(messages)):
+                if ok:
+                    sent += 1
+                    continue
+                failed += 1
+                saved = core._save_failed_pdf(message.pdf_bytes, message.filename, message.to_email)
+                print(f"{message.to_email}: {detail}" + (f" (saved failed_emails/{saved})" if saved else ""), file=sys.stderr)
+            print(f"Sent {sent}, failed {failed} of {len(rows)} ({time.perf_counter() - start:.0f}s)", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paced result-email delivery within provider quotas")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="configured rates and daily quotas, with today's usage")
+    bulk = sub.add_parser("bulk", help="email every matching submission that has a student email")
+    bulk.add_argument("--course")
+    bulk.add_argument("--semester")
+    bulk.add_argument("--academic-year")
+    bulk.add_argument("--q", help="search text, as /submissions?q=")
+    bulk.add_argument("--limit", type=int)
+    bulk.add_argument("--chunk", type=int, default=200, help="messages rendered and queued at a time")
+    bulk.add_argument("--dry-run", action="store_true", help="only count the recipients")
+    args = parser.parse_args()
+    {"status": cmd_status, "bulk": cmd_bulk}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Minimal in-process metrics registry rendered in Prometheus text format.
+
+Kept dependency-free on purpose: each observation is a dict lookup, a bisect and
+a few additions under a per-metric lock, so instrumenting the hot path is cheap.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _render_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_render_labels(self.labelnames, labelvalues)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[idx] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = f'le="{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{_render_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _render_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_fmt(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render():
+    """Return every registered metric in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by method, route and status code.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by method and route.", ("method", "route"))
+DB_CONNECT = Histogram("db_connect_duration_seconds", "Time spent opening Postgres connections (get_conn).")
+DB_QUERY = Histogram("db_query_duration_seconds", "Time spent executing SQL statements, by statement type.", ("statement",))
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS, by statement type.", ("statement",))
+DB_READ_ROUTE = Counter("db_read_route_total", "Read-only connections by target (primary or replica).", ("target",))
+PASSWORD_HASH = Histogram("password_hash_duration_seconds", "Password hashing time including queueing, by operation.", ("operation",))
+AUTH_REJECTED = Counter("auth_rejected_total", "Auth requests refused before hashing, by reason.", ("reason",))
+PDF_RENDER = Histogram("pdf_render_duration_seconds", "Time spent rendering result PDFs.")
+EMAIL_SEND = Histogram("email_send_duration_seconds", "Email transport time by provider and outcome.", ("provider", "outcome"))
+EMAIL_DEFERRED = Counter("email_deferred_total", "Emails passed over by a provider for its rate limit or daily quota, by provider and reason.", ("provider", "reason"))
+
+
+def init_app(app):
+    """Record request count, status and latency for every Flask request."""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = getattr(g, "_metrics_start", None)
+        if start is not None:
+            # Use the route template, not the raw path, to keep label cardinality bounded
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, request.method, route)
+            REQUESTS.inc(request.method, route, str(response.status_code))
+        return response
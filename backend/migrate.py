@@ -0,0 +1,305 @@
+"""Numbered schema migrations with a schema_version table.
+
+Migrations live in migrations/NNNN_description.sql and are applied in order,
+each exactly once.  A plain migration runs in one transaction together with
+its schema_version row.  A migration whose first line is
+
+    -- migrate:no-transaction
+
+runs statement by statement in autocommit mode instead, which is what
+`CREATE INDEX CONCURRENTLY` needs; such steps must be idempotent (IF NOT
+EXISTS) because a failure part-way leaves the earlier statements applied.
+While a concurrent index builds, its progress is printed from
+pg_stat_progress_create_index.  On a partitioned table the index is built
+per partition and attached to an ON ONLY parent index, since Postgres cannot
+build it concurrently on the parent.
+
+Usage:
+    python migrate.py              # apply pending migrations
+    python migrate.py --to 2       # apply up to and including 0002
+    python migrate.py status
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT") or ""
+PROGRESS_INTERVAL = float(os.getenv("MIGRATION_PROGRESS_INTERVAL") or 5)
+
+NO_TRANSACTION = "-- migrate:no-transaction"
+ADVISORY_LOCK_ID = 7270037  # pg_advisory_lock key held while migrating
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    duration_ms INTEGER
+);
+"""
+
+PROGRESS_SQL = """
+SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total, lockers_done, lockers_total
+FROM pg_stat_progress_create_index WHERE pid = %s;
+"""
+
+_FILE_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+_CONCURRENT_INDEX_RE = re.compile(
+    r"^CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(?:ONLY\s+)?([\w.]+)\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+class Migration:
+    def __init__(self, path):
+        match = _FILE_RE.match(os.path.basename(path))
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = [Migration(os.path.join(directory, f)) for f in sorted(os.listdir(directory)) if _FILE_RE.match(f)]
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise SystemExit(f"duplicate migration numbers in {directory}")
+    return sorted(migrations, key=lambda m: m.version)
+
+
+def split_statements(sql):
+    """Split SQL on top-level semicolons, skipping comments, quotes and $tag$ bodies."""
+    statements, buf, quote = [], [], None
+    i, n = 0, len(sql)
+    while i < n:
+        if quote:
+            if sql.startswith(quote, i):
+                buf.append(quote)
+                i += len(quote)
+                quote = None
+            else:
+                buf.append(sql[i])
+                i += 1
+            continue
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        if ch in "'\"":
+            quote = ch
+        elif ch == "$":
+            tag = re.match(r"\$[A-Za-z_]*\$", sql[i:])
+            if tag:
+                quote = tag.group(0)
+                buf.append(quote)
+                i += len(quote)
+                continue
+        elif ch == ";":
+            statement = "".join(buf).strip()
+            if statement:
+                statements.append(statement)
+            buf = []
+            i += 1
+            continue
+        buf.append(ch)
+        i += 1
+    statement = "".join(buf).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def _watch_progress(pid, label, stop):
+    import psycopg2
+
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        while not stop.wait(PROGRESS_INTERVAL):
+            cur.execute(PROGRESS_SQL, (pid,))
+            row = cur.fetchone()
+            if row is None:
+                continue
+            phase, blocks_done, blocks_total, tuples_done, tuples_total, lockers_done, lockers_total = row
+            if phase.startswith("waiting"):
+                detail = f"lockers {lockers_done}/{lockers_total}"
+            elif blocks_total:
+                detail = f"blocks {blocks_done}/{blocks_total} ({blocks_done * 100 // blocks_total}%)"
+            else:
+                detail = f"tuples {tuples_done}/{tuples_total or '?'}"
+            print(f"    {label}: {phase}, {detail}", flush=True)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _run_with_progress(conn, statement, label):
+    stop = threading.Event()
+    watcher = threading.Thread(target=_watch_progress, args=(conn.get_backend_pid(), label, stop), daemon=True)
+    watcher.start()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(statement)
+    finally:
+        stop.set()
+        watcher.join()
+
+
+def _drop_if_invalid(conn, index):
+    """A failed concurrent build leaves an INVALID index that IF NOT EXISTS would silently keep."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (index,))
+        row = cur.fetchone()
+        if row and row[0]:
+            print(f"    dropping invalid index {index} left by an earlier failed build")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index};")
+
+
+def _create_index_concurrently(conn, match):
+    unique, index, table, rest = match.group(1) or "", match.group(2), match.group(3), match.group(4)
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+        row = cur.fetchone()
+    if not row or row[0] != "p":
+        _drop_if_invalid(conn, index)
+        _run_with_progress(conn, f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} {rest}", index)
+        return
+
+    # Partitioned: an invalid parent index on ONLY the parent, then one concurrent build per partition
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE {unique}INDEX IF NOT EXISTS {index} ON ONLY {table} {rest};")
+        cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s) ORDER BY 1;", (table,))
+        partitions = [r[0] for r in cur.fetchall()]
+    for partition in partitions:
+        child = f"{partition}_{index}"[:63]
+        _drop_if_invalid(conn, child)
+        _run_with_progress(conn, f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {rest}", child)
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s) AND inhparent = to_regclass(%s);", (child, index))
+            if cur.fetchone() is None:
+                cur.execute(f"ALTER INDEX {index} ATTACH PARTITION {child};")
+
+
+def _apply(conn, migration, lock_timeout):
+    start = time.perf_counter()
+    if migration.transactional:
+        with conn.cursor() as cur:
+            if lock_timeout:
+                cur.execute("SELECT set_config('lock_timeout', %s, true);", (lock_timeout,))
+            cur.execute(migration.sql)
+    else:
+        conn.autocommit = True
+        try:
+            for statement in split_statements(migration.sql):
+                match = _CONCURRENT_INDEX_RE.match(statement)
+                if match:
+                    _create_index_concurrently(conn, match)
+                else:
+                    with conn.cursor() as cur:
+                        cur.execute(statement)
+        finally:
+            conn.autocommit = False
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO schema_version (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s);",
+            (migration.version, migration.name, migration.checksum, int((time.perf_counter() - start) * 1000)),
+        )
+    conn.commit()
+
+
+def _applied(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_VERSION_SQL)
+        cur.execute("SELECT version, checksum, applied_at FROM schema_version ORDER BY version;")
+        rows = cur.fetchall()
+    conn.commit()
+    return {version: (checksum, applied_at) for version, checksum, applied_at in rows}
+
+
+def migrate(target=None, lock_timeout=MIGRATION_LOCK_TIMEOUT):
+    """Apply pending migrations up to `target` (all when None); returns the applied ones."""
+    import psycopg2
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        with conn.cursor() as cur:
+            # Serialize concurrent deploys; session-level so it spans autocommit steps
+            cur.execute("SELECT pg_advisory_lock(%s);", (ADVISORY_LOCK_ID,))
+        conn.commit()
+        applied = _applied(conn)
+        done = []
+        for migration in load_migrations():
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                if applied[migration.version][0] != migration.checksum:
+                    print(f"warning: {migration} changed after it was applied")
+                continue
+            mode = "transactional" if migration.transactional else "no-transaction"
+            print(f"Applying {migration} ({mode})", flush=True)
+            try:
+                _apply(conn, migration, lock_timeout)
+            except Exception:
+                conn.rollback()
+                raise
+            done.append(migration)
+        return done
+    finally:
+        conn.close()
+
+
+def cmd_status(args):
+    import psycopg2
+
+    conn = psycopg2.connect(DATABASE_URL)
+    applied = _applied(conn)
+    conn.close()
+    for migration in load_migrations():
+        state = applied.get(migration.version)
+        if state is None:
+            print(f"  pending  {migration}")
+        else:
+            changed = "  (changed since applied)" if state[0] != migration.checksum else ""
+            print(f"  applied  {migration}  {state[1]:%Y-%m-%d %H:%M}{changed}")
+
+
+def cmd_up(args):
+    done = migrate(args.to, args.lock_timeout)
+    print(f"Applied {len(done)} migration(s)" if done else "Schema is up to date")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply numbered schema migrations")
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status"))
+    parser.add_argument("--to", type=int, help="stop after this migration number")
+    parser.add_argument("--lock-timeout", default=MIGRATION_LOCK_TIMEOUT,
+                        help="lock_timeout for transactional migrations, e.g. 5s (default: MIGRATION_LOCK_TIMEOUT)")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+    {"up": cmd_up, "status": cmd_status}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+-- Baseline schema (formerly the inline SQL in init_db.py); every statement is idempotent
+-- so it is safe on databases created before schema_version existed.
+-- Create submissions table to store arbitrary form data as JSON
+CREATE TABLE IF NOT EXISTS submissions (
+    id SERIAL PRIMARY KEY,
+    data JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+-- Indexes to speed JSONB queries and common student lookups
+CREATE INDEX IF NOT EXISTS idx_submissions_data ON submissions USING GIN (data);
+CREATE INDEX IF NOT EXISTS idx_submissions_student_name_lower ON submissions (lower((data->'student'->>'name')));
+CREATE INDEX IF NOT EXISTS idx_submissions_student_roll ON submissions ((data->'student'->>'rollNumber'));
+-- Users table for basic authentication
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Associate submissions with users (nullable for existing records)
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS user_id INTEGER;
+-- Note: adding a foreign key constraint via ALTER TABLE IF NOT EXISTS is not portable across all Postgres versions,
+-- so we only create an index on user_id to support queries.
+CREATE INDEX IF NOT EXISTS idx_submissions_user_id ON submissions (user_id);
+
+-- Academic year copied out of data->'student' by the app on insert.  It is the partition key
+-- when submissions is partitioned (see partitions.py), so it must be a plain column.
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS academic_year TEXT NOT NULL DEFAULT '';
+UPDATE submissions SET academic_year = btrim(data->'student'->>'academicYear')
+    WHERE academic_year = '' AND btrim(COALESCE(data->'student'->>'academicYear', '')) <> '';
+CREATE INDEX IF NOT EXISTS idx_submissions_academic_year ON submissions (academic_year);
+
+-- Idempotency keys sent by clients on POST /submit (NULLs are allowed and never conflict).
+-- academic_year is part of the key because unique indexes on a partitioned table need the partition key.
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+DROP INDEX IF EXISTS idx_submissions_idempotency_key;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_submissions_idempotency_year ON submissions (idempotency_key, academic_year);
+-- Write counter for cheap HTTP validators (ETag / Last-Modified) on read endpoints;
+-- bumped once per statement that changes submissions, whichever client wrote it.
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO data_versions (name) VALUES ('submissions') ON CONFLICT (name) DO NOTHING;
+CREATE OR REPLACE FUNCTION bump_submissions_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE data_versions SET version = version + 1, updated_at = clock_timestamp() WHERE name = 'submissions';
+    RETURN NULL;
+END;
+$$;
+DROP TRIGGER IF EXISTS trg_submissions_version ON submissions;
+CREATE TRIGGER trg_submissions_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON submissions
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_submissions_version();
+
+-- The unique (rollNumber, semester, academicYear) index used by upsert mode is created by
+-- dedup_submissions.py, because it cannot be built while duplicate rows still exist.
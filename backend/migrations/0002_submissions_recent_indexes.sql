@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Newest-first listing (ORDER BY created_at DESC LIMIT n) and the semester filter
+-- without a full scan and sort.  Built concurrently so writes are not blocked.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_submissions_created_at ON submissions (created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_submissions_semester_created ON submissions ((data->'student'->>'semester'), created_at DESC);
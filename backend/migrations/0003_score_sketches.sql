@@ -0,0 +1,11 @@
+-- Per-cohort t-digests of overall and per-subject scores (see sketches.py).
+-- subject '' is the overall percentage; course and subject are stored lower-cased.
+CREATE TABLE IF NOT EXISTS score_sketches (
+    course TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    sketch BYTEA NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (course, semester, subject)
+);
@@ -0,0 +1,65 @@
+-- One row per subject of every submission, kept in step with submissions by triggers,
+-- for /analytics/cube (see cube.py).  Numbers follow the analytics: missing or non-numeric
+-- marks count as 0, missing/zero maxMarks as 100.
+CREATE TABLE IF NOT EXISTS submission_subject_facts (
+    submission_id INTEGER NOT NULL,
+    ordinal INTEGER NOT NULL,
+    academic_year TEXT NOT NULL,
+    university TEXT,
+    course TEXT,
+    semester TEXT,
+    subject TEXT,
+    marks DOUBLE PRECISION NOT NULL,
+    max_marks DOUBLE PRECISION NOT NULL,
+    score DOUBLE PRECISION GENERATED ALWAYS AS (marks / max_marks * 100) STORED,
+    passed BOOLEAN GENERATED ALWAYS AS (marks >= max_marks * 0.4) STORED,
+    PRIMARY KEY (submission_id, ordinal)
+);
+CREATE INDEX IF NOT EXISTS idx_subject_facts_course_semester ON submission_subject_facts (lower(course), semester);
+
+CREATE OR REPLACE FUNCTION subject_facts(p_id INTEGER, p_academic_year TEXT, p_data JSONB)
+RETURNS TABLE (submission_id INTEGER, ordinal INTEGER, academic_year TEXT, university TEXT, course TEXT,
+               semester TEXT, subject TEXT, marks DOUBLE PRECISION, max_marks DOUBLE PRECISION)
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT p_id, s.ordinal::int, p_academic_year,
+           NULLIF(btrim(p_data->'student'->>'universityName'), ''),
+           NULLIF(btrim(p_data->'student'->>'courseName'), ''),
+           NULLIF(btrim(p_data->'student'->>'semester'), ''),
+           NULLIF(btrim(s.value->>'name'), ''),
+           CASE WHEN s.value->>'marksObtained' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                THEN (s.value->>'marksObtained')::float8 ELSE 0 END,
+           COALESCE(NULLIF(CASE WHEN s.value->>'maxMarks' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                                THEN (s.value->>'maxMarks')::float8 ELSE 0 END, 0), 100)
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(p_data->'subjects') = 'array' THEN p_data->'subjects' ELSE '[]'::jsonb END)
+         WITH ORDINALITY AS s(value, ordinal);
+$$;
+
+CREATE OR REPLACE FUNCTION sync_subject_facts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE submission_subject_facts;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM submission_subject_facts WHERE submission_id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO submission_subject_facts (submission_id, ordinal, academic_year, university, course, semester, subject, marks, max_marks)
+        SELECT * FROM subject_facts(NEW.id, NEW.academic_year, NEW.data);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_submissions_subject_facts ON submissions;
+CREATE TRIGGER trg_submissions_subject_facts AFTER INSERT OR UPDATE OR DELETE ON submissions
+    FOR EACH ROW EXECUTE FUNCTION sync_subject_facts();
+DROP TRIGGER IF EXISTS trg_submissions_subject_facts_truncate ON submissions;
+CREATE TRIGGER trg_submissions_subject_facts_truncate AFTER TRUNCATE ON submissions
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_subject_facts();
+
+-- Backfill existing submissions
+TRUNCATE submission_subject_facts;
+INSERT INTO submission_subject_facts (submission_id, ordinal, academic_year, university, course, semester, subject, marks, max_marks)
+SELECT f.* FROM submissions AS sub CROSS JOIN LATERAL subject_facts(sub.id, sub.academic_year, sub.data) AS f;
+ANALYZE submission_subject_facts;
@@ -0,0 +1,45 @@
+-- Year-over-year aggregates for /analytics/trends (see trends.py), refreshed with
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY, which needs the unique indexes below.
+-- Missing course/semester/subject become '' so every row has a unique key.
+CREATE MATERIALIZED VIEW IF NOT EXISTS subject_year_stats AS
+SELECT COALESCE(course, '') AS course,
+       COALESCE(semester, '') AS semester,
+       COALESCE(subject, '') AS subject,
+       academic_year,
+       count(*) AS entries,
+       avg(score) AS avg_score,
+       avg(marks) AS avg_marks,
+       stddev_pop(score) AS stddev_score,
+       min(score) AS min_score,
+       max(score) AS max_score,
+       avg(passed::int) * 100 AS pass_rate
+FROM submission_subject_facts
+GROUP BY 1, 2, 3, 4;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_subject_year_stats_key ON subject_year_stats (course, semester, subject, academic_year);
+
+-- Per student (overall percentage and pass/fail as in result-utils.ts), then per cohort and year
+CREATE MATERIALIZED VIEW IF NOT EXISTS cohort_year_stats AS
+SELECT course, semester, academic_year,
+       count(*) AS students,
+       avg(percentage) AS avg_percentage,
+       stddev_pop(percentage) AS stddev_percentage,
+       min(percentage) AS min_percentage,
+       max(percentage) AS max_percentage,
+       avg((NOT failed)::int) * 100 AS pass_rate
+FROM (
+    SELECT submission_id,
+           COALESCE(course, '') AS course,
+           COALESCE(semester, '') AS semester,
+           academic_year,
+           sum(marks) / sum(max_marks) * 100 AS percentage,
+           bool_or(NOT passed) AS failed
+    FROM submission_subject_facts
+    GROUP BY 1, 2, 3, 4
+) per_student
+GROUP BY 1, 2, 3;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cohort_year_stats_key ON cohort_year_stats (course, semester, academic_year);
+
+-- Submissions version the views were last refreshed at (compared with 'submissions' to detect staleness)
+INSERT INTO data_versions (name, version)
+VALUES ('trends', COALESCE((SELECT version FROM data_versions WHERE name = 'submissions'), 0))
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,126 @@
+-- Subject catalog: one id per subject, whatever spelling a submission uses.  Spellings are
+-- folded by subject_key() (case, surrounding/repeated spaces and punctuation; mirrored by
+-- subject_catalog.normalize) and subject_aliases maps every known key, the subject's own
+-- included, to its id, so "Maths", "MATHS" and "Mathematics " are one subject.
+CREATE TABLE IF NOT EXISTS subjects (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS subject_aliases (
+    key TEXT PRIMARY KEY,
+    subject_id INTEGER NOT NULL REFERENCES subjects (id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_subject_aliases_subject ON subject_aliases (subject_id);
+
+CREATE OR REPLACE FUNCTION subject_key(p_name TEXT) RETURNS TEXT LANGUAGE sql IMMUTABLE AS $$
+    SELECT btrim(regexp_replace(lower(p_name), '[\s.,;:_/()''"-]+', ' ', 'g'));
+$$;
+
+-- Id of a known spelling, NULL otherwise (for filters)
+CREATE OR REPLACE FUNCTION subject_lookup(p_name TEXT) RETURNS INTEGER LANGUAGE sql STABLE AS $$
+    SELECT subject_id FROM subject_aliases WHERE key = subject_key(p_name);
+$$;
+
+-- Id of a spelling, adding a subject named after it the first time it is seen (at ingestion)
+CREATE OR REPLACE FUNCTION resolve_subject(p_name TEXT) RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    k TEXT := subject_key(p_name);
+    sid INTEGER;
+BEGIN
+    IF k IS NULL OR k = '' THEN
+        RETURN NULL;
+    END IF;
+    SELECT subject_id INTO sid FROM subject_aliases WHERE key = k;
+    IF FOUND THEN
+        RETURN sid;
+    END IF;
+    -- Concurrent first sightings of a spelling queue here; the later ones find the alias
+    PERFORM pg_advisory_xact_lock(hashtext('subject_aliases'), hashtext(k));
+    SELECT subject_id INTO sid FROM subject_aliases WHERE key = k;
+    IF FOUND THEN
+        RETURN sid;
+    END IF;
+    INSERT INTO subjects (name) VALUES (regexp_replace(btrim(p_name), '\s+', ' ', 'g')) RETURNING id INTO sid;
+    INSERT INTO subject_aliases (key, subject_id) VALUES (k, sid);
+    RETURN sid;
+END;
+$$;
+
+-- Common abbreviations; more with `python subject_catalog.py alias`
+SELECT resolve_subject('Mathematics');
+INSERT INTO subject_aliases (key, subject_id)
+SELECT k, subject_lookup('Mathematics') FROM unnest(ARRAY['maths', 'math']) AS k
+ON CONFLICT (key) DO NOTHING;
+
+-- Backfill the catalog from the facts, most frequent spelling first so it becomes the display name
+SELECT count(resolve_subject(subject)) FROM (
+    SELECT subject, count(*) AS n FROM submission_subject_facts WHERE subject IS NOT NULL
+    GROUP BY subject ORDER BY n DESC, subject
+) AS spellings;
+
+-- Facts keep the subject id instead of its name
+DROP MATERIALIZED VIEW IF EXISTS subject_year_stats;
+DROP FUNCTION IF EXISTS subject_facts(INTEGER, TEXT, JSONB);
+CREATE FUNCTION subject_facts(p_id INTEGER, p_academic_year TEXT, p_data JSONB)
+RETURNS TABLE (submission_id INTEGER, ordinal INTEGER, academic_year TEXT, university TEXT, course TEXT,
+               semester TEXT, subject_id INTEGER, marks DOUBLE PRECISION, max_marks DOUBLE PRECISION)
+LANGUAGE sql AS $$
+    SELECT p_id, s.ordinal::int, p_academic_year,
+           NULLIF(btrim(p_data->'student'->>'universityName'), ''),
+           NULLIF(btrim(p_data->'student'->>'courseName'), ''),
+           NULLIF(btrim(p_data->'student'->>'semester'), ''),
+           resolve_subject(s.value->>'name'),
+           CASE WHEN s.value->>'marksObtained' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                THEN (s.value->>'marksObtained')::float8 ELSE 0 END,
+           COALESCE(NULLIF(CASE WHEN s.value->>'maxMarks' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                                THEN (s.value->>'maxMarks')::float8 ELSE 0 END, 0), 100)
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(p_data->'subjects') = 'array' THEN p_data->'subjects' ELSE '[]'::jsonb END)
+         WITH ORDINALITY AS s(value, ordinal);
+$$;
+
+CREATE OR REPLACE FUNCTION sync_subject_facts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE submission_subject_facts;
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM submission_subject_facts WHERE submission_id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO submission_subject_facts (submission_id, ordinal, academic_year, university, course, semester, subject_id, marks, max_marks)
+        SELECT * FROM subject_facts(NEW.id, NEW.academic_year, NEW.data);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+ALTER TABLE submission_subject_facts DROP COLUMN IF EXISTS subject;
+ALTER TABLE submission_subject_facts ADD COLUMN IF NOT EXISTS subject_id INTEGER;
+CREATE INDEX IF NOT EXISTS idx_subject_facts_subject ON submission_subject_facts (subject_id);
+-- Rewrite rather than update in place, so the dropped names' space is returned
+TRUNCATE submission_subject_facts;
+INSERT INTO submission_subject_facts (submission_id, ordinal, academic_year, university, course, semester, subject_id, marks, max_marks)
+SELECT f.* FROM submissions AS sub CROSS JOIN LATERAL subject_facts(sub.id, sub.academic_year, sub.data) AS f;
+ANALYZE submission_subject_facts;
+
+-- Trend views per subject id (0: entries without a subject name); names come from subjects
+CREATE MATERIALIZED VIEW subject_year_stats AS
+SELECT COALESCE(course, '') AS course,
+       COALESCE(semester, '') AS semester,
+       COALESCE(subject_id, 0) AS subject_id,
+       academic_year,
+       count(*) AS entries,
+       avg(score) AS avg_score,
+       avg(marks) AS avg_marks,
+       stddev_pop(score) AS stddev_score,
+       min(score) AS min_score,
+       max(score) AS max_score,
+       avg(passed::int) * 100 AS pass_rate
+FROM submission_subject_facts
+GROUP BY 1, 2, 3, 4;
+CREATE UNIQUE INDEX idx_subject_year_stats_key ON subject_year_stats (course, semester, subject_id, academic_year);
+REFRESH MATERIALIZED VIEW cohort_year_stats;
+UPDATE data_versions SET version = (SELECT version FROM data_versions WHERE name = 'submissions'), updated_at = NOW()
+WHERE name = 'trends';
@@ -0,0 +1,58 @@
+-- Versioned grading rule sets and the grade computed for each submission (see grading.py).
+-- university is lower(btrim(universityName)); '' is the rule set for every other university.
+-- The highest version per university is current; older versions stay for stored grades.
+CREATE TABLE IF NOT EXISTS grading_rules (
+    id SERIAL PRIMARY KEY,
+    university TEXT NOT NULL DEFAULT '',
+    version INTEGER NOT NULL,
+    rules JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE (university, version)
+);
+
+-- Kept beside submissions rather than in it, so a re-grade rewrites these narrow rows only
+CREATE TABLE IF NOT EXISTS submission_grades (
+    submission_id INTEGER PRIMARY KEY,
+    rule_id INTEGER NOT NULL REFERENCES grading_rules (id),
+    total_obtained DOUBLE PRECISION NOT NULL,
+    total_max DOUBLE PRECISION NOT NULL,
+    percentage DOUBLE PRECISION NOT NULL,
+    status TEXT NOT NULL,
+    cgpa DOUBLE PRECISION,
+    failed_subjects INTEGER NOT NULL,
+    graded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_submission_grades_rule ON submission_grades (rule_id);
+
+-- Version 1: the rules of src/lib/result-utils.ts, plus a 10-point grade-point scale for CGPA
+INSERT INTO grading_rules (university, version, rules) VALUES ('', 1, '{
+    "passPercent": 40,
+    "aggregatePassPercent": 0,
+    "failLabel": "Fail",
+    "bands": [{"name": "Distinction", "min": 75}, {"name": "First Class", "min": 60},
+              {"name": "Second Class", "min": 50}, {"name": "Pass", "min": 0}],
+    "gradePoints": [{"min": 90, "points": 10}, {"min": 80, "points": 9}, {"min": 70, "points": 8},
+                    {"min": 60, "points": 7}, {"min": 55, "points": 6}, {"min": 50, "points": 5},
+                    {"min": 40, "points": 4}],
+    "failPoints": 0
+}') ON CONFLICT (university, version) DO NOTHING;
+
+-- A changed or deleted submission loses its grade; the app grades writes in the same
+-- transaction and `python grading.py regrade` fills in anything else
+CREATE OR REPLACE FUNCTION drop_submission_grade() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE submission_grades;
+    ELSE
+        DELETE FROM submission_grades WHERE submission_id = OLD.id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_submissions_grades ON submissions;
+CREATE TRIGGER trg_submissions_grades AFTER UPDATE OF data OR DELETE ON submissions
+    FOR EACH ROW EXECUTE FUNCTION drop_submission_grade();
+DROP TRIGGER IF EXISTS trg_submissions_grades_truncate ON submissions;
+CREATE TRIGGER trg_submissions_grades_truncate AFTER TRUNCATE ON submissions
+    FOR EACH STATEMENT EXECUTE FUNCTION drop_submission_grade();
@@ -0,0 +1,8 @@
+-- Result emails sent per provider and UTC day, against the EMAIL_<PROVIDER>_DAILY quotas
+-- (mail_scheduler.py); shared by every app process and the bulk mailer
+CREATE TABLE IF NOT EXISTS email_daily_usage (
+    provider TEXT NOT NULL,
+    day DATE NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, day)
+);
@@ -0,0 +1,5 @@
+-- Per-subject score sketches are keyed by subject catalog id (migration 0006) instead of the
+-- lower-cased name.  Digests cannot be split or merged in SQL, so the name-keyed ones are
+-- dropped; `python sketches.py rebuild` recreates them from the submissions.  The overall
+-- digests (subject '') are unchanged.
+DELETE FROM score_sketches WHERE subject <> '';
@@ -0,0 +1,70 @@
+-- Pass/fail of the per-subject facts follows the current grading rule set of the submission's
+-- university (grading.py) instead of the fixed 40% of migration 0004.  A generated column
+-- cannot read grading_rules, so `passed` moves from submission_subject_facts to the
+-- subject_results view, which joins each fact to its pass marks; publishing a rule set
+-- changes the answers of /analytics/cube at once and of the trend views at their next refresh.
+
+-- Pass marks of the newest rule set per university key ('' for every other university)
+CREATE OR REPLACE VIEW current_pass_marks AS
+SELECT DISTINCT ON (university) university,
+       (rules->>'passPercent')::float8 AS pass_percent,
+       (rules->>'aggregatePassPercent')::float8 AS aggregate_pass_percent
+FROM grading_rules
+ORDER BY university, version DESC;
+
+DROP MATERIALIZED VIEW IF EXISTS subject_year_stats;
+DROP MATERIALIZED VIEW IF EXISTS cohort_year_stats;
+ALTER TABLE submission_subject_facts DROP COLUMN IF EXISTS passed;
+-- The rule sets' key (grading.university_key); stored, as lower() per row would double a cube scan
+ALTER TABLE submission_subject_facts
+    ADD COLUMN IF NOT EXISTS university_key TEXT GENERATED ALWAYS AS (COALESCE(lower(university), '')) STORED;
+
+CREATE OR REPLACE VIEW subject_results AS
+SELECT f.*,
+       f.marks >= f.max_marks * COALESCE(own.pass_percent, other.pass_percent) / 100 AS passed,
+       COALESCE(own.aggregate_pass_percent, other.aggregate_pass_percent) AS aggregate_pass_percent
+FROM submission_subject_facts AS f
+LEFT JOIN current_pass_marks AS own ON own.university = f.university_key
+LEFT JOIN current_pass_marks AS other ON other.university = '';
+
+-- The trend views of migrations 0005/0006, now over subject_results
+CREATE MATERIALIZED VIEW subject_year_stats AS
+SELECT COALESCE(course, '') AS course,
+       COALESCE(semester, '') AS semester,
+       COALESCE(subject_id, 0) AS subject_id,
+       academic_year,
+       count(*) AS entries,
+       avg(score) AS avg_score,
+       avg(marks) AS avg_marks,
+       stddev_pop(score) AS stddev_score,
+       min(score) AS min_score,
+       max(score) AS max_score,
+       avg(passed::int) * 100 AS pass_rate
+FROM subject_results
+GROUP BY 1, 2, 3, 4;
+CREATE UNIQUE INDEX idx_subject_year_stats_key ON subject_year_stats (course, semester, subject_id, academic_year);
+
+-- Per student (overall percentage; failed as grading.grade() decides it), then per cohort and year
+CREATE MATERIALIZED VIEW cohort_year_stats AS
+SELECT course, semester, academic_year,
+       count(*) AS students,
+       avg(percentage) AS avg_percentage,
+       stddev_pop(percentage) AS stddev_percentage,
+       min(percentage) AS min_percentage,
+       max(percentage) AS max_percentage,
+       avg((NOT failed)::int) * 100 AS pass_rate
+FROM (
+    SELECT submission_id,
+           COALESCE(course, '') AS course,
+           COALESCE(semester, '') AS semester,
+           academic_year,
+           sum(marks) / sum(max_marks) * 100 AS percentage,
+           bool_or(NOT passed) OR sum(marks) / sum(max_marks) * 100 < max(aggregate_pass_percent) AS failed
+    FROM subject_results
+    GROUP BY 1, 2, 3, 4
+) per_student
+GROUP BY 1, 2, 3;
+CREATE UNIQUE INDEX idx_cohort_year_stats_key ON cohort_year_stats (course, semester, academic_year);
+
+UPDATE data_versions SET version = (SELECT version FROM data_versions WHERE name = 'submissions'), updated_at = NOW()
+WHERE name = 'trends';
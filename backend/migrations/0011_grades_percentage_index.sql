@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- /toppers reads the best stored grades (ORDER BY percentage DESC LIMIT n) without sorting every
+-- grade.  Built concurrently so writes are not blocked.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_submission_grades_percentage ON submission_grades (percentage DESC);
@@ -0,0 +1,356 @@
+"""Partition `submissions` by academic year and archive cold years.
+
+`migrate` converts the plain table into one LIST-partitioned on the
+academic_year column: one partition per year plus a default partition for
+rows without a (known) year.  It copies every row while holding an exclusive
+lock, so run it in a maintenance window.  The old table is kept as
+`submissions_unpartitioned` until you drop it (or pass --drop-old).  Indexes
+and triggers are recreated from the old table; grants and row-level security
+policies are not, so re-apply those if you use them (e.g. on Supabase).
+
+Reads that pass ?academic_year= (the `academic_year` filter of _fetch_rows)
+are planned against that year's partition only.
+
+Usage:
+    python partitions.py migrate [--drop-old]
+    python partitions.py list
+    python partitions.py create 2026-27            # before the year starts; moves rows out of the default partition
+    python partitions.py archive 2021-22 --out-dir archive
+    python partitions.py restore archive/submissions_y2021_22.csv.gz
+
+`archive` exports a year to <out-dir>/<partition>.csv.gz plus a .json
+manifest, then detaches and drops the partition.  `restore` loads the file
+into a new table and attaches it again.  Run init_db.py first.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+import grading
+import trends
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+TABLE = "submissions"
+OLD_TABLE = "submissions_unpartitioned"
+DEFAULT_PARTITION = "submissions_default"
+FACTS_TABLE = "submission_subject_facts"  # per-subject rows for /analytics/cube, see migrations/0004 and 0006
+GRADES_TABLE = "submission_grades"  # stored grades, see grading.py
+
+BUMP_VERSION_SQL = "UPDATE data_versions SET version = version + 1, updated_at = clock_timestamp() WHERE name = 'submissions';"
+
+
+def partition_name(year):
+    slug = re.sub(r"[^0-9a-z]+", "_", year.strip().lower()).strip("_")
+    if not slug:
+        raise ValueError("academic year must not be empty")
+    return f"submissions_y{slug}"[:63]
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def _is_partitioned(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (TABLE,))
+    row = cur.fetchone()
+    if row is None:
+        raise SystemExit(f"table {TABLE} does not exist; run init_db.py first")
+    return row[0] == "p"
+
+
+def _partitions(cur):
+    cur.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, pg_total_relation_size(c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname;",
+        (TABLE,),
+    )
+    return cur.fetchall()
+
+
+def _create_partition(cur, year):
+    """Create the partition for `year`, moving any of its rows out of the default partition."""
+    from psycopg2 import sql
+
+    name = partition_name(year)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    if cur.fetchone()[0]:
+        return name, 0
+    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;").format(sql.Identifier(DEFAULT_PARTITION)))
+    cur.execute(sql.SQL("SELECT count(*) FROM {} WHERE academic_year = %s;").format(sql.Identifier(DEFAULT_PARTITION)), (year,))
+    moved = cur.fetchone()[0]
+    if moved:
+        # The new partition cannot be created while the default one holds its rows
+        cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(sql.Identifier(TABLE), sql.Identifier(DEFAULT_PARTITION)))
+    cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES IN (%s);").format(sql.Identifier(name), sql.Identifier(TABLE)), (year,))
+    if moved:
+        cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM {} WHERE academic_year = %s;").format(
+            sql.Identifier(name), sql.Identifier(DEFAULT_PARTITION)), (year,))
+        cur.execute(sql.SQL("DELETE FROM {} WHERE academic_year = %s;").format(sql.Identifier(DEFAULT_PARTITION)), (year,))
+        cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} DEFAULT;").format(sql.Identifier(TABLE), sql.Identifier(DEFAULT_PARTITION)))
+    return name, moved
+
+
+def cmd_migrate(args):
+    from psycopg2 import sql
+
+    conn = _connect()
+    cur = conn.cursor()
+    if _is_partitioned(cur):
+        print(f"{TABLE} is already partitioned")
+        return
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (OLD_TABLE,))
+    if cur.fetchone()[0]:
+        raise SystemExit(f"{OLD_TABLE} already exists; drop it before migrating again")
+
+    cur.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE;")
+    cur.execute(
+        "SELECT i.relname, pg_get_indexdef(x.indexrelid), x.indisunique, x.indisprimary, "
+        "       pg_get_indexdef(x.indexrelid) ~ '\\macademic_year\\M' "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = to_regclass(%s);",
+        (TABLE,),
+    )
+    indexes = cur.fetchall()
+    bad = [name for name, _, unique, primary, has_year in indexes if unique and not primary and not has_year]
+    if bad:
+        raise SystemExit(f"unique indexes without academic_year cannot exist on a partitioned table: {', '.join(bad)} "
+                         "(run init_db.py and dedup_submissions.py first)")
+    cur.execute(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal;",
+        (TABLE,),
+    )
+    triggers = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (TABLE,))
+    sequence = cur.fetchone()[0]
+
+    # Move the old table and its index names out of the way; the definitions are replayed on the new table
+    cur.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE};")
+    for name, *_ in indexes:
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {};").format(sql.Identifier(name), sql.Identifier(f"{name[:50]}_unpart")))
+    cur.execute(f"CREATE TABLE {TABLE} (LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (academic_year);")
+    cur.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, academic_year);")
+    if sequence:
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id;")
+    cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT;").format(sql.Identifier(DEFAULT_PARTITION), sql.Identifier(TABLE)))
+    cur.execute(f"SELECT DISTINCT academic_year FROM {OLD_TABLE} WHERE academic_year <> '' ORDER BY 1;")
+    years = [row[0] for row in cur.fetchall()]
+    for year in years:
+        cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES IN (%s);").format(
+            sql.Identifier(partition_name(year)), sql.Identifier(TABLE)), (year,))
+
+    cur.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE};")
+    copied = cur.rowcount
+    # Build indexes after the bulk copy; they cascade to every partition
+    for name, definition, unique, primary, _ in indexes:
+        if not primary:
+            cur.execute(definition)
+    for definition in triggers:
+        cur.execute(definition)
+    cur.execute(BUMP_VERSION_SQL)
+    if args.drop_old:
+        cur.execute(f"DROP TABLE {OLD_TABLE};")
+    conn.commit()
+    cur.execute(f"ANALYZE {TABLE};")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print(f"Partitioned {TABLE}: {copied} rows into {len(years)} year partitions plus {DEFAULT_PARTITION}")
+    if not args.drop_old:
+        print(f"The original table is kept as {OLD_TABLE}; drop it once the application has been verified")
+
+
+def cmd_list(args):
+    conn = _connect()
+    cur = conn.cursor()
+    if not _is_partitioned(cur):
+        print(f"{TABLE} is not partitioned (run `python partitions.py migrate`)")
+        return
+    for name, bound, rows, size in _partitions(cur):
+        print(f"{name:32s} {bound:34s} ~{max(rows, 0):>10d} rows {size / 1048576:10.1f} MiB")
+    cur.close()
+    conn.close()
+
+
+def cmd_create(args):
+    conn = _connect()
+    cur = conn.cursor()
+    if not _is_partitioned(cur):
+        raise SystemExit(f"{TABLE} is not partitioned (run `python partitions.py migrate`)")
+    name, moved = _create_partition(cur, args.year.strip())
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"Created/verified {name} ({moved} rows moved from {DEFAULT_PARTITION})")
+
+
+def cmd_archive(args):
+    from psycopg2 import sql
+
+    year = args.year.strip()
+    name = partition_name(year)
+    conn = _connect()
+    cur = conn.cursor()
+    if not _is_partitioned(cur):
+        raise SystemExit(f"{TABLE} is not partitioned (run `python partitions.py migrate`)")
+    if name not in [p[0] for p in _partitions(cur)]:
+        raise SystemExit(f"no attached partition {name} for academic year {year!r}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    path = os.path.join(args.out_dir, f"{name}.csv.gz")
+    cur.execute(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(name)))
+    rows = cur.fetchone()[0]
+    conn.commit()
+
+    # Export while still attached (readers are not blocked), then detach only if nothing changed meanwhile
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=args.level) as f:
+        cur.copy_expert(sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(name)).as_string(conn), f)
+    conn.commit()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;").format(sql.Identifier(name)))
+    cur.execute(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(name)))
+    if cur.fetchone()[0] != rows:
+        conn.rollback()
+        raise SystemExit(f"{name} changed during the export; nothing was detached, run archive again")
+    # Neither does it drop the grades, which are keyed by submission id only
+    cur.execute(f"SELECT to_regclass('{GRADES_TABLE}') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute(sql.SQL(f"DELETE FROM {GRADES_TABLE} WHERE submission_id IN (SELECT id FROM {{}});").format(sql.Identifier(name)))
+    cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(sql.Identifier(TABLE), sql.Identifier(name)))
+    if not args.keep_table:
+        cur.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(name)))
+    # Detaching fires no row triggers, so drop the year's cube facts explicitly (grades went above)
+    cur.execute(f"SELECT to_regclass('{FACTS_TABLE}') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute(f"DELETE FROM {FACTS_TABLE} WHERE academic_year = %s;", (year,))
+    cur.execute(BUMP_VERSION_SQL)
+    conn.commit()
+    cur.close()
+    trends.refresh_after_import(conn)
+    conn.close()
+
+    manifest = {
+        "academic_year": year,
+        "partition": name,
+        "rows": rows,
+        "file": os.path.basename(path),
+        "sha256": digest.hexdigest(),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(args.out_dir, f"{name}.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Archived {rows} rows of {year} to {path} and {'detached' if args.keep_table else 'dropped'} {name}")
+
+
+def cmd_restore(args):
+    from psycopg2 import sql
+
+    path = args.file
+    manifest_path = re.sub(r"\.csv\.gz$", "", path) + ".json"
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    year, name = manifest["academic_year"], manifest["partition"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != manifest.get("sha256"):
+        raise SystemExit(f"{path} does not match the checksum in {manifest_path}")
+
+    conn = _connect()
+    cur = conn.cursor()
+    if not _is_partitioned(cur):
+        raise SystemExit(f"{TABLE} is not partitioned (run `python partitions.py migrate`)")
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    if cur.fetchone()[0]:
+        raise SystemExit(f"{name} already exists")
+
+    # Load into a standalone table first so the parent is only locked for the attach
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);").format(
+        sql.Identifier(name), sql.Identifier(TABLE)))
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        columns = next(iter(f)).strip().split(",")
+        f.seek(0)
+        copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER)").format(
+            sql.Identifier(name), sql.SQL(", ").join(sql.Identifier(c) for c in columns))
+        cur.copy_expert(copy.as_string(conn), f)
+    # Lets ATTACH skip the validation scan of the restored rows
+    cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} CHECK (academic_year = %s);").format(
+        sql.Identifier(name), sql.Identifier(f"{name[:50]}_year")), (year,))
+
+    # Rows submitted for this year after it was archived landed in the default partition
+    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE;").format(sql.Identifier(DEFAULT_PARTITION)))
+    cur.execute(sql.SQL("WITH moved AS (DELETE FROM {} WHERE academic_year = %s RETURNING *) INSERT INTO {} SELECT * FROM moved;").format(
+        sql.Identifier(DEFAULT_PARTITION), sql.Identifier(name)), (year,))
+    moved = cur.rowcount
+    cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES IN (%s);").format(
+        sql.Identifier(TABLE), sql.Identifier(name)), (year,))
+    cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(sql.Identifier(name), sql.Identifier(f"{name[:50]}_year")))
+    cur.execute(f"SELECT to_regclass('{FACTS_TABLE}') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        # Loaded while detached, so the facts triggers did not see these rows
+        cur.execute(f"DELETE FROM {FACTS_TABLE} WHERE academic_year = %s;", (year,))
+        cur.execute(sql.SQL(
+            f"INSERT INTO {FACTS_TABLE} (submission_id, ordinal, academic_year, university, course, semester, subject_id, marks, max_marks) "
+            "SELECT f.* FROM {} AS sub CROSS JOIN LATERAL subject_facts(sub.id, sub.academic_year, sub.data) AS f;"
+        ).format(sql.Identifier(name)))
+    cur.execute(BUMP_VERSION_SQL)
+    conn.commit()
+    cur.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(name)))
+    conn.commit()
+    cur.close()
+    trends.refresh_after_import(conn)
+    grading.regrade_after_import(conn)
+    conn.close()
+    print(f"Restored {manifest['rows']} rows of {year} into {name}" + (f" (plus {moved} from {DEFAULT_PARTITION})" if moved else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Academic-year partitioning and archival for submissions")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate = sub.add_parser("migrate", help="convert submissions into a partitioned table")
+    migrate.add_argument("--drop-old", action="store_true", help=f"drop {OLD_TABLE} after copying")
+
+    sub.add_parser("list", help="show partitions with estimated rows and size")
+
+    create = sub.add_parser("create", help="create the partition for an academic year")
+    create.add_argument("year")
+
+    archive = sub.add_parser("archive", help="export a year to a compressed file and detach it")
+    archive.add_argument("year")
+    archive.add_argument("--out-dir", default="archive")
+    archive.add_argument("--level", type=int, default=6, help="gzip compression level")
+    archive.add_argument("--keep-table", action="store_true", help="detach but do not drop the partition table")
+
+    restore = sub.add_parser("restore", help="re-attach a year from an archive file")
+    restore.add_argument("file", help="<partition>.csv.gz written by archive (its .json manifest must sit next to it)")
+
+    args = parser.parse_args()
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+
+    {"migrate": cmd_migrate, "list": cmd_list, "create": cmd_create,
+     "archive": cmd_archive, "restore": cmd_restore}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Password hashing off the request threads, with login throttling.
+
+Hashes are computed on a small dedicated pool (PASSWORD_HASH_WORKERS threads;
+hashlib releases the GIL, so that many cores at most) and at most
+PASSWORD_HASH_QUEUE further requests may wait for it.  Beyond that, submit()
+raises Busy and the caller answers 503 instead of letting a login burst
+occupy every web worker.  Token buckets per client IP and per account stop
+one source from monopolizing the pool at all.
+
+PASSWORD_HASH_METHOD selects the werkzeug method (e.g. "scrypt" or
+"pbkdf2:sha256:600000"; default: werkzeug's default).  Stored hashes made
+with other parameters are replaced after the next successful login.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import metrics
+
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD") or None
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or 2)
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE") or 32)
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT") or 10)
+# Auth attempts allowed in a burst and refilled per minute, per client IP and per account email
+AUTH_IP_BURST = float(os.getenv("AUTH_IP_BURST") or 20)
+AUTH_IP_PER_MINUTE = float(os.getenv("AUTH_IP_PER_MINUTE") or 20)
+AUTH_ACCOUNT_BURST = float(os.getenv("AUTH_ACCOUNT_BURST") or 5)
+AUTH_ACCOUNT_PER_MINUTE = float(os.getenv("AUTH_ACCOUNT_PER_MINUTE") or 5)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+_target_prefix = None
+
+
+class Busy(Exception):
+    """The hashing pool and its queue are full."""
+
+
+class TokenBucket:
+    """Per-key token buckets; keeps at most `max_keys` keys, dropping the least recently used."""
+
+    def __init__(self, burst, per_minute, max_keys=100_000):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Consume one token; returns 0 when allowed, else seconds until a token is available."""
+        if not key or self.burst <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+ip_throttle = TokenBucket(AUTH_IP_BURST, AUTH_IP_PER_MINUTE)
+account_throttle = TokenBucket(AUTH_ACCOUNT_BURST, AUTH_ACCOUNT_PER_MINUTE)
+
+
+def throttle(ip, account=None):
+    """Charge one attempt to the IP and account buckets; returns (reason, retry_after) or None."""
+    wait = ip_throttle.take(ip)
+    if wait:
+        metrics.AUTH_REJECTED.inc("ip_throttled")
+        return "too many attempts from this address", wait
+    wait = account_throttle.take(account) if account else 0
+    if wait:
+        metrics.AUTH_REJECTED.inc("account_throttled")
+        return "too many attempts for this account", wait
+    return None
+
+
+def submit(operation, fn, *args):
+    """Run fn(*args) on the hashing pool and return its Future; raises Busy when the queue is full."""
+    if not _slots.acquire(blocking=False):
+        metrics.AUTH_REJECTED.inc("busy")
+        raise Busy()
+    start = time.perf_counter()
+
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            metrics.PASSWORD_HASH.observe(time.perf_counter() - start, operation)
+
+    try:
+        future = _executor.submit(run)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def new_hash(password):
+    if PASSWORD_HASH_METHOD:
+        return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    return generate_password_hash(password)
+
+
+def hash_password(password):
+    return submit("hash", new_hash, password).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+def verify_password(pwhash, password):
+    return submit("verify", check_password_hash, pwhash, password).result(timeout=PASSWORD_HASH_TIMEOUT)
+
+
+def method_prefix(method=None):
+    """The "<method>:<params>" part of hashes werkzeug makes with `method` (default: its own default),
+    e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000", worked out without hashing; None if unknown.
+    """
+    import inspect
+    from werkzeug import security
+
+    if not method:
+        method = inspect.signature(generate_password_hash).parameters["method"].default
+    name, *args = method.split(":")
+    if name == "scrypt":
+        if not args:
+            args = ["32768", "8", "1"]
+        return f"scrypt:{':'.join(args)}" if len(args) == 3 else None
+    if name == "pbkdf2" and len(args) <= 2:
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) == 2 else security.DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    return None
+
+
+def needs_rehash(pwhash):
+    """True when `pwhash` was made with a different method or cost than new hashes use.
+    Never hashes, so it cannot be refused (Busy) after a login has already been verified.
+    """
+    global _target_prefix
+    if _target_prefix is None:
+        _target_prefix = method_prefix(PASSWORD_HASH_METHOD) or ""
+    return bool(_target_prefix) and (pwhash or "").split("$", 1)[0] != _target_prefix
+
+
+def rehash_later(password, store):
+    """Compute a new hash in the background and pass it to store(new_hash); skipped when busy."""
+    try:
+        future = submit("rehash", new_hash, password)
+    except Busy:
+        return
+
+    def done(f):
+        if f.exception() is None:
+            try:
+                store(f.result())
+            except Exception:
+                pass
+
+    future.add_done_callback(done)
@@ -0,0 +1,82 @@
+"""Opt-in per-request cProfile capture.
+
+A request is profiled when it carries `X-Profile: 1` and passes the admin check
+given to init_app, or when it is picked by PROFILE_SAMPLE_RATE (0..1, default 0).
+Each capture is written as a .pstats file to PROFILE_DIR; open it with
+`python -m pstats`, snakeviz, or convert it to a flamegraph with flameprof /
+gprof2dot.  Unprofiled requests only pay for one header lookup and a random().
+"""
+import os
+import re
+import time
+import random
+import cProfile
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(os.getcwd(), "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE") or 0)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES") or 200)
+
+_SAFE = re.compile(r"[^A-Za-z0-9]+")
+
+
+def _should_profile(request, is_admin):
+    if (request.headers.get("X-Profile") or "").strip().lower() in ("1", "true", "yes", "on"):
+        return is_admin()
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _prune():
+    files = list_profiles()
+    for info in files[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, info["name"]))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Return captured profiles, newest first, as dicts with name/size/modified."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".pstats"):
+            continue
+        st = os.stat(os.path.join(PROFILE_DIR, name))
+        out.append({"name": name, "size": st.st_size, "modified": st.st_mtime})
+    out.sort(key=lambda x: x["modified"], reverse=True)
+    return out
+
+
+def init_app(app, is_admin):
+    """Wrap selected requests in cProfile. `is_admin` is a zero-arg callable for the current request."""
+    from flask import g, request
+
+    @app.before_request
+    def _profile_start():
+        if not _should_profile(request, is_admin):
+            return
+        prof = cProfile.Profile()
+        g._profile = (prof, time.perf_counter())
+        prof.enable()
+
+    @app.after_request
+    def _profile_stop(response):
+        state = g.pop("_profile", None)
+        if state is None:
+            return response
+        prof, start = state
+        prof.disable()
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            route = request.url_rule.rule if request.url_rule is not None else request.path
+            ts = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+            name = f"{ts}_{request.method}_{_SAFE.sub('_', route).strip('_') or 'root'}_{elapsed_ms}ms.pstats"
+            prof.dump_stats(os.path.join(PROFILE_DIR, name))
+            response.headers["X-Profile-Id"] = name
+            _prune()
+        except Exception:
+            pass
+        return response
@@ -0,0 +1,143 @@
+"""Per-statement query statistics and slow-query logging.
+
+Every statement run through the app's cursor is folded into an in-process
+table keyed by its normalized SQL (numbers and placeholders replaced by `?`),
+so each filter combination of _fetch_rows aggregates into one entry whatever
+its parameter values or LIMIT/OFFSET.  Statements slower than SLOW_QUERY_MS are logged with their
+parameters on the "slow_query" logger (and appended to SLOW_QUERY_LOG_PATH as
+JSON lines when set).  A SLOW_QUERY_EXPLAIN_RATE fraction of slow SELECTs is
+re-run under EXPLAIN (ANALYZE, BUFFERS) and the plan kept with the entry.
+QUERY_STATS_MAX bounds how many distinct statements are tracked.
+"""
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 200)
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE") or 0)
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG_PATH")
+QUERY_STATS_MAX = int(os.getenv("QUERY_STATS_MAX") or 500)
+
+logger = logging.getLogger("slow_query")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_MAX_PARAM_CHARS = 120
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def normalize(query):
+    """SQL text with numeric literals and placeholders as `?` and whitespace collapsed.
+    Quoted strings are kept: in this app they are JSON keys, which identify the query shape.
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    text, parts, pos = str(query), [], 0
+    for m in _STRING.finditer(text):
+        parts.append(_NUMBER.sub("?", _PLACEHOLDER.sub("?", text[pos:m.start()])))
+        parts.append(m.group(0))
+        pos = m.end()
+    parts.append(_NUMBER.sub("?", _PLACEHOLDER.sub("?", text[pos:])))
+    text = _LIST.sub("(...)", "".join(parts))
+    return _SPACE.sub(" ", text).strip().rstrip(";").rstrip()
+
+
+def _short(value):
+    text = value if isinstance(value, str) else repr(getattr(value, "adapted", value))
+    return text if len(text) <= _MAX_PARAM_CHARS else text[:_MAX_PARAM_CHARS] + "..."
+
+
+def _params(vars):
+    if vars is None:
+        return None
+    if isinstance(vars, dict):
+        return {k: _short(v) for k, v in vars.items()}
+    return [_short(v) for v in vars]
+
+
+def record(query, vars, elapsed, rows=None):
+    """Fold one execution into the stats; returns True when it counts as slow."""
+    key = normalize(query)
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            if len(_stats) >= QUERY_STATS_MAX:
+                # Forget the statement that has cost the least so far
+                del _stats[min(_stats, key=lambda k: _stats[k]["total_s"])]
+            entry = _stats[key] = {"query": key, "calls": 0, "total_s": 0.0, "max_s": 0.0, "rows": 0,
+                                   "slow_calls": 0, "last_slow": None, "plan": None}
+        entry["calls"] += 1
+        entry["total_s"] += elapsed
+        entry["max_s"] = max(entry["max_s"], elapsed)
+        if rows is not None and rows >= 0:
+            entry["rows"] += rows
+        if slow:
+            entry["slow_calls"] += 1
+            entry["last_slow"] = {"at": time.time(), "duration_ms": round(elapsed * 1000, 3), "params": _params(vars)}
+    if slow:
+        _log_slow(key, vars, elapsed)
+    return slow
+
+
+def _log_slow(key, vars, elapsed):
+    logger.warning("slow query (%.1f ms): %s params=%s", elapsed * 1000, key, _params(vars))
+    if not SLOW_QUERY_LOG_PATH:
+        return
+    line = json.dumps({"t": time.time(), "duration_ms": round(elapsed * 1000, 3), "query": key, "params": _params(vars)},
+                      default=str)
+    try:
+        with _lock, open(SLOW_QUERY_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except Exception:
+        pass
+
+
+def should_explain(query):
+    """Sample slow read-only statements for EXPLAIN ANALYZE (which executes them again)."""
+    if SLOW_QUERY_EXPLAIN_RATE <= 0 or random.random() >= SLOW_QUERY_EXPLAIN_RATE:
+        return False
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    head = str(query).lstrip().split(None, 1)
+    return bool(head) and head[0].upper() == "SELECT"
+
+
+def attach_plan(query, plan):
+    key = normalize(query)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is not None:
+            entry["plan"] = {"at": time.time(), "text": plan}
+
+
+def top(limit=20, order="total"):
+    """Tracked statements sorted by total (default), mean or max time, with times in ms."""
+    sort_key = {
+        "total": lambda e: e["total_s"],
+        "mean": lambda e: e["total_s"] / e["calls"],
+        "max": lambda e: e["max_s"],
+        "calls": lambda e: e["calls"],
+    }.get(order, lambda e: e["total_s"])
+    with _lock:
+        entries = sorted(_stats.values(), key=sort_key, reverse=True)[:limit]
+        entries = [dict(e) for e in entries]
+    for e in entries:
+        e["total_ms"] = round(e.pop("total_s") * 1000, 3)
+        e["max_ms"] = round(e.pop("max_s") * 1000, 3)
+        e["mean_ms"] = round(e["total_ms"] / e["calls"], 3)
+    return entries
+
+
+def reset():
+    with _lock:
+        _stats.clear()
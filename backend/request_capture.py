@@ -0,0 +1,83 @@
+"""Sanitized request capture for load-test replay (see loadtest.py replay).
+
+Enabled by REQUEST_CAPTURE_PATH; each request becomes one JSON line with its
+timestamp, method, path, query args, sanitized JSON body, status and duration.
+Credentials and personal data never reach the file: passwords and emails are
+replaced, student names / roll / registration numbers are swapped for stable
+hashes, and only the presence of an Authorization header is recorded.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+
+REQUEST_CAPTURE_PATH = os.getenv("REQUEST_CAPTURE_PATH")
+REQUEST_CAPTURE_RATE = float(os.getenv("REQUEST_CAPTURE_RATE") or 1.0)
+
+# Operator endpoints and multipart uploads are not replayable
+_SKIP_PREFIXES = ("/metrics", "/admin", "/failed-emails", "/send-email")
+_REDACTED = "<redacted>"
+_lock = threading.Lock()
+
+
+def _pseudonym(value, prefix):
+    digest = hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:10]
+    return f"{prefix}-{digest}"
+
+
+def sanitize(body, parent=None):
+    """Return a copy of a JSON request body with credentials and PII replaced."""
+    if isinstance(body, list):
+        return [sanitize(v, parent) for v in body]
+    if not isinstance(body, dict):
+        return body
+    out = {}
+    for key, value in body.items():
+        if key in ("password", "email") and value:
+            out[key] = _REDACTED
+        elif key == "name" and isinstance(value, str) and parent != "subjects":
+            out[key] = _pseudonym(value, "name")
+        elif key in ("rollNumber", "registrationNumber") and value:
+            out[key] = _pseudonym(value, key)
+        else:
+            out[key] = sanitize(value, key)
+    return out
+
+
+def init_app(app):
+    if not REQUEST_CAPTURE_PATH:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _capture_start():
+        if request.path.startswith(_SKIP_PREFIXES) or random.random() >= REQUEST_CAPTURE_RATE:
+            return
+        g._capture_start = (time.time(), time.perf_counter())
+
+    @app.after_request
+    def _capture_record(response):
+        state = g.pop("_capture_start", None)
+        if state is None:
+            return response
+        wall, start = state
+        body = request.get_json(force=True, silent=True) if request.method == "POST" else None
+        entry = {
+            "t": wall,
+            "method": request.method,
+            "path": request.path,
+            "args": {k: (_pseudonym(v, "q") if k == "q" and v else v) for k, v in request.args.items()},
+            "auth": bool(request.headers.get("Authorization")),
+            "body": sanitize(body) if body is not None else None,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        try:
+            with _lock, open(REQUEST_CAPTURE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception:
+            pass
+        return response
@@ -0,0 +1,384 @@
+"""Mergeable quantile sketches of scores per cohort, for percentile ranks.
+
+One t-digest is kept per (course, semester, subject) in the score_sketches
+table; subject '' holds the overall percentage and the others, keyed by
+subject catalog id (subject_catalog.py), each subject's marks as a percentage
+of its maxMarks, so every spelling of a subject feeds one digest.  /submit
+folds every new submission into its cohort's digests in the same
+transaction, so "which percentile is this student in" is one primary-key
+lookup instead of a scan of the cohort.
+Digests of several cohorts merge into one (e.g. a course across semesters).
+
+A digest holds at most about SKETCH_COMPRESSION centroids (~1 KB stored) and
+answers percentile ranks within a fraction of a percent, most precisely in
+the tails.  Values are only ever added: a replaced (upserted) or deleted
+submission keeps counting until the sketches are rebuilt.
+
+Usage:
+    python sketches.py rebuild                    # recompute every digest from submissions
+    python sketches.py show --course BCA --semester 3
+"""
+import os
+import sys
+import math
+import struct
+import bisect
+import argparse
+
+import subject_catalog
+
+# python-dotenv is optional, as for api/submit.py, which imports this module and its imports
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SKETCH_COMPRESSION = int(os.getenv("SKETCH_COMPRESSION") or 100)
+
+OVERALL = ""  # subject key of the overall percentage
+_HEADER = struct.Struct("<BHddI")  # format version, compression, min, max, centroid count
+_FORMAT_VERSION = 1
+
+
+class TDigest:
+    """Merging t-digest (Dunning & Ertl) with the k1 arcsine scale function."""
+
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    @property
+    def count(self):
+        return sum(self.weights) + len(self._buffer)
+
+    def add(self, value):
+        value = float(value)
+        self._buffer.append(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.compression:
+            self.compress()
+
+    def merge(self, other):
+        """Fold `other` into this digest; the result summarizes both inputs."""
+        other.compress()
+        self.compress()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(list(zip(self.means + other.means, self.weights + other.weights)))
+        return self
+
+    def compress(self):
+        if self._buffer:
+            self._compress(list(zip(self.means, self.weights)) + [(v, 1) for v in self._buffer])
+            self._buffer = []
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(max(-1.0, min(1.0, 2 * q - 1)))
+
+    def _compress(self, centroids):
+        centroids.sort()
+        total = sum(w for _, w in centroids)
+        means, weights = [], []
+        if centroids:
+            mean, weight = centroids[0]
+            before = 0
+            k_lower = self._k(0)
+            for m, w in centroids[1:]:
+                if self._k((before + weight + w) / total) - k_lower <= 1:
+                    weight += w
+                    mean += (m - mean) * w / weight
+                else:
+                    means.append(mean)
+                    weights.append(weight)
+                    before += weight
+                    k_lower = self._k(before / total)
+                    mean, weight = m, w
+            means.append(mean)
+            weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def rank(self, value):
+        """Percentage of the values below `value`, counting ties as half (mid-rank); None when empty."""
+        self.compress()
+        n = sum(self.weights)
+        if not n:
+            return None
+        if value < self.min:
+            return 0.0
+        if value > self.max:
+            return 100.0
+        lo = bisect.bisect_left(self.means, value)
+        hi = bisect.bisect_right(self.means, value)
+        below = sum(self.weights[:lo])
+        if hi > lo:  # centroids exactly at `value`
+            return (below + sum(self.weights[lo:hi]) / 2) / n * 100
+        # Interpolate between the centroid centres around `value`; each centroid's weight sits half on either side
+        if lo == 0:
+            left_x, left_c = self.min, 0.0
+        else:
+            left_x, left_c = self.means[lo - 1], below - self.weights[lo - 1] / 2
+        if lo == len(self.means):
+            right_x, right_c = self.max, n
+        else:
+            right_x, right_c = self.means[lo], below + self.weights[lo] / 2
+        if right_x <= left_x:
+            return (left_c + right_c) / 2 / n * 100
+        return (left_c + (right_c - left_c) * (value - left_x) / (right_x - left_x)) / n * 100
+
+    def quantile(self, q):
+        """Approximate value at fraction `q` (0..1); None when empty."""
+        self.compress()
+        n = sum(self.weights)
+        if not n:
+            return None
+        target = max(0.0, min(1.0, q)) * n
+        xs = [self.min] + self.means + [self.max]
+        cs = [0.0]
+        seen = 0
+        for w in self.weights:
+            cs.append(seen + w / 2)
+            seen += w
+        cs.append(n)
+        i = bisect.bisect_left(cs, target)
+        if i == 0:
+            return self.min
+        if i >= len(cs):
+            return self.max
+        span = cs[i] - cs[i - 1]
+        frac = (target - cs[i - 1]) / span if span else 0.0
+        return xs[i - 1] + (xs[i] - xs[i - 1]) * frac
+
+    def to_bytes(self):
+        self.compress()
+        n = len(self.means)
+        return (_HEADER.pack(_FORMAT_VERSION, self.compression, self.min, self.max, n)
+                + struct.pack(f"<{n}d{n}I", *self.means, *(int(w) for w in self.weights)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        version, compression, lo, hi, n = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"unsupported sketch format {version}")
+        values = struct.unpack_from(f"<{n}d{n}I", data, _HEADER.size)
+        digest = cls(compression)
+        digest.means, digest.weights = list(values[:n]), list(values[n:])
+        digest.min, digest.max = lo, hi
+        return digest
+
+
+def cohort_key(student):
+    """(course, semester) key of a submission's student block; course is matched case-insensitively."""
+    student = student if isinstance(student, dict) else {}
+    semester = student.get("semester")
+    return str(student.get("courseName") or "").strip().lower(), "" if semester is None else str(semester).strip()
+
+
+def subject_key(subject_id):
+    """Sketch key of a catalog subject id."""
+    return str(subject_id)
+
+
+def _number(value, default):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+
+def scores(data, catalog=None):
+    """{subject key: score} for a submission: OVERALL -> percentage, each subject of `catalog`
+    ({normalized spelling: (subject id, name)}, as subject_catalog.load) -> % of its maxMarks.
+    Same defaults as the analytics: missing marks count as 0, missing/zero maxMarks as 100.
+    """
+    subjects = data.get("subjects") if isinstance(data, dict) else None
+    out = {}
+    total_obt = total_max = 0.0
+    for s in subjects if isinstance(subjects, list) else []:
+        marks = _number(s.get("marksObtained"), 0.0)
+        maxm = _number(s.get("maxMarks"), 0.0) or 100.0
+        total_obt += marks
+        total_max += maxm
+        entry = (catalog or {}).get(subject_catalog.normalize(s.get("name")))
+        if entry:
+            out[subject_key(entry[0])] = marks / maxm * 100
+    if not total_max:
+        return {}
+    out[OVERALL] = total_obt / total_max * 100
+    return out
+
+
+def catalog_of(cur, data):
+    """The subject catalog entries ({normalized spelling: (subject id, name)}) of a stored submission's subjects."""
+    subjects = data.get("subjects") if isinstance(data, dict) else None
+    names = [str(s.get("name") or "") for s in subjects if isinstance(s, dict)] if isinstance(subjects, list) else []
+    if not names:
+        return {}
+    cur.execute("SELECT a.key, s.id, s.name FROM subject_aliases AS a JOIN subjects AS s ON s.id = a.subject_id "
+                "WHERE a.key = ANY(%s);", (list({subject_catalog.normalize(n) for n in names}),))
+    return {key: (sid, name) for key, sid, name in cur.fetchall()}
+
+
+def record(cur, data):
+    """Add one new submission to its cohort's digests, inside the caller's transaction (after the
+    insert, whose trigger has added any new subject spelling to the catalog).
+    Rows are locked in subject order so concurrent submits to a cohort cannot deadlock.
+    """
+    values = scores(data, catalog_of(cur, data))
+    if not values:
+        return
+    course, semester = cohort_key(data.get("student"))
+    keys = sorted(values)
+    cur.execute(
+        "INSERT INTO score_sketches (course, semester, subject, sketch, count) "
+        "SELECT %s, %s, k, %s, 0 FROM unnest(%s::text[]) AS k ON CONFLICT DO NOTHING;",
+        (course, semester, _binary(TDigest().to_bytes()), keys),
+    )
+    cur.execute(
+        "SELECT subject, sketch FROM score_sketches WHERE course = %s AND semester = %s AND subject = ANY(%s) "
+        "ORDER BY subject FOR UPDATE;",
+        (course, semester, keys),
+    )
+    digests = {subject: TDigest.from_bytes(sketch) for subject, sketch in cur.fetchall()}
+    for key in keys:
+        digests[key].add(values[key])
+    cur.execute(
+        "UPDATE score_sketches AS s SET sketch = v.sketch, count = v.count, updated_at = NOW() "
+        "FROM unnest(%s::text[], %s::bytea[], %s::bigint[]) AS v(subject, sketch, count) "
+        "WHERE s.course = %s AND s.semester = %s AND s.subject = v.subject;",
+        (keys, [_binary(digests[k].to_bytes()) for k in keys], [int(digests[k].count) for k in keys],
+         course, semester),
+    )
+
+
+def load(cur, course=None, semester=None, subjects=None):
+    """{subject key: TDigest} merged over every cohort matching course/semester (None matches all)."""
+    where, params = [], []
+    if course is not None:
+        where.append("course = %s")
+        params.append(str(course).strip().lower())
+    if semester is not None:
+        where.append("semester = %s")
+        params.append(str(semester).strip())
+    if subjects is not None:
+        where.append("subject = ANY(%s)")
+        params.append(list(subjects))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    cur.execute(f"SELECT subject, sketch FROM score_sketches {where_sql};", tuple(params))
+    merged = {}
+    for subject, sketch in cur.fetchall():
+        digest = TDigest.from_bytes(sketch)
+        if subject in merged:
+            merged[subject].merge(digest)
+        else:
+            merged[subject] = digest
+    return merged
+
+
+def merge_subject(cur, source, target):
+    """Fold the digests of catalog subject `source` into `target`'s, cohort by cohort (subject_catalog merge)."""
+    cur.execute("SELECT course, semester, subject, sketch FROM score_sketches WHERE subject IN (%s, %s) "
+                "ORDER BY course, semester, subject FOR UPDATE;", (subject_key(source), subject_key(target)))
+    cohorts = {}
+    for course, semester, subject, sketch in cur.fetchall():
+        cohorts.setdefault((course, semester), {})[subject] = TDigest.from_bytes(sketch)
+    cur.execute("DELETE FROM score_sketches WHERE subject = %s;", (subject_key(source),))
+    for (course, semester), digests in cohorts.items():
+        digest = digests.get(subject_key(target)) or TDigest()
+        if subject_key(source) in digests:
+            digest.merge(digests[subject_key(source)])
+        cur.execute(
+            "INSERT INTO score_sketches (course, semester, subject, sketch, count) VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (course, semester, subject) DO UPDATE SET sketch = EXCLUDED.sketch, count = EXCLUDED.count, "
+            "updated_at = NOW();",
+            (course, semester, subject_key(target), _binary(digest.to_bytes()), int(digest.count)),
+        )
+
+
+def _binary(data):
+    import psycopg2
+    return psycopg2.Binary(data)
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def cmd_rebuild(args):
+    conn = _connect()
+    cur = conn.cursor()
+    # Taken before the scan: submits committed earlier are in the scan, later ones wait here and add
+    # themselves to the rebuilt digests, so nothing is lost or counted twice.  /submit's sketch
+    # update (not the insert itself) blocks until the rebuild commits.
+    cur.execute("LOCK TABLE score_sketches IN EXCLUSIVE MODE;")
+    catalog = subject_catalog.load(cur)
+    scan = conn.cursor(name="sketch_rebuild")  # server-side cursor: stream instead of loading every row
+    scan.itersize = 5000
+    scan.execute("SELECT data FROM submissions;")
+    digests = {}
+    rows = 0
+    for (data,) in scan:
+        rows += 1
+        course, semester = cohort_key(data.get("student") if isinstance(data, dict) else None)
+        for key, value in scores(data, catalog).items():
+            digest = digests.get((course, semester, key))
+            if digest is None:
+                digest = digests[(course, semester, key)] = TDigest()
+            digest.add(value)
+    scan.close()
+
+    cur.execute("DELETE FROM score_sketches;")
+    for (course, semester, key), digest in digests.items():
+        cur.execute(
+            "INSERT INTO score_sketches (course, semester, subject, sketch, count) VALUES (%s, %s, %s, %s, %s);",
+            (course, semester, key, _binary(digest.to_bytes()), int(digest.count)),
+        )
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"Rebuilt {len(digests)} sketch(es) from {rows} submission(s)")
+
+
+def cmd_show(args):
+    conn = _connect()
+    cur = conn.cursor()
+    merged = load(cur, args.course, args.semester)
+    names = {subject_key(sid): name for sid, name in subject_catalog.load(cur).values()}
+    cur.close()
+    conn.close()
+    if not merged:
+        print("No sketches match")
+        return
+    print(f"{'subject':<32} {'count':>8} {'p10':>7} {'p50':>7} {'p90':>7}")
+    for key in sorted(merged, key=lambda k: (k != OVERALL, names.get(k, k))):
+        d = merged[key]
+        label = names.get(key, key) if key else "(overall)"
+        print(f"{label:<32} {int(d.count):>8} {d.quantile(0.1):>7.2f} {d.quantile(0.5):>7.2f} {d.quantile(0.9):>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-cohort score sketches for percentile ranks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="recompute every sketch from the submissions table")
+    show = sub.add_parser("show", help="print count and percentiles per subject (merged over matching cohorts)")
+    show.add_argument("--course")
+    show.add_argument("--semester")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+    {"rebuild": cmd_rebuild, "show": cmd_show}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Subject catalog: one id per subject across spellings (migration 0006).
+
+Submissions keep the subject names as typed; the per-subject facts behind
+/analytics/cube and /analytics/trends store the catalog id that
+resolve_subject() assigns when a submission is inserted, adding a subject
+the first time a spelling is seen.  Spellings are folded by normalize()
+(the SQL subject_key()): case, spaces and punctuation do not matter, so
+"MATHS" and "maths." are the same key.  Different words for one subject
+("Maths" and "Mathematics") need an alias, added with this script; the
+facts of affected submissions are re-derived and the trend views refreshed.
+/analytics groups its subject averages by the same catalog.
+
+Usage:
+    python subject_catalog.py list
+    python subject_catalog.py alias "Maths" Mathematics   # the spelling now means Mathematics
+    python subject_catalog.py merge "Comp Sci" "Computer Science"
+    python subject_catalog.py rename "Computer Science" "Computer Science & Engineering"
+"""
+import re
+import os
+import sys
+import argparse
+
+import trends
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Keep in sync with subject_key() in migrations/0006_subject_catalog.sql.  Postgres (UTF-8 ctype of
+# glibc, e.g. C.UTF-8 or en_US.UTF-8) counts fewer characters as \s than Python: not the no-break
+# spaces, U+0085 or U+001C-U+001F, so the spaces are spelled out.
+_SEPARATORS = re.compile("[\t\n\v\f\r \u1680\u2000-\u2006\u2008-\u200a\u2028\u2029\u205f\u3000.,;:_/()'\"-]+")
+
+BUMP_VERSION_SQL = "UPDATE data_versions SET version = version + 1, updated_at = clock_timestamp() WHERE name = 'submissions';"
+FACTS_COLUMNS = "submission_id, ordinal, academic_year, university, course, semester, subject_id, marks, max_marks"
+
+
+def _lower(name):
+    """lower() one character at a time, as Postgres does: no final sigma, and U+0130 becomes a plain i."""
+    if name.isascii():
+        return name.lower()
+    return "".join(ch.lower()[0] for ch in name)
+
+
+def normalize(name):
+    """Catalog key of a subject name: lower case, runs of spaces/punctuation as one space."""
+    return _SEPARATORS.sub(" ", _lower(str(name or ""))).strip(" ")
+
+
+def load(cur):
+    """{key: (subject id, name)} for every known spelling; {} before migration 0006."""
+    cur.execute("SELECT to_regclass('subject_aliases') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return {}
+    cur.execute("SELECT a.key, s.id, s.name FROM subject_aliases AS a JOIN subjects AS s ON s.id = a.subject_id;")
+    return {key: (sid, name) for key, sid, name in cur.fetchall()}
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def _subject(cur, name):
+    cur.execute("SELECT s.id, s.name FROM subject_aliases AS a JOIN subjects AS s ON s.id = a.subject_id WHERE a.key = %s;",
+                (normalize(name),))
+    row = cur.fetchone()
+    if row is None:
+        raise SystemExit(f"Unknown subject: {name}")
+    return row
+
+
+def _rederive(cur, subject_id):
+    """Recompute the facts of every submission that has a `subject_id` entry, under the current aliases."""
+    cur.execute("SELECT array_agg(DISTINCT submission_id) FROM submission_subject_facts WHERE subject_id = %s;", (subject_id,))
+    ids = cur.fetchone()[0] or []
+    if ids:
+        cur.execute("DELETE FROM submission_subject_facts WHERE submission_id = ANY(%s);", (ids,))
+        cur.execute(
+            f"INSERT INTO submission_subject_facts ({FACTS_COLUMNS}) "
+            "SELECT f.* FROM submissions AS sub CROSS JOIN LATERAL subject_facts(sub.id, sub.academic_year, sub.data) AS f "
+            "WHERE sub.id = ANY(%s);", (ids,))
+    return len(ids)
+
+
+def _finish(conn, message):
+    cur = conn.cursor()
+    cur.execute(BUMP_VERSION_SQL)  # drops cached analytics and ETags
+    conn.commit()
+    cur.close()
+    print(message)
+    trends.refresh_after_import(conn)
+    conn.close()
+
+
+def cmd_list(args):
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT s.id, s.name, (SELECT string_agg(a.key, ', ' ORDER BY a.key) FROM subject_aliases AS a WHERE a.subject_id = s.id), "
+        "(SELECT count(*) FROM submission_subject_facts AS f WHERE f.subject_id = s.id) "
+        "FROM subjects AS s ORDER BY 4 DESC, s.name;")
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    print(f"{'id':>5} {'entries':>9}  {'name':<32} spellings")
+    for sid, name, keys, entries in rows:
+        print(f"{sid:>5} {entries:>9}  {name:<32} {keys or ''}")
+
+
+def cmd_alias(args):
+    conn = _connect()
+    cur = conn.cursor()
+    target, target_name = _subject(cur, args.subject)
+    key = normalize(args.spelling)
+    if not key:
+        raise SystemExit("The spelling is empty once normalized")
+    cur.execute("SELECT subject_id FROM subject_aliases WHERE key = %s FOR UPDATE;", (key,))
+    row = cur.fetchone()
+    old = row[0] if row else None
+    if old == target:
+        raise SystemExit(f"'{key}' already means {target_name}")
+    cur.execute("INSERT INTO subject_aliases (key, subject_id) VALUES (%s, %s) "
+                "ON CONFLICT (key) DO UPDATE SET subject_id = EXCLUDED.subject_id;", (key, target))
+    moved = 0
+    note = ""
+    if old is not None:
+        cur.execute("SELECT count(*) FROM subject_aliases WHERE subject_id = %s;", (old,))
+        if cur.fetchone()[0]:
+            # The old subject keeps other spellings, so only its entries spelled `key` move
+            moved = _rederive(cur, old)
+            note = "; run `python sketches.py rebuild` to move their score sketches" if moved else ""
+        else:
+            import sketches
+
+            cur.execute("UPDATE submission_subject_facts SET subject_id = %s WHERE subject_id = %s;", (target, old))
+            moved = cur.rowcount
+            sketches.merge_subject(cur, old, target)
+            cur.execute("DELETE FROM subjects WHERE id = %s;", (old,))
+    cur.close()
+    _finish(conn, f"'{key}' now means {target_name}" + (" (subject facts updated)" if moved else "") + note)
+
+
+def cmd_merge(args):
+    import sketches
+
+    conn = _connect()
+    cur = conn.cursor()
+    source, source_name = _subject(cur, args.source)
+    target, target_name = _subject(cur, args.target)
+    if source == target:
+        raise SystemExit(f"{args.source} and {args.target} are already the same subject")
+    cur.execute("UPDATE subject_aliases SET subject_id = %s WHERE subject_id = %s;", (target, source))
+    cur.execute("UPDATE submission_subject_facts SET subject_id = %s WHERE subject_id = %s;", (target, source))
+    entries = cur.rowcount
+    sketches.merge_subject(cur, source, target)
+    cur.execute("DELETE FROM subjects WHERE id = %s;", (source,))
+    cur.close()
+    _finish(conn, f"Merged {source_name} into {target_name} ({entries} entries)")
+
+
+def cmd_rename(args):
+    conn = _connect()
+    cur = conn.cursor()
+    sid, old_name = _subject(cur, args.subject)
+    name = re.sub(r"\s+", " ", args.name.strip())
+    key = normalize(name)
+    if not key:
+        raise SystemExit("The new name is empty once normalized")
+    cur.execute("SELECT subject_id FROM subject_aliases WHERE key = %s;", (key,))
+    row = cur.fetchone()
+    if row and row[0] != sid:
+        raise SystemExit(f"'{name}' already names another subject; use merge")
+    cur.execute("UPDATE subjects SET name = %s WHERE id = %s;", (name, sid))
+    cur.execute("INSERT INTO subject_aliases (key, subject_id) VALUES (%s, %s) ON CONFLICT (key) DO NOTHING;", (key, sid))
+    cur.close()
+    _finish(conn, f"Renamed {old_name} to {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subject catalog: ids, names and spellings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="subjects with their spellings and entry counts")
+    alias = sub.add_parser("alias", help="make a spelling mean an existing subject")
+    alias.add_argument("spelling")
+    alias.add_argument("subject")
+    merge = sub.add_parser("merge", help="fold one subject, with all its spellings, into another")
+    merge.add_argument("source")
+    merge.add_argument("target")
+    rename = sub.add_parser("rename", help="change a subject's display name (its old spellings keep working)")
+    rename.add_argument("subject")
+    rename.add_argument("name")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+    {"list": cmd_list, "alias": cmd_alias, "merge": cmd_merge, "rename": cmd_rename}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import pytest
+
+import cube
+
+
+def test_parse_defaults():
+    dims, measures, sets, filters = cube.parse({"dimensions": "courseName, semester,courseName"})
+    assert dims == ["courseName", "semester"]
+    assert measures == list(cube.DEFAULT_MEASURES)
+    assert sets is None
+    assert filters == {}
+
+
+def test_parse_filters_and_totals():
+    dims, measures, sets, filters = cube.parse({"dimensions": "subject", "measures": "students,max",
+                                                "totals": " Rollup ", "course": " BCA ", "semester": ""})
+    assert measures == ["students", "max"]
+    assert sets == "rollup"
+    assert filters == {"course": "BCA"}
+
+
+def test_parse_grouping_sets_add_their_dimensions():
+    dims, _measures, sets, _filters = cube.parse({"dimensions": "courseName", "sets": "courseName,semester;courseName;"})
+    assert sets == [["courseName", "semester"], ["courseName"], []]
+    assert dims == ["courseName", "semester"]
+
+
+@pytest.mark.parametrize("args, message", [
+    ({"dimensions": "course"}, "unknown dimension: course"),
+    ({"measures": "avg,median"}, "unknown measure: median"),
+    ({"totals": "all"}, "totals must be one of"),
+    ({"dimensions": "semester", "sets": "courseName"}, "not in any grouping set: semester"),
+    ({"sets": "courseName;bogus"}, "unknown dimension: bogus"),
+])
+def test_parse_rejects(args, message):
+    with pytest.raises(cube.CubeError, match=message):
+        cube.parse(args)
+
+
+def test_build_plain_group_by():
+    sql, params = cube.build(["courseName", "subject"], ["avg", "count"], None,
+                             {"course": "BCA", "subject": "Maths"}, 100)
+    assert sql.startswith("SELECT course, subjects.name, GROUPING(course, subjects.name), avg(score), count(*) ")
+    assert f"FROM {cube.FROM_SQL} " in sql
+    assert "WHERE lower(course) = lower(%s) AND subject_id = subject_lookup(%s)" in sql
+    assert "GROUP BY course, subjects.name ORDER BY 1, 2, 3 LIMIT 101;" in sql
+    assert params == ["BCA", "Maths"]
+
+
+def test_build_totals_and_sets():
+    assert "GROUP BY CUBE(course, semester)" in cube.build(["courseName", "semester"], ["count"], "cube", {}, 10)[0]
+    assert "GROUP BY ROLLUP(course)" in cube.build(["courseName"], ["count"], "rollup", {}, 10)[0]
+    sql, _ = cube.build(["courseName", "semester"], ["count"], [["courseName", "semester"], ["courseName"], []], {}, 10)
+    assert "GROUP BY GROUPING SETS ((course, semester), (course), ())" in sql
+
+
+def test_build_without_dimensions_is_one_row():
+    sql, params = cube.build([], ["count"], "cube", {}, 5)
+    assert sql.startswith("SELECT 0, count(*) ")
+    assert "GROUP BY" not in sql and "ORDER BY" not in sql and "WHERE" not in sql
+    assert params == []
+
+
+def test_build_students_measure():
+    per_submission = "count(*) FILTER (WHERE ordinal = 1)"
+    assert per_submission in cube.build(["courseName"], ["students"], None, {}, 10)[0]
+    assert "CASE WHEN GROUPING(subjects.name) = 0 THEN count(*) ELSE" in cube.build(["subject"], ["students"], "rollup", {}, 10)[0]
+    sql = cube.build(["courseName"], ["students"], None, {"subject": "Maths"}, 10)[0]
+    assert per_submission not in sql and ", count(*) FROM" in sql
+
+
+def test_build_only_known_names_reach_the_sql():
+    with pytest.raises(KeyError):
+        cube.build(["courseName; DROP TABLE submissions"], ["count"], None, {}, 10)
+    with pytest.raises(KeyError):
+        cube.build([], ["count"], None, {"1=1 OR course": "x"}, 10)
+
+
+def test_shape_marks_rolled_up_dimensions_and_truncation():
+    rows = [
+        ("BCA", "1", 0, 61.23456, 10, 4),
+        ("BCA", None, 1, 60.0, 20, 8),
+        (None, None, 3, None, 30, 12),
+        ("BSc", "1", 0, 70.0, 1, 1),
+    ]
+    out = cube.shape(rows, ["courseName", "semester"], ["avg", "count", "students"], 3)
+    assert out["truncated"] is True
+    assert [r["rolledUp"] for r in out["rows"]] == [[], ["semester"], ["courseName", "semester"]]
+    assert out["rows"][0] == {"courseName": "BCA", "semester": "1", "rolledUp": [], "avg": 61.2346, "count": 10, "students": 4}
+    assert out["rows"][2]["avg"] is None
+    assert cube.shape(rows[:1], ["courseName", "semester"], ["avg"], 3)["truncated"] is False
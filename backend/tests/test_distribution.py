@@ -0,0 +1,120 @@
+import struct
+
+import numpy as np
+import pytest
+
+import distribution
+import grading
+
+SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _copy(rows, header_extension=b""):
+    """A binary COPY stream of (id int8, subject int4, marks float8, max float8[, rule int4]) rows; None is NULL."""
+    formats = ["q", "i", "d", "d", "i"]
+    out = [SIGNATURE, struct.pack(">ii", 0, len(header_extension)), header_extension]
+    for row in rows:
+        out.append(struct.pack(">h", len(row)))
+        for fmt, value in zip(formats, row):
+            if value is None:
+                out.append(struct.pack(">i", -1))
+            else:
+                out.append(struct.pack(">i", struct.calcsize(fmt)) + struct.pack(">" + fmt, value))
+    out.append(struct.pack(">h", -1))
+    return b"".join(out)
+
+
+def test_decode_copy_rows():
+    rows = [(1, 2, 55.5, 100.0), (1, 0, 30.0, 50.0), (9_000_000_000, 1, 0.0, 100.0)]
+    ids, subjects, marks, maxm = distribution.decode_copy(_copy(rows, header_extension=b"\x00" * 4))
+    assert ids.tolist() == [1, 1, 9_000_000_000]
+    assert subjects.tolist() == [2, 0, 1]
+    assert marks.tolist() == [55.5, 30.0, 0.0]
+    assert maxm.tolist() == [100.0, 50.0, 100.0]
+    assert ids.dtype == np.int64 and marks.dtype.isnative
+
+
+def test_decode_copy_with_rule_index():
+    columns = distribution.decode_copy(_copy([(4, 1, 40.0, 100.0, 2)]), distribution.DISTRIBUTION_COLUMNS)
+    assert [c.tolist() for c in columns] == [[4], [1], [40.0], [100.0], [2]]
+
+
+def test_decode_copy_empty():
+    ids, subjects, marks, maxm = distribution.decode_copy(_copy([]))
+    assert ids.size == subjects.size == marks.size == maxm.size == 0
+
+
+@pytest.mark.parametrize("rows", [
+    [(1, 1, None, 100.0)],                          # a NULL shortens the row
+    [(1, 1, 50.0, 100.0), (2, None, 50.0, 100.0)],
+    [(1, 1, 50.0, 100.0, 0)],                       # one column too many
+])
+def test_decode_copy_rejects_other_layouts(rows):
+    with pytest.raises(ValueError, match="row layout"):
+        distribution.decode_copy(_copy(rows))
+
+
+def test_decode_copy_rejects_other_streams():
+    with pytest.raises(ValueError, match="not a binary COPY"):
+        distribution.decode_copy(b"1\t2\t3\t4\n")
+
+
+RULEBOOK = grading.RuleBook([
+    (1, "", 1, grading.DEFAULT_RULES),
+    (2, "state university", 3, {"passPercent": 35, "aggregatePassPercent": 40,
+                                "bands": [{"name": "First Division", "min": 60}, {"name": "Second Division", "min": 45},
+                                          {"name": "Pass", "min": 0}]}),
+])
+
+
+def _payloads(seed, count):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for sid in range(1, count + 1):
+        subjects = [{"name": name, "marksObtained": int(rng.integers(0, 101)), "maxMarks": 100}
+                    for name in ("Maths", "Physics", "English") if rng.random() < 0.8]
+        subjects = subjects or [{"name": "Maths", "marksObtained": "41"}]
+        university = "State University" if rng.random() < 0.5 else "Elsewhere"
+        rows.append((sid, {"student": {"universityName": university}, "subjects": subjects}, None))
+    return rows
+
+
+def test_summarize_matches_grade():
+    rows = _payloads(0, 400)
+    out = distribution.summarize(*distribution.from_rows(rows, 10, RULEBOOK))
+    statuses = [grading.grade(data, RULEBOOK.lookup(data["student"]["universityName"])[2])["status"] for _, data, _ in rows]
+    assert out["count"] == len(rows)
+    assert out["overall"]["bands"] == {name: statuses.count(name) for name in out["overall"]["bands"]}
+    assert sum(out["overall"]["bands"].values()) == len(rows)
+    failed = sum(s == "Fail" for s in statuses)
+    assert out["overall"]["passRate"] == pytest.approx((len(rows) - failed) / len(rows) * 100, abs=1e-4)
+
+
+def test_subject_pass_rate_uses_each_university_pass_mark():
+    rows = [
+        (1, {"student": {"universityName": "State University"}, "subjects": [{"name": "Maths", "marksObtained": 36}]}, None),
+        (2, {"student": {"universityName": "Elsewhere"}, "subjects": [{"name": "Maths", "marksObtained": 36}]}, None),
+    ]
+    maths = distribution.summarize(*distribution.from_rows(rows, 10, RULEBOOK))["subjects"]["Maths"]
+    assert maths["passRate"] == 50.0
+    assert maths["bands"]["Pass"] == 1 and maths["bands"]["Fail"] == 1
+
+
+def test_summarize_subject_statistics():
+    rows = [(i, {"subjects": [{"name": "Maths", "marksObtained": m, "maxMarks": 50},
+                              {"name": "Art", "marksObtained": 2 * m}]}, None)
+            for i, m in enumerate([10, 20, 30, 40, 50])]
+    out = distribution.summarize(*distribution.from_rows(rows, 10, RULEBOOK), percentiles=(50,))
+    maths = out["subjects"]["Maths"]
+    assert (maths["count"], maths["min"], maths["max"], maths["mean"]) == (5, 20.0, 100.0, 60.0)
+    assert maths["percentiles"] == {"p50": 60.0}
+    assert maths["std"] == pytest.approx(np.std([20, 40, 60, 80, 100]), abs=1e-4)
+    assert out["correlation"]["matrix"] == [[1.0, 1.0], [1.0, 1.0]]
+
+
+def test_summarize_without_entries():
+    out = distribution.summarize(*distribution.from_rows([], 10, RULEBOOK))
+    assert out["count"] == 0
+    assert out["overall"]["mean"] is None and out["overall"]["passRate"] == 0
+    assert set(out["overall"]["bands"].values()) == {0}
+    assert out["subjects"] == {} and out["correlation"] == {"subjects": [], "matrix": []}
@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+import pytest
+
+import grading
+
+RULE_SETS = [
+    grading.DEFAULT_RULES,
+    {"passPercent": 35, "aggregatePassPercent": 40,
+     "bands": [{"name": "First Division", "min": 60}, {"name": "Second Division", "min": 45}, {"name": "Pass", "min": 0}],
+     "gradePoints": [{"min": 85, "points": 10}, {"min": 70, "points": 8}, {"min": 35, "points": 5}]},
+    {"passPercent": 0, "failLabel": "Not Passed", "bands": [{"name": "Pass", "min": 0}], "gradePoints": []},
+    {"passPercent": 50, "aggregatePassPercent": 55, "failPoints": 1,
+     "bands": [{"name": "Honours", "min": 80}, {"name": "Merit", "min": 65}, {"name": "Pass", "min": 55}]},
+]
+
+
+def _submissions(rng, count, rule_count):
+    """(docs, rule index per doc, flat ids, rule_index, marks, maxm) with whole marks, so every sum is exact."""
+    docs, rules, ids, rule_index, marks, maxm = [], [], [], [], [], []
+    for sid in range(1, count + 1):
+        rule = int(rng.integers(rule_count))
+        subjects = []
+        for _ in range(int(rng.integers(1, 7))):
+            top = int(rng.choice([50, 75, 100]))
+            got = int(rng.integers(0, top + 1))
+            subjects.append({"name": "S", "marksObtained": str(got), "maxMarks": top})
+            ids.append(sid * 3)  # ids need not be dense
+            rule_index.append(rule)
+            marks.append(got)
+            maxm.append(top)
+        docs.append({"subjects": subjects})
+        rules.append(rule)
+    return (docs, rules, np.array(ids, dtype=np.int64), np.array(rule_index, dtype=np.int32),
+            np.array(marks, dtype=np.float64), np.array(maxm, dtype=np.float64))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_grade_arrays_matches_grade(seed):
+    rulesets = [grading.validate(r) for r in RULE_SETS]
+    docs, rules, ids, rule_index, marks, maxm = _submissions(np.random.default_rng(seed), 500, len(rulesets))
+    # Entries of one submission are contiguous in the facts but need not be; shuffle them
+    order = np.random.default_rng(seed).permutation(ids.size)
+    out = grading.grade_arrays(ids[order], rule_index[order], marks[order], maxm[order], rulesets)
+    student_ids, rule, obtained, total, percentage, status, cgpa, failed = out
+
+    assert student_ids.tolist() == [3 * (i + 1) for i in range(len(docs))]
+    for i, (doc, r) in enumerate(zip(docs, rules)):
+        expected = grading.grade(doc, rulesets[r])
+        assert rule[i] == r
+        assert obtained[i] == expected["totalObtained"]
+        assert total[i] == expected["totalMax"]
+        assert percentage[i] == pytest.approx(expected["percentage"])
+        assert status[i] == expected["status"]
+        assert failed[i] == expected["failedSubjects"]
+        if expected["cgpa"] is None:
+            assert math.isnan(cgpa[i])
+        else:
+            assert cgpa[i] == pytest.approx(expected["cgpa"])
+
+
+def test_grade_pass_marks_are_inclusive():
+    rules = grading.validate({"passPercent": 40, "aggregatePassPercent": 50})
+    doc = {"subjects": [{"marksObtained": 40, "maxMarks": 100}, {"marksObtained": "60"}]}
+    assert grading.grade(doc, rules)["status"] == "Second Class"
+    doc["subjects"][0]["marksObtained"] = 39.5
+    assert grading.grade(doc, rules)["status"] == "Fail"
+    assert grading.grade({"subjects": []}, rules) is None
+
+
+def test_validate_fills_defaults_and_sorts():
+    rules = grading.validate({"bands": [{"name": " Pass ", "min": 0}, {"name": "Top", "min": 90}]})
+    assert rules["passPercent"] == grading.DEFAULT_RULES["passPercent"]
+    assert [b["name"] for b in rules["bands"]] == ["Top", "Pass"]
+    assert rules["gradePoints"][0]["min"] == 90
+
+
+@pytest.mark.parametrize("rules, message", [
+    ([], "JSON object"),
+    ({"passMark": 40}, "unknown keys"),
+    ({"passPercent": 101}, "passPercent"),
+    ({"passPercent": True}, "passPercent"),
+    ({"aggregatePassPercent": "40"}, "aggregatePassPercent"),
+    ({"failLabel": "  "}, "band names"),
+    ({"bands": []}, "bands must not be empty"),
+    ({"bands": {"Pass": 0}}, "bands must be a list"),
+    ({"bands": [{"name": "Pass"}]}, "exactly 'min' and 'name'"),
+    ({"bands": [{"name": "Pass", "min": 0, "extra": 1}]}, "exactly 'min' and 'name'"),
+    ({"bands": [{"name": "A", "min": 50}, {"name": "B", "min": 50}]}, "every min must be different"),
+    ({"bands": [{"name": "A", "min": -1}]}, "min must be a number"),
+    ({"gradePoints": [{"min": 50, "points": "ten"}]}, "grade points must be numbers"),
+    ({"failPoints": float("nan")}, "grade points must be numbers"),
+])
+def test_validate_rejects(rules, message):
+    with pytest.raises(grading.GradingError, match=message):
+        grading.validate(rules)
+
+
+def test_rulebook_lookup_falls_back_to_default():
+    book = grading.RuleBook([(5, "state university", 2, {"passPercent": 35})])
+    assert book.lookup(" State University ")[:2] == (5, 2)
+    assert book.lookup("Elsewhere") == (None, 0, grading.validate(grading.DEFAULT_RULES))
+    keys, rule_ids, rulesets = grading.ruleset_index(book)
+    assert keys == ["state university"]
+    assert rule_ids == [None, 5]
+    assert rulesets[1]["passPercent"] == 35
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.row
+
+
+def test_publish_inserts_and_bumps_version():
+    cur = FakeCursor((9, 3))
+    assert grading.publish(cur, "State University", {"passPercent": 35}) == (9, 3)
+    (insert, params), (bump, _) = cur.executed
+    assert insert.startswith("INSERT INTO grading_rules")
+    assert params[0] == params[2] == "state university"
+    assert bump == grading.BUMP_VERSION_SQL
+
+
+def test_publish_validates_before_writing():
+    cur = FakeCursor(None)
+    with pytest.raises(grading.GradingError):
+        grading.publish(cur, None, {"passPercent": 200})
+    assert cur.executed == []
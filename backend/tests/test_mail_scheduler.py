@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+import mail_scheduler
+from mail_scheduler import DailyUsage, Message, Scheduler, Transport
+
+
+class FakeTransport:
+    """Transport stand-in: `outcome(message)` gives (ok, detail); records what it was asked to send."""
+
+    def __init__(self, name, outcome=lambda message: (True, "sent")):
+        self.name = name
+        self.outcome = outcome
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self.sent.append(message.to_email)
+        return self.outcome(message)
+
+    def transport(self):
+        return Transport(self.name, self.send)
+
+
+def _messages(n):
+    return [Message(b"%PDF", f"r{i}.pdf", f"s{i}@example.com", "Result", "<p>r</p>", "r") for i in range(n)]
+
+
+def _scheduler(*fakes, usage=None, **kwargs):
+    return Scheduler({f.name: f.transport() for f in fakes}, usage=usage or DailyUsage(),
+                     providers=[f.name for f in fakes], **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def unlimited(monkeypatch):
+    for name in ("a", "b"):
+        for key in ("PER_SECOND", "BURST", "DAILY"):
+            monkeypatch.delenv(f"EMAIL_{name.upper()}_{key}", raising=False)
+
+
+def test_failed_messages_spill_over_to_the_next_provider():
+    a = FakeTransport("a", lambda m: (False, "a-error: 500") if m.to_email.startswith("s1") else (True, "a ok"))
+    b = FakeTransport("b", lambda m: (True, "b ok"))
+    results = _scheduler(a, b).send_many(_messages(4))
+    assert all(ok for ok, _ in results)
+    assert results[1] == (True, "b ok")
+    assert "s1@example.com" in a.sent and "s1@example.com" in b.sent
+    assert sorted(a.sent + b.sent).count("s1@example.com") == 2
+
+
+def test_send_spills_over_when_rate_limited(monkeypatch):
+    monkeypatch.setenv("EMAIL_A_PER_SECOND", "0.001")
+    monkeypatch.setenv("EMAIL_A_BURST", "1")
+    a, b = FakeTransport("a"), FakeTransport("b", lambda m: (True, "b ok"))
+    scheduler = _scheduler(a, b, max_wait=0)
+    assert scheduler.send(_messages(1)[0]) == (True, "sent")
+    assert scheduler.send(_messages(1)[0]) == (True, "b ok")
+    assert len(a.sent) == 1
+
+
+def test_daily_quota_leaves_the_rest_to_other_providers(monkeypatch):
+    monkeypatch.setenv("EMAIL_A_DAILY", "3")
+    usage = DailyUsage()
+    a, b = FakeTransport("a"), FakeTransport("b")
+    results = _scheduler(a, b, usage=usage, batch_size=2).send_many(_messages(10))
+    assert all(ok for ok, _ in results)
+    assert len(a.sent) <= 3 and len(a.sent) + len(b.sent) == 10
+    assert usage.used("a") == len(a.sent)
+
+
+def test_unsent_reservations_are_refunded(monkeypatch):
+    monkeypatch.setenv("EMAIL_A_DAILY", "100")
+    monkeypatch.setattr(mail_scheduler, "EMAIL_MAX_CONSECUTIVE_FAILURES", 2)
+    usage = DailyUsage()
+    a = FakeTransport("a", lambda m: (False, "a-error"))
+    results = _scheduler(a, usage=usage).send_many(_messages(10))
+    assert not any(ok for ok, _ in results)
+    # The whole batch was reserved; only the two attempted sends stay counted
+    assert len(a.sent) == 2
+    assert usage.used("a") == 2
+
+
+def test_unconfigured_provider_hands_back_its_batch(monkeypatch):
+    monkeypatch.setenv("EMAIL_A_DAILY", "100")
+    usage = DailyUsage()
+    a = FakeTransport("a", lambda m: (False, "no-credentials"))
+    b = FakeTransport("b")
+    results = _scheduler(a, b, usage=usage).send_many(_messages(5))
+    assert all(ok for ok, _ in results)
+    assert usage.used("a") == 0
+
+
+def test_a_failing_provider_is_retired(monkeypatch):
+    monkeypatch.setattr(mail_scheduler, "EMAIL_MAX_CONSECUTIVE_FAILURES", 3)
+    a = FakeTransport("a", lambda m: (False, "a-error"))
+    results = _scheduler(a).send_many(_messages(10))
+    assert len(a.sent) == 3
+    assert [ok for ok, _ in results] == [False] * 10
+    assert all(detail.startswith("All transports failed") for _, detail in results)
+    assert any("a: a-error" in detail for _, detail in results)
+
+
+def test_a_transport_exception_counts_as_a_failure():
+    def broken(message):
+        raise ConnectionError("reset")
+
+    a, b = FakeTransport("a", broken), FakeTransport("b")
+    results = _scheduler(a, b).send_many(_messages(3))
+    assert all(ok for ok, _ in results)
+
+
+@pytest.mark.parametrize("attempts", [1, 3, 4])
+def test_messages_are_given_up_after_max_attempts(monkeypatch, attempts):
+    monkeypatch.setattr(mail_scheduler, "EMAIL_MAX_ATTEMPTS", attempts)
+    monkeypatch.setattr(mail_scheduler, "EMAIL_MAX_CONSECUTIVE_FAILURES", 1000)
+    a = FakeTransport("a", lambda m: (False, "a-error"))
+    b = FakeTransport("b", lambda m: (False, "b-error"))
+    done = []
+    results = _scheduler(a, b, batch_size=1).send_many(_messages(4), progress=lambda d, total: done.append((d, total)))
+    assert [ok for ok, _ in results] == [False] * 4
+    # A message is tried by every provider before any provider retries it
+    assert len(a.sent) + len(b.sent) == 4 * max(attempts, 2)
+    for _, detail in results:
+        assert detail.count("-error") == max(attempts, 2)
+    assert done[-1] == (4, 4) and len(done) == 4
@@ -0,0 +1,55 @@
+import pytest
+
+import migrate
+
+
+def test_splits_on_top_level_semicolons():
+    sql = "CREATE TABLE a (id INT);\nINSERT INTO a VALUES (1);  \n;\n  SELECT 1"
+    assert migrate.split_statements(sql) == ["CREATE TABLE a (id INT)", "INSERT INTO a VALUES (1)", "SELECT 1"]
+
+
+def test_empty_and_comment_only_input():
+    assert migrate.split_statements("") == []
+    assert migrate.split_statements("-- nothing here;\n;\n-- migrate:no-transaction") == []
+
+
+def test_line_comments_are_dropped():
+    sql = "-- header; with a semicolon\nSELECT 1; -- trailing; comment\nSELECT 2 -- no newline at the end;"
+    assert migrate.split_statements(sql) == ["SELECT 1", "SELECT 2"]
+
+
+@pytest.mark.parametrize("literal", [
+    "'a;b'",
+    "'it''s; fine'",
+    "'-- not a comment'",
+    '"odd;name"',
+])
+def test_quoted_text_is_kept_whole(literal):
+    assert migrate.split_statements(f"SELECT {literal}; SELECT 2;") == [f"SELECT {literal}", "SELECT 2"]
+
+
+def test_dollar_quoted_bodies_are_kept_whole():
+    body = """CREATE FUNCTION f() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    -- a comment inside the body; kept
+    NEW.x := 'a;b';
+    RETURN NEW;
+END;
+$$"""
+    tagged = "DO $body$ BEGIN PERFORM 1; PERFORM $$nested; text$$; END $body$"
+    assert migrate.split_statements(f"{body};\n{tagged};\nSELECT 3;") == [body, tagged, "SELECT 3"]
+
+
+def test_positional_parameters_are_not_dollar_quotes():
+    sql = "PREPARE p AS SELECT $1 + $2; SELECT 2;"
+    assert migrate.split_statements(sql) == ["PREPARE p AS SELECT $1 + $2", "SELECT 2"]
+
+
+@pytest.mark.parametrize("migration", migrate.load_migrations(), ids=repr)
+def test_shipped_migrations_split_cleanly(migration):
+    statements = migrate.split_statements(migration.sql)
+    assert statements
+    for statement in statements:
+        # Every quote and dollar-quoted body that opens in a statement also closes in it
+        assert statement.count("$$") % 2 == 0
+        assert not statement.startswith("--")
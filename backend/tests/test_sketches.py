@@ -0,0 +1,88 @@
+import bisect
+import random
+
+import pytest
+
+from sketches import TDigest
+
+QUANTILES = [i / 200 for i in range(1, 200)]
+
+
+def _exact_rank(ordered, value):
+    """Mid-rank percentage, as TDigest.rank() approximates it."""
+    lo, hi = bisect.bisect_left(ordered, value), bisect.bisect_right(ordered, value)
+    return (lo + (hi - lo) / 2) / len(ordered) * 100
+
+
+def _digest(values, compression=100):
+    digest = TDigest(compression)
+    for v in values:
+        digest.add(v)
+    return digest
+
+
+def _errors(digest, ordered):
+    """(quantile, |approximate - exact| rank in percentage points) at values across the distribution."""
+    out = []
+    for q in QUANTILES:
+        value = ordered[int(q * len(ordered))]
+        out.append((q, abs(digest.rank(value) - _exact_rank(ordered, value))))
+    return out
+
+
+DISTRIBUTIONS = {
+    "uniform": lambda r: r.uniform(0, 100),
+    "normal": lambda r: r.gauss(60, 15),
+    "skewed": lambda r: r.expovariate(1 / 20),
+}
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("distribution", DISTRIBUTIONS)
+def test_rank_error_is_a_fraction_of_a_percent(distribution, seed):
+    rng = random.Random(seed)
+    values = [DISTRIBUTIONS[distribution](rng) for _ in range(20000)]
+    digest = _digest(values)
+    errors = _errors(digest, sorted(values))
+    assert max(e for _, e in errors) < 0.5
+    # The k1 scale keeps small centroids at the ends: the tails are the most precise
+    assert max(e for q, e in errors if q < 0.02 or q > 0.98) < 0.1
+    assert len(digest.means) <= digest.compression
+
+
+def test_rank_with_ties():
+    # Whole marks out of 100: every value is a tie shared by ~1% of the students
+    rng = random.Random(3)
+    values = [min(100, max(0, round(rng.gauss(60, 15)))) for _ in range(20000)]
+    errors = _errors(_digest(values), sorted(values))
+    assert max(e for _, e in errors) < 1.0
+
+
+def test_merged_digests_keep_the_bound():
+    rng = random.Random(4)
+    values = [rng.gauss(60, 15) for _ in range(20000)]
+    parts = [_digest(values[i::4]) for i in range(4)]
+    merged = TDigest()
+    for part in parts:
+        merged.merge(part)
+    assert merged.count == len(values)
+    assert max(e for _, e in _errors(merged, sorted(values))) < 0.5
+
+
+def test_small_digests_are_exact():
+    digest = _digest([10, 20, 30, 40])
+    assert digest.rank(20) == 37.5
+    assert digest.rank(25) == 50.0
+    assert digest.rank(5) == 0.0
+    assert digest.rank(45) == 100.0
+    assert _digest([7, 7, 7]).rank(7) == 50.0
+    assert TDigest().rank(50) is None
+
+
+def test_rank_survives_serialization():
+    rng = random.Random(5)
+    digest = _digest([rng.uniform(0, 100) for _ in range(5000)])
+    restored = TDigest.from_bytes(digest.to_bytes())
+    assert (restored.min, restored.max, restored.count) == (digest.min, digest.max, digest.count)
+    for value in (0.5, 10, 50, 90, 99.5):
+        assert restored.rank(value) == digest.rank(value)
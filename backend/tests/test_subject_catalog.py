@@ -0,0 +1,76 @@
+import os
+import re
+
+import pytest
+
+import migrate
+import subject_catalog
+
+# (name, key) under subject_key() of migration 0006:
+# btrim(regexp_replace(lower(name), '[\s.,;:_/()''"-]+', ' ', 'g')) in a UTF-8 database
+KEYS = [
+    ("Mathematics", "mathematics"),
+    ("  MATHS  ", "maths"),
+    ("Computer-Science", "computer science"),
+    ("Comp. Sci.", "comp sci"),
+    ("Physics\t(Hons)", "physics hons"),
+    ("A/B_C;D:E,F", "a b c d e f"),
+    ("O'Brien \"Lit\"", "o brien lit"),
+    ("Maths -- II", "maths ii"),
+    ("x\r\ny\vz\fw", "x y z w"),
+    ("Maths\u2003II\u3000", "maths ii"),  # Unicode spaces are separators
+    ("Maths\u00a0II", "maths\u00a0ii"),  # no-break spaces are not
+    ("Maths\u202fII\u2007", "maths\u202fii\u2007"),
+    ("Maths\x1cII\x85", "maths\x1cii\x85"),
+    ("Maths\u2013II", "maths\u2013ii"),  # an en dash is not a hyphen
+    ("ÉTUDES Françaises", "études françaises"),
+    ("İstanbul Studies", "istanbul studies"),    # one character, as Postgres lowers it
+    ("ΜΑΘΗΜΑΤΙΚΑ ΣΑΣ", "μαθηματικα σασ"),        # no final sigma
+    ("Straße", "straße"),
+    ("ﬁnance", "ﬁnance"),
+    ("  ", ""),
+    ("", ""),
+    (None, ""),
+]
+
+
+@pytest.mark.parametrize("name, key", KEYS)
+def test_normalize(name, key):
+    assert subject_catalog.normalize(name) == key
+
+
+def test_separators_match_the_migration():
+    # A change to subject_key() needs the same change in normalize() (and this test)
+    sql = next(m.sql for m in migrate.load_migrations() if m.name == "subject_catalog")
+    assert "btrim(regexp_replace(lower(p_name), '[\\s.,;:_/()''\"-]+', ' ', 'g'))" in sql
+
+
+def _database():
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    try:
+        conn = psycopg2.connect(os.getenv("DATABASE_URL"), connect_timeout=2)
+    except psycopg2.Error as e:
+        pytest.skip(f"database unavailable: {e}")
+    cur = conn.cursor()
+    cur.execute("SELECT to_regproc('subject_key') IS NOT NULL, pg_encoding_to_char(encoding), datctype "
+                "FROM pg_database WHERE datname = current_database();")
+    has_function, encoding, ctype = cur.fetchone()
+    if not has_function or encoding != "UTF8" or not re.search(r"utf-?8", ctype, re.IGNORECASE):
+        conn.close()
+        pytest.skip("needs migration 0006 in a UTF-8 database")
+    return conn
+
+
+def test_normalize_matches_subject_key_in_the_database():
+    conn = _database()
+    try:
+        names = [name for name, _key in KEYS if name is not None]
+        names += [f"a{chr(cp)}B{chr(cp)}" for cp in range(1, 0x3100) if not 0xD800 <= cp < 0xE000]
+        cur = conn.cursor()
+        cur.execute("SELECT subject_key(n) FROM unnest(%s::text[]) AS n;", (names,))
+        differ = [(n, k) for n, (k,) in zip(names, cur.fetchall()) if k != subject_catalog.normalize(n)]
+        assert differ == []
+    finally:
+        conn.close()
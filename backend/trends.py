@@ -0,0 +1,238 @@
+"""Year-over-year trends from materialized views, for /analytics/trends.
+
+subject_year_stats (per course, semester, catalog subject id and academic
+year) and cohort_year_stats (per course, semester and academic year, over each
+student's overall percentage) are aggregated from submission_subject_facts by
+migrations 0005/0006, so a multi-year trend chart reads a few dozen
+precomputed rows instead of every submission.  Since migration 0010 they read
+the subject_results view, whose pass/fail follows the current grading rule
+set of each university; `grading.py publish` refreshes them.
+
+The views are refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY, which
+keeps them readable meanwhile.  The submissions write counter is recorded
+under data_versions 'trends' at each refresh, so a refresh is skipped while
+nothing changed and answers can tell how stale they are.  Refresh from cron
+or after bulk imports (partitions.py archive/restore and benchmark.py
+generate do it themselves), or set TRENDS_REFRESH_INTERVAL to let the app
+refresh in a background thread.
+
+Usage:
+    python trends.py refresh            # only when submissions changed since the last refresh
+    python trends.py refresh --force
+    python trends.py status
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Seconds between staleness checks in the app's background thread; 0 disables it
+TRENDS_REFRESH_INTERVAL = float(os.getenv("TRENDS_REFRESH_INTERVAL") or 0)
+
+VIEWS = ("subject_year_stats", "cohort_year_stats")
+ALL_SUBJECTS = "*"
+# pg_try_advisory_xact_lock key: one refresh at a time across processes
+_LOCK_KEY = 0x7472656E  # "tren"
+
+_STATE_SQL = ("SELECT t.version, t.updated_at, s.version, s.updated_at FROM data_versions AS t, data_versions AS s "
+              "WHERE t.name = 'trends' AND s.name = 'submissions';")
+
+
+def state(cur):
+    """(refreshed version, refreshed_at, submissions version, submissions updated_at), or None without the views."""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AND to_regclass(%s) IS NOT NULL;", VIEWS)
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute(_STATE_SQL)
+    return cur.fetchone()
+
+
+def refresh(conn, force=False):
+    """Refresh both views unless they are current; commits.  Returns True when refreshed,
+    False when current or another process is refreshing, None when the views do not exist.
+    """
+    cur = conn.cursor()
+    try:
+        current = state(cur)
+        if current is None:
+            conn.rollback()
+            return None
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return False
+        # Read after taking the lock; each REFRESH sees at least the writes counted here
+        cur.execute("SELECT version FROM data_versions WHERE name = 'submissions';")
+        version = cur.fetchone()[0]
+        cur.execute("SELECT version FROM data_versions WHERE name = 'trends';")
+        if not force and cur.fetchone()[0] == version:
+            conn.rollback()
+            return False
+        for view in VIEWS:
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+        cur.execute("UPDATE data_versions SET version = %s, updated_at = NOW() WHERE name = 'trends';", (version,))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def refresh_after_import(conn):
+    """For bulk-import scripts: refresh if the views exist, and report it."""
+    start = time.perf_counter()
+    if refresh(conn):
+        print(f"Refreshed {', '.join(VIEWS)} in {time.perf_counter() - start:.1f}s")
+
+
+def start_scheduler(connect, interval=TRENDS_REFRESH_INTERVAL):
+    """Refresh stale views every `interval` seconds in a daemon thread; `connect()` returns a connection."""
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                conn = connect()
+                try:
+                    refresh(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Trend view refresh failed: {e}", file=sys.stderr)
+
+    thread = threading.Thread(target=run, name="trends-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+def build(course=None, semester=None, subject=None, from_year=None, to_year=None):
+    """(sql, params, per_subject) for the trend rows; without `subject` the rows are overall percentages."""
+    per_subject = bool(subject)
+    where, params = ["academic_year <> ''"], []
+    if course:
+        where.append("lower(course) = lower(%s)")
+        params.append(course)
+    if semester:
+        where.append("semester = %s")
+        params.append(semester)
+    if per_subject and subject != ALL_SUBJECTS:
+        where.append("subject_id = subject_lookup(%s)")
+        params.append(subject)
+    if from_year:
+        where.append("academic_year >= %s")
+        params.append(from_year)
+    if to_year:
+        where.append("academic_year <= %s")
+        params.append(to_year)
+    if per_subject:
+        sql = ("SELECT course, semester, subjects.name, academic_year, entries, avg_score, stddev_score, min_score, "
+               "max_score, pass_rate FROM subject_year_stats LEFT JOIN subjects ON subjects.id = subject_id")
+        order = "course, semester, subjects.name, subject_id, academic_year"
+    else:
+        sql = ("SELECT course, semester, NULL, academic_year, students, avg_percentage, stddev_percentage, "
+               "min_percentage, max_percentage, pass_rate FROM cohort_year_stats")
+        order = "course, semester, academic_year"
+    return f"{sql} WHERE {' AND '.join(where)} ORDER BY {order};", params, per_subject
+
+
+def _round(value):
+    return None if value is None else round(float(value), 4)
+
+
+def shape(rows, per_subject):
+    """Group rows into one series per (course, semester[, subject]), points in year order.
+    `change` is the move in `avg` from the previous point of the series.
+    """
+    series = []
+    current = None
+    for course, semester, subject, year, count, avg, stddev, low, high, pass_rate in rows:
+        key = (course, semester, subject)
+        if current is None or current["key"] != key:
+            current = {"key": key, "points": []}
+            series.append(current)
+        points = current["points"]
+        previous = points[-1]["avg"] if points else None
+        avg = _round(avg)
+        points.append({
+            "academicYear": year,
+            "count": int(count),
+            "avg": avg,
+            "change": None if previous is None or avg is None else round(avg - previous, 4),
+            "stddev": _round(stddev),
+            "min": _round(low),
+            "max": _round(high),
+            "passRate": _round(pass_rate),
+        })
+    out = []
+    for s in series:
+        course, semester, subject = s["key"]
+        item = {"courseName": course or None, "semester": semester or None}
+        if per_subject:
+            item["subject"] = subject or None
+        item["points"] = s["points"]
+        out.append(item)
+    return out
+
+
+def _connect():
+    import psycopg2
+    return psycopg2.connect(DATABASE_URL)
+
+
+def cmd_refresh(args):
+    conn = _connect()
+    start = time.perf_counter()
+    done = refresh(conn, force=args.force)
+    conn.close()
+    if done is None:
+        raise SystemExit("Trend views not found (run `python migrate.py`)")
+    print(f"Refreshed {', '.join(VIEWS)} in {time.perf_counter() - start:.1f}s" if done
+          else "Trend views are current (or another refresh is running); nothing to do")
+
+
+def cmd_status(args):
+    conn = _connect()
+    cur = conn.cursor()
+    current = state(cur)
+    if current is None:
+        raise SystemExit("Trend views not found (run `python migrate.py`)")
+    for view in VIEWS:
+        cur.execute(f"SELECT count(*), pg_total_relation_size('{view}') FROM {view};")
+        rows, size = cur.fetchone()
+        print(f"{view:<20} {rows:>8} rows {size / 1024:>10.0f} KB")
+    cur.close()
+    conn.close()
+    refreshed, refreshed_at, version, changed_at = current
+    print(f"Refreshed at {refreshed_at.isoformat()} (submissions version {refreshed}, now {version})")
+    if refreshed != version:
+        print(f"Stale: submissions changed at {changed_at.isoformat()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialized views behind /analytics/trends")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ref = sub.add_parser("refresh", help="REFRESH MATERIALIZED VIEW CONCURRENTLY when submissions changed")
+    ref.add_argument("--force", action="store_true", help="refresh even when the views look current")
+    sub.add_parser("status", help="row counts, sizes and staleness of the views")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("No DATABASE_URL found in environment or .env")
+        sys.exit(1)
+    {"refresh": cmd_refresh, "status": cmd_status}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
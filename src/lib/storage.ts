@@ -23,16 +23,29 @@ export function saveResult(result: ResultData): void {
   localStorage.setItem(STORAGE_KEY, JSON.stringify(results));
 }
 
+async function idempotencyKey(resultId: string, body: string): Promise<string> {
+  try {
+    const digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(body));
+    const hex = Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, "0")).join("");
+    return `${resultId}:${hex.slice(0, 32)}`;
+  } catch {
+    return resultId;
+  }
+}
+
 export async function saveResultRemote(result: ResultData): Promise<{ ok: boolean; id?: string }>
 {
   try {
     const headers: Record<string,string> = { "Content-Type": "application/json" };
     const token = localStorage.getItem(AUTH_TOKEN_KEY);
     if (token) headers["Authorization"] = `Bearer ${token}`;
+    const body = JSON.stringify(result);
+    // Same result + same content => same key, so retries and repeated "Save" clicks don't create duplicates
+    headers["Idempotency-Key"] = await idempotencyKey(result.id, body);
     const res = await fetch(`${import.meta.env.VITE_API_URL || ''}/submit`, {
       method: "POST",
       headers,
-      body: JSON.stringify(result),
+      body,
     });
     if (!res.ok) return { ok: false };
     const data = await res.json();